@@ -1,24 +1,46 @@
-from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, WebSocket, WebSocketDisconnect, File, UploadFile
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, WebSocket, WebSocketDisconnect, File, UploadFile, Request, Response, Query
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.encoders import jsonable_encoder
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import re
+import hashlib
 import logging
 from pathlib import Path
+from contextlib import asynccontextmanager
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 import uuid
 from datetime import datetime, timezone, timedelta
 import jwt
+import typer
 from passlib.context import CryptContext
 import socketio
 import json
+import csv
+import codecs
+import math
+import heapq
+import bisect
+import unicodedata
 import asyncio
 from geopy.distance import geodesic
 import base64
+from urllib.parse import parse_qs
+from xml.sax.saxutils import escape as xml_escape
 import io
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import zstandard
+from pymongo import ReturnDocument, UpdateOne, InsertOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from bson import Binary
+from PIL import Image, ImageOps
 from reportlab.lib.pagesizes import A4
 from reportlab.lib import colors
 from reportlab.lib.units import cm
@@ -39,31 +61,153 @@ db = client[os.environ['DB_NAME']]
 # Security
 SECRET_KEY = os.environ.get('SECRET_KEY', 'vatrogasci_secret_key_2024')  # Za produkciju, SECRET_KEY MORA biti u .env!
 ALGORITHM = "HS256"
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+# Password hashing policy - calibrate against the server with `python server.py calibrate-hash`
+PASSWORD_HASH_SCHEME = os.environ.get('PASSWORD_HASH_SCHEME', 'bcrypt')  # bcrypt or argon2
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+ARGON2_TIME_COST = int(os.environ.get('ARGON2_TIME_COST', 3))
+ARGON2_MEMORY_COST = int(os.environ.get('ARGON2_MEMORY_COST', 65536))  # KiB
+ARGON2_PARALLELISM = int(os.environ.get('ARGON2_PARALLELISM', 4))
+
+def build_password_context(
+    scheme: str = PASSWORD_HASH_SCHEME,
+    bcrypt_rounds: int = BCRYPT_ROUNDS,
+    argon2_time_cost: int = ARGON2_TIME_COST,
+    argon2_memory_cost: int = ARGON2_MEMORY_COST,
+    argon2_parallelism: int = ARGON2_PARALLELISM,
+) -> CryptContext:
+    """Build the CryptContext for the configured policy.
+
+    Min and max rounds are pinned to the configured cost, so any stored hash made
+    with other parameters (or with a non-default scheme) reports needs_update and
+    gets rehashed on the next successful login.
+    """
+    if scheme not in ("bcrypt", "argon2"):
+        raise ValueError(f"Unsupported PASSWORD_HASH_SCHEME '{scheme}'")
+    schemes = [scheme] + [s for s in ("bcrypt",) if s != scheme]
+    settings = {
+        "bcrypt__default_rounds": bcrypt_rounds,
+        "bcrypt__min_rounds": bcrypt_rounds,
+        "bcrypt__max_rounds": bcrypt_rounds,
+    }
+    if scheme == "argon2":
+        settings.update({
+            "argon2__default_rounds": argon2_time_cost,
+            "argon2__min_rounds": argon2_time_cost,
+            "argon2__max_rounds": argon2_time_cost,
+            "argon2__memory_cost": argon2_memory_cost,
+            "argon2__parallelism": argon2_parallelism,
+        })
+    return CryptContext(schemes=schemes, default=scheme, deprecated="auto", **settings)
+
+pwd_context = build_password_context()
 security = HTTPBearer()
 
 # Socket.IO manager
 sio = socketio.AsyncServer(cors_allowed_origins="*", async_mode='asgi', logger=True, engineio_logger=True)
 
+# Shared process pool for CPU-bound work (password hashing etc.) - created lazily
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        workers = int(os.environ.get('WORKER_PROCESSES', os.cpu_count() or 2))
+        _process_pool = ProcessPoolExecutor(max_workers=workers)
+    return _process_pool
+
 # Active connections tracking - MUST be defined before event handlers
 active_connections: Dict[str, Dict] = {}
+presence_departures: Dict[str, datetime] = {}  # user_id -> when the user dropped off (for /api/sync deltas)
+PRESENCE_STALE_SECONDS = 60
+
+def prune_presence():
+    """Drop locations older than PRESENCE_STALE_SECONDS"""
+    cutoff_time = datetime.now(timezone.utc) - timedelta(seconds=PRESENCE_STALE_SECONDS)
+    for key, loc_data in list(active_connections.items()):
+        try:
+            loc_time = datetime.fromisoformat(loc_data['timestamp'].replace('Z', '+00:00'))
+            if loc_time > cutoff_time:
+                continue
+        except (KeyError, TypeError, ValueError):
+            pass
+        remove_presence(key)
+
+def remove_presence(key: str):
+    loc_data = active_connections.pop(key, None)
+    if loc_data and loc_data.get("user_id"):
+        presence_departures[loc_data["user_id"]] = datetime.now(timezone.utc)
+
+# Socket rooms: every socket joins user_<id> plus its department's chat groups,
+# named like chat group IDs ("<department>_all", "<department>_operational")
+def user_room(user_id: str) -> str:
+    return f"user_{user_id}"
+
+def chat_groups_for(department: str, is_operational: bool) -> List[str]:
+    """Group chats a member may read and post to"""
+    return [f"{department}_all"] + ([f"{department}_operational"] if is_operational else [])
+
+def socket_rooms_for(user: dict) -> List[str]:
+    return [user_room(user["id"])] + chat_groups_for(user["department"], user.get("is_operational", False))
+
+SOCKET_USER_FIELDS = {"_id": 0, "id": 1, "username": 1, "full_name": 1, "department": 1, "is_operational": 1}
+
+async def refresh_socket_rooms(user_id: str):
+    """Move the user's open sockets to the rooms matching their current department and role"""
+    user = await db.users.find_one({"id": user_id}, SOCKET_USER_FIELDS)
+    for sid, _ in list(sio.manager.get_participants('/', user_room(user_id))):
+        session = await sio.get_session(sid)
+        if user is None:
+            await sio.disconnect(sid)
+            continue
+        rooms = socket_rooms_for(user)
+        for room in set(session.get("rooms", [])) - set(rooms):
+            sio.leave_room(sid, room)
+        for room in rooms:
+            sio.enter_room(sid, room)
+        await sio.save_session(sid, {**user, "rooms": rooms})
+
+async def socket_user(environ: dict, auth) -> Optional[dict]:
+    """User for the JWT passed in the Socket.IO auth payload or ?token= query parameter"""
+    token = auth.get('token') if isinstance(auth, dict) else None
+    if not token:
+        token = (parse_qs(environ.get('QUERY_STRING', '')).get('token') or [None])[0]
+    if not token:
+        return None
+    if token.startswith('Bearer '):
+        token = token[len('Bearer '):]
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.PyJWTError:
+        return None
+    return await db.users.find_one({"username": payload.get("sub")}, SOCKET_USER_FIELDS)
 
 # ===== SOCKET.IO EVENT HANDLERS - REGISTER BEFORE socket_app =====
 print("🔧 Registering Socket.IO event handlers...")
 
 @sio.event
-async def connect(sid, environ):
+async def connect(sid, environ, auth=None):
     print(f"🔌 ========================================")
     print(f"🔌 CLIENT CONNECTED: {sid}")
     print(f"🔌 FROM IP: {environ.get('REMOTE_ADDR')}")
     print(f"🔌 ========================================")
+    user = await socket_user(environ, auth)
+    if user is None:
+        print(f"⛔ Socket {sid} odbijen: nedostaje ili neispravan token")
+        raise socketio.exceptions.ConnectionRefusedError('unauthorized')
+    rooms = socket_rooms_for(user)
+    await sio.save_session(sid, {**user, "rooms": rooms})
+    for room in rooms:
+        sio.enter_room(sid, room)
+    print(f"🔌 {user['username']} joined rooms: {rooms}")
     await sio.emit('connection_success', {'message': 'Successfully connected to server!'}, room=sid)
+    # Reconciliation snapshot: pushes missed while disconnected are not replayed
+    await sio.emit('unread_changed', {"unread_private": await get_unread_private(user['id'])}, room=sid)
 
 @sio.event
 async def disconnect(sid):
     print(f"❌ Client {sid} disconnected")
-    if sid in active_connections:
-        del active_connections[sid]
+    remove_presence(sid)
     await sio.emit('user_locations', list(active_connections.values()))
 
 @sio.event
@@ -153,6 +297,14 @@ async def ping_user(sid, data):
             'reason': 'User not online'
         }, room=sid)
 
+@sio.event
+async def message_ack(sid, data):
+    """Client confirms an alert reached the device"""
+    session = await sio.get_session(sid)
+    message_id = (data or {}).get('message_id')
+    if session and message_id:
+        await alert_dispatcher.acknowledge(message_id, session["id"])
+
 print("✅ Socket.IO event handlers registered!")
 # ===== END OF SOCKET.IO EVENT HANDLERS =====
 
@@ -212,9 +364,12 @@ class Hydrant(BaseModel):
     tip_hidranta: str = "nadzemni"  # NEW: podzemni, nadzemni
     last_check: Optional[datetime] = None
     notes: Optional[str] = None
-    images: List[str] = []  # NEW: List of image URLs/base64
+    images: List[str] = []  # Media store references (/api/media/<sha256>) or external URLs
     checked_by: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: Optional[datetime] = None
+    version: int = 0  # Monotonic change version for delta sync (/api/hydrants/changes)
+    dvd_area: Optional[str] = None  # DVD area the hydrant lies in (from dvd-podrucja.geojson)
 
 class HydrantCreate(BaseModel):
     latitude: float
@@ -223,7 +378,7 @@ class HydrantCreate(BaseModel):
     status: str = "working"
     tip_hidranta: str = "nadzemni"  # NEW
     notes: Optional[str] = None
-    images: Optional[List[str]] = []  # NEW: Images as base64 strings
+    images: Optional[List[str]] = []  # base64 data URLs are moved to the media store on write
 
 class HydrantUpdate(BaseModel):
     status: Optional[str] = None
@@ -245,6 +400,34 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+def verify_and_update_password(plain_password, hashed_password):
+    """Returns (valid, new_hash) - new_hash is set when the stored hash is outdated"""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+def calibrate_password_hash(target_ms: float, scheme: str = PASSWORD_HASH_SCHEME, samples: int = 3) -> List[dict]:
+    """Time each cost setting on this machine and mark the strongest one within target_ms"""
+    if scheme == "argon2":
+        candidates = [("argon2_time_cost", cost, build_password_context(scheme, argon2_time_cost=cost)) for cost in range(1, 11)]
+    else:
+        candidates = [("bcrypt_rounds", rounds, build_password_context("bcrypt", bcrypt_rounds=rounds)) for rounds in range(8, 17)]
+
+    results = []
+    for param, value, context in candidates:
+        timings = []
+        for _ in range(samples):
+            started = time.perf_counter()
+            context.hash("calibration-password")
+            timings.append((time.perf_counter() - started) * 1000)
+        median_ms = sorted(timings)[len(timings) // 2]
+        results.append({"param": param, "value": value, "ms": round(median_ms, 1), "recommended": False})
+        if median_ms > target_ms * 2:
+            break  # every further step only doubles the cost
+
+    within_budget = [r for r in results if r["ms"] <= target_ms]
+    if within_budget:
+        within_budget[-1]["recommended"] = True
+    return results
+
 # DVD and VZO role enums
 DVD_ROLES = [
     "clan_bez_funkcije",
@@ -374,24 +557,8 @@ async def update_location(data: dict, current_user: User = Depends(get_current_u
 async def get_active_locations(current_user: User = Depends(get_current_user)):
     """Get all active user locations"""
     # Remove stale locations (older than 60 seconds)
-    cutoff_time = datetime.now(timezone.utc) - timedelta(seconds=60)
-    
-    active_list = []
-    stale_keys = []
-    
-    for user_id, loc_data in active_connections.items():
-        try:
-            loc_time = datetime.fromisoformat(loc_data['timestamp'].replace('Z', '+00:00'))
-            if loc_time > cutoff_time:
-                active_list.append(loc_data)
-            else:
-                stale_keys.append(user_id)
-        except:
-            stale_keys.append(user_id)
-    
-    # Remove stale entries
-    for key in stale_keys:
-        del active_connections[key]
+    prune_presence()
+    active_list = list(active_connections.values())
     
     print(f"📥 Returning {len(active_list)} active users")
     return active_list
@@ -436,9 +603,19 @@ async def login(user_login: UserLogin):
             {"email": user_login.username}  # username field can contain email
         ]
     })
-    if not user or not verify_password(user_login.password, user["password"]):
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    
+    # Hashing is deliberately slow - keep it off the event loop
+    valid, new_hash = await asyncio.to_thread(verify_and_update_password, user_login.password, user["password"])
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
+    # Transparent rehash when the stored hash uses an outdated scheme or cost
+    if new_hash:
+        await db.users.update_one({"id": user["id"], "password": user["password"]}, {"$set": {"password": new_hash}})
+        print(f"🔐 Rehashed password for {user['username']} to current policy")
+    
     access_token = create_access_token(data={"sub": user["username"]})
     return {
         "access_token": access_token,
@@ -651,8 +828,10 @@ class ChatMessage(BaseModel):
     recipient_id: Optional[str] = None  # for private messages
     group_id: Optional[str] = None  # DVD department name for group chat
     content: str
-    read: bool = False
+    read: bool = False  # legacy flag, read state now lives in chat_read_state watermarks
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    conversation_id: Optional[str] = None  # "private:<id>:<id>" (sorted) or "group:<group_id>"
+    client_msg_id: Optional[str] = None  # idempotency key from the client, unique per sender
 
 # Chat message creation model (without sender_id/sender_name - set by backend)
 class ChatMessageCreate(BaseModel):
@@ -660,6 +839,14 @@ class ChatMessageCreate(BaseModel):
     recipient_id: Optional[str] = None  # for private messages
     group_id: Optional[str] = None  # DVD department name for group chat
     content: str
+    client_msg_id: Optional[str] = None  # retries with the same key return the stored message
+
+# Offline-queued messages replayed by the PWA in one request
+class ChatBatchItem(ChatMessageCreate):
+    client_msg_id: str
+
+class ChatBatchCreate(BaseModel):
+    messages: List[ChatBatchItem]
 
 # NEW: DVD Logo model (for managing department logos)
 class DvdLogo(BaseModel):
@@ -684,7 +871,7 @@ class Intervention(BaseModel):
     actions_taken: Optional[str] = None
     damage_assessment: Optional[str] = None
     casualties: Optional[str] = None
-    images: List[str] = []  # base64 encoded images
+    images: List[str] = []  # Media store references (/api/media/<sha256>)
     created_by: str  # user ID
     created_by_name: str
     status: str = "completed"  # in_progress, completed
@@ -751,6 +938,8 @@ async def update_user(user_id: str, user_update: UserUpdate, current_user: User
         update_data['medical_exam_valid_until'] = update_data['medical_exam_valid_until'].isoformat()
     
     await db.users.update_one({"id": user_id}, {"$set": update_data})
+    if 'department' in update_data or 'is_operational' in update_data:
+        await refresh_socket_rooms(user_id)
     return {"message": "User updated successfully"}
 
 @api_router.post("/users/{user_id}/reset-password")
@@ -778,6 +967,159 @@ async def reset_user_password(user_id: str, new_password: dict, current_user: Us
     
     return {"message": "Lozinka uspješno resetirana"}
 
+# ===== BULK MEMBER IMPORT =====
+
+USER_IMPORT_BATCH_SIZE = 200
+USER_IMPORT_REQUIRED_COLUMNS = ["username", "email", "full_name", "department", "password"]
+
+def _parse_bool(value) -> bool:
+    """Interpret spreadsheet booleans (da/ne, 1/0, true/false, x)"""
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in ("1", "true", "da", "yes", "y", "x")
+
+def _open_user_import_reader(upload: UploadFile):
+    """Return an iterator of DataFrame chunks for a CSV or XLSX upload"""
+    filename = (upload.filename or '').lower()
+    if filename.endswith(('.xlsx', '.xls')):
+        # Excel files can't be read incrementally - load once and slice into batches
+        frame = pd.read_excel(upload.file, dtype=str).fillna('')
+        return (frame.iloc[start:start + USER_IMPORT_BATCH_SIZE]
+                for start in range(0, len(frame), USER_IMPORT_BATCH_SIZE))
+    return pd.read_csv(upload.file, dtype=str, keep_default_na=False,
+                       chunksize=USER_IMPORT_BATCH_SIZE, sep=None, engine='python')
+
+def _validate_import_row(row: dict, current_user: User) -> tuple:
+    """Validate one import row, returns (UserCreate or None, list of errors)"""
+    errors = []
+    for column in USER_IMPORT_REQUIRED_COLUMNS:
+        if not str(row.get(column) or '').strip():
+            errors.append(f"Nedostaje '{column}'")
+    if errors:
+        return None, errors
+
+    user = UserCreate(
+        username=row['username'].strip(),
+        email=row['email'].strip().lower(),
+        password=row['password'],
+        full_name=row['full_name'].strip(),
+        department=row['department'].strip(),
+        role=(row.get('role') or '').strip() or "clan_bez_funkcije",
+        vzo_role=(row.get('vzo_role') or '').strip() or None,
+        is_operational=_parse_bool(row.get('is_operational')),
+    )
+    if len(user.password) < 6:
+        errors.append("Lozinka mora imati minimalno 6 znakova")
+    if '@' not in user.email:
+        errors.append(f"Neispravan email '{user.email}'")
+    if user.role not in DVD_ROLES:
+        errors.append(f"Nepoznata DVD funkcija '{user.role}'")
+    if user.vzo_role and user.vzo_role not in VZO_ROLES:
+        errors.append(f"Nepoznata VZO funkcija '{user.vzo_role}'")
+    if not has_vzo_full_access(current_user) and user.department != current_user.department:
+        errors.append("Možete uvoziti samo članove svog DVD-a")
+    return user, errors
+
+@api_router.post("/users/import")
+async def import_users(
+    file: UploadFile = File(...),
+    dry_run: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    """Bulk import members from CSV/XLSX - validates row by row and returns an error report"""
+    if not (has_vzo_full_access(current_user) or has_dvd_management_access(current_user)):
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    pool = get_process_pool()
+
+    seen_usernames, seen_emails = set(), set()
+    taken_vzo_roles = set(await db.users.distinct("vzo_role", {"vzo_role": {"$in": VZO_ROLES}}))
+    report = {"processed": 0, "valid": 0, "inserted": 0, "failed": 0, "errors": []}
+
+    def reject(row_number: int, username: str, errors: List[str]):
+        report["failed"] += 1
+        report["errors"].append({"row": row_number, "username": username, "errors": errors})
+
+    reader = await asyncio.to_thread(_open_user_import_reader, file)
+    row_number = 1  # header row
+    while True:
+        chunk = await asyncio.to_thread(next, reader, None)
+        if chunk is None:
+            break
+
+        candidates = []  # (row_number, UserCreate)
+        for row in chunk.to_dict(orient="records"):
+            row_number += 1
+            report["processed"] += 1
+            row = {str(k).strip().lower(): v for k, v in row.items()}
+            try:
+                user, errors = _validate_import_row(row, current_user)
+            except Exception as e:
+                user, errors = None, [str(e)]
+            username = user.username if user else str(row.get('username') or '')
+            if user:
+                if user.username in seen_usernames or user.email in seen_emails:
+                    errors.append("Duplikat unutar datoteke")
+                if user.vzo_role and user.vzo_role in taken_vzo_roles:
+                    errors.append(f"Funkcija '{user.vzo_role}' je već zauzeta")
+            if errors:
+                reject(row_number, username, errors)
+                continue
+            seen_usernames.add(user.username)
+            seen_emails.add(user.email)
+            if user.vzo_role:
+                taken_vzo_roles.add(user.vzo_role)
+            candidates.append((row_number, user))
+
+        if not candidates:
+            continue
+
+        # One query per batch for users that already exist
+        existing = await db.users.find(
+            {"$or": [
+                {"username": {"$in": [u.username for _, u in candidates]}},
+                {"email": {"$in": [u.email for _, u in candidates]}}
+            ]},
+            {"_id": 0, "username": 1, "email": 1}
+        ).to_list(length=None)
+        existing_usernames = {u.get("username") for u in existing}
+        existing_emails = {u.get("email") for u in existing}
+
+        batch = []
+        for number, user in candidates:
+            if user.username in existing_usernames or user.email in existing_emails:
+                reject(number, user.username, ["User already exists"])
+            else:
+                batch.append((number, user))
+        report["valid"] += len(batch)
+        if not batch or dry_run:
+            continue
+
+        # bcrypt is CPU bound - hash the whole batch in parallel worker processes
+        hashes = await asyncio.gather(*[
+            loop.run_in_executor(pool, get_password_hash, user.password) for _, user in batch
+        ])
+        documents = [
+            {**User(**user.dict(exclude={"password"})).dict(), "password": hashed}
+            for (_, user), hashed in zip(batch, hashes)
+        ]
+        try:
+            result = await db.users.insert_many(documents, ordered=False)
+            report["inserted"] += len(result.inserted_ids)
+        except BulkWriteError as e:
+            failed_indexes = {err["index"] for err in e.details.get("writeErrors", [])}
+            report["inserted"] += len(documents) - len(failed_indexes)
+            for err in e.details.get("writeErrors", []):
+                number, user = batch[err["index"]]
+                reject(number, user.username, [err.get("errmsg", "Write error")])
+
+    report["elapsed_ms"] = round((time.perf_counter() - started) * 1000)
+    report["dry_run"] = dry_run
+    print(f"📥 User import by {current_user.username}: {report['inserted']} inserted, {report['failed']} failed in {report['elapsed_ms']} ms")
+    return report
+
 # NEW: DVD Stations endpoints
 @api_router.get("/dvd-stations", response_model=List[DVDStation])
 async def get_dvd_stations(current_user: User = Depends(get_current_user)):
@@ -900,6 +1242,7 @@ async def create_equipment(equipment: Equipment, current_user: User = Depends(ge
         raise HTTPException(status_code=403, detail="Access denied")
     
     await db.equipment.insert_one(equipment.dict())
+    await index_search_document("equipment", equipment.dict())
     return equipment
 
 class EquipmentUpdate(BaseModel):
@@ -929,6 +1272,7 @@ async def update_equipment(equipment_id: str, equipment_update: EquipmentUpdate,
     result = await db.equipment.update_one({"id": equipment_id}, {"$set": update_data})
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Equipment not found")
+    await reindex_document("equipment", equipment_id)
     
     return {"message": "Equipment updated successfully"}
 
@@ -940,6 +1284,7 @@ async def delete_equipment(equipment_id: str, current_user: User = Depends(get_c
     result = await db.equipment.delete_one({"id": equipment_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Equipment not found")
+    await unindex_search_document("equipment", equipment_id)
     
     return {"message": "Equipment deleted successfully"}
 
@@ -1009,15 +1354,203 @@ async def delete_event(event_id: str, current_user: User = Depends(get_current_u
     return {"message": "Event deleted successfully"}
 
 # NEW: Messages endpoints (grupne poruke)
+# ===== ALERT DISPATCH =====
+# Alerts go through a priority queue drained by a few workers, so an urgent
+# alarm is emitted before queued routine notices. Each alert is sent only to
+# the <department>_all rooms it targets (every socket for "all"). A delivery
+# row is written per recipient and acked by the client's message_ack event;
+# send-to-ack latency per priority is kept in in-process histograms.
+
+ALERT_PRIORITIES = {"urgent": 0, "normal": 1, "low": 2}
+ALERT_DISPATCH_WORKERS = int(os.environ.get('ALERT_DISPATCH_WORKERS', 4))
+
+class LatencyHistogram:
+    BOUNDS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS_MS) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms: float):
+        self.counts[bisect.bisect_left(self.BOUNDS_MS, ms)] += 1
+        self.count += 1
+        self.sum_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-quantile"""
+        if not self.count:
+            return None
+        target, seen = q * self.count, 0
+        for bound, count in zip(self.BOUNDS_MS + (self.max_ms,), self.counts):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def snapshot(self) -> dict:
+        labels = [f"le_{b}" for b in self.BOUNDS_MS] + ["inf"]
+        return {
+            "count": self.count,
+            "avg_ms": round(self.sum_ms / self.count, 1) if self.count else None,
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "max_ms": round(self.max_ms, 1),
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+class AlertDispatcher:
+    def __init__(self, workers: int):
+        self.worker_count = workers
+        self.queue: Optional[asyncio.PriorityQueue] = None
+        self.workers: List[asyncio.Task] = []
+        self._sequence = 0
+        self.dispatched = 0
+        self.failed = 0
+        self.queue_wait = {p: LatencyHistogram() for p in ALERT_PRIORITIES}
+        self.ack_latency = {p: LatencyHistogram() for p in ALERT_PRIORITIES}
+
+    def start(self):
+        self.queue = asyncio.PriorityQueue()
+        self.workers = [asyncio.create_task(self._run()) for _ in range(self.worker_count)]
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    async def enqueue(self, message: Message):
+        # The sequence keeps FIFO order within a priority
+        self._sequence += 1
+        priority = ALERT_PRIORITIES.get(message.priority, ALERT_PRIORITIES["normal"])
+        await self.queue.put((priority, self._sequence, time.monotonic(), message))
+
+    async def _run(self):
+        while True:
+            _, _, enqueued_at, message = await self.queue.get()
+            try:
+                await self._dispatch(message, enqueued_at)
+                self.dispatched += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"❌ Alert dispatch failed for {message.id}: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def _dispatch(self, message: Message, enqueued_at: float):
+        departments = message.sent_to_departments
+        broadcast = "all" in departments
+        user_query = {} if broadcast else {"department": {"$in": departments}}
+        recipients = await db.users.find(user_query, {"_id": 0, "id": 1, "department": 1}).to_list(length=None)
+        priority = message.priority if message.priority in ALERT_PRIORITIES else "normal"
+        if recipients:
+            # Rows exist before the emit, so an ack can never arrive ahead of its row
+            dispatched_at = datetime.now(timezone.utc)
+            await db.message_deliveries.insert_many([{
+                "message_id": message.id,
+                "user_id": r["id"],
+                "department": r.get("department"),
+                "priority": priority,
+                "created_at": message.created_at,
+                "dispatched_at": dispatched_at,
+                "acked_at": None,
+            } for r in recipients], ordered=False)
+
+        payload = jsonable_encoder(message)
+        if broadcast:
+            await sio.emit('new_message', payload)
+        elif departments:
+            await sio.emit('new_message', payload, room=[f"{d}_all" for d in departments])
+        self.queue_wait[priority].observe((time.monotonic() - enqueued_at) * 1000)
+
+    async def acknowledge(self, message_id: str, user_id: str):
+        now = datetime.now(timezone.utc)
+        delivery = await db.message_deliveries.find_one_and_update(
+            {"message_id": message_id, "user_id": user_id, "acked_at": None},
+            {"$set": {"acked_at": now}},
+            projection={"_id": 0, "priority": 1, "created_at": 1}
+        )
+        if delivery:
+            created_at = delivery["created_at"]
+            if created_at.tzinfo is None:
+                created_at = created_at.replace(tzinfo=timezone.utc)
+            self.ack_latency[delivery["priority"]].observe((now - created_at).total_seconds() * 1000)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue.qsize() if self.queue else 0,
+            "workers": len(self.workers),
+            "dispatched": self.dispatched,
+            "failed": self.failed,
+            "queue_wait": {p: h.snapshot() for p, h in self.queue_wait.items()},
+            "send_to_ack": {p: h.snapshot() for p, h in self.ack_latency.items()},
+        }
+
+alert_dispatcher = AlertDispatcher(ALERT_DISPATCH_WORKERS)
+
+@api_router.get("/messages/dispatch-stats")
+async def get_alert_dispatch_stats(current_user: User = Depends(get_current_user)):
+    """Queue depth and latency histograms of this server process"""
+    if not (has_vzo_full_access(current_user) or has_dvd_management_access(current_user)):
+        raise HTTPException(status_code=403, detail="Access denied")
+    return alert_dispatcher.stats()
+
+@api_router.get("/messages/{message_id}/deliveries")
+async def get_message_deliveries(message_id: str, current_user: User = Depends(get_current_user)):
+    """Who has (not yet) acknowledged an alert"""
+    if not (has_vzo_full_access(current_user) or has_dvd_management_access(current_user)):
+        raise HTTPException(status_code=403, detail="Access denied")
+    deliveries = await db.message_deliveries.find(
+        {"message_id": message_id}, {"_id": 0, "user_id": 1, "department": 1, "dispatched_at": 1, "acked_at": 1}
+    ).to_list(length=None)
+    acked = [d for d in deliveries if d.get("acked_at")]
+    return {
+        "message_id": message_id,
+        "total": len(deliveries),
+        "acked": len(acked),
+        "pending": [d["user_id"] for d in deliveries if not d.get("acked_at")],
+        "deliveries": deliveries,
+    }
+
+MESSAGE_PAGE_SIZE = 50
+
 @api_router.get("/messages", response_model=List[Message])
-async def get_messages(current_user: User = Depends(get_current_user)):
-    # Return messages sent to user's department or to "all"
-    messages = await db.messages.find({
-        "$or": [
-            {"sent_to_departments": current_user.department},
-            {"sent_to_departments": "all"}
+async def get_messages(
+    response: Response,
+    before: Optional[str] = Query(None, description="X-Before-Cursor of the previous page - older messages"),
+    since: Optional[str] = Query(None, description="X-After-Cursor of the last refresh - only newer messages"),
+    limit: int = Query(MESSAGE_PAGE_SIZE, ge=1, le=500),
+    current_user: User = Depends(get_current_user)
+):
+    """Messages sent to user's department or to "all", newest first"""
+    if before and since:
+        raise HTTPException(status_code=400, detail="Koristite before ili since, ne oboje")
+    query = {"sent_to_departments": {"$in": [current_user.department, "all"]}}
+    if before or since:
+        created_at, message_id = decode_cursor(before or since)
+        op = "$gt" if since else "$lt"
+        query["$or"] = [
+            {"created_at": {op: created_at}},
+            {"created_at": created_at, "id": {op: message_id}},
         ]
-    }).to_list(1000)
+    # since= walks forward from the cursor so nothing between refreshes is skipped
+    direction = 1 if since else -1
+    messages = await db.messages.find(query, {"_id": 0}) \
+        .sort([("created_at", direction), ("id", direction)]).limit(limit + 1).to_list(length=None)
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    if since:
+        messages.reverse()
+
+    if messages:
+        response.headers["X-After-Cursor"] = encode_cursor(messages[0])
+        if has_more and not since:
+            response.headers["X-Before-Cursor"] = encode_cursor(messages[-1])
+    elif since:
+        response.headers["X-After-Cursor"] = since
     return [Message(**msg) for msg in messages]
 
 @api_router.post("/messages", response_model=Message)
@@ -1039,12 +1572,372 @@ async def send_message(message_create: MessageCreate, current_user: User = Depen
     )
     
     await db.messages.insert_one(message.dict())
+    await index_search_document("message", message.dict())
     
-    # Broadcast message via WebSocket
-    await sio.emit('new_message', message.dict())
+    # Fan-out happens in the alert dispatcher, urgent alerts first
+    await alert_dispatcher.enqueue(message)
     
     return message
 
+# ===== MEDIA STORE =====
+# Photos are stored once on disk under the SHA-256 of their content, so the same
+# image uploaded twice is kept once. Documents only hold references like
+# "/api/media/<sha256>", which the frontend can use directly as <img src>.
+
+MEDIA_ROOT = Path(os.environ.get('MEDIA_ROOT', ROOT_DIR / 'media'))
+MEDIA_URL_PREFIX = "/api/media/"
+MEDIA_CHUNK_SIZE = 64 * 1024
+MEDIA_CACHE_CONTROL = "public, max-age=31536000, immutable"
+MEDIA_ID_PATTERN = re.compile(r"[0-9a-f]{64}")
+MEDIA_MAX_BYTES = int(os.environ.get('MEDIA_MAX_BYTES', 15 * 1024 * 1024))
+MEDIA_MAX_FILES = 10
+# Whole multipart request; enforced while the body arrives, before it is spooled
+MEDIA_MAX_REQUEST_BYTES = int(os.environ.get('MEDIA_MAX_REQUEST_BYTES', MEDIA_MAX_FILES * MEDIA_MAX_BYTES + 64 * 1024))
+MEDIA_UPLOAD_PATH = re.compile(r"/api/(media|hydrants/[^/]+/photos|interventions/[^/]+/photos)/?")
+# Only raster formats Pillow can decode are stored; the type is taken from the
+# decoded image, never from the client. SVG and anything scriptable is refused.
+MEDIA_ALLOWED_FORMATS = {"JPEG": "image/jpeg", "PNG": "image/png", "GIF": "image/gif", "WEBP": "image/webp"}
+# Every media response is inert even if a stored file ever turns out hostile
+MEDIA_SECURITY_HEADERS = {"X-Content-Type-Options": "nosniff", "Content-Security-Policy": "sandbox"}
+
+def media_path(media_id: str) -> Path:
+    return MEDIA_ROOT / media_id[:2] / media_id[2:4] / media_id
+
+def media_ref(media_id: str) -> str:
+    return f"{MEDIA_URL_PREFIX}{media_id}"
+
+def media_id_from_ref(ref: str) -> Optional[str]:
+    if isinstance(ref, str) and ref.startswith(MEDIA_URL_PREFIX):
+        media_id = ref[len(MEDIA_URL_PREFIX):].split('?')[0]
+        if MEDIA_ID_PATTERN.fullmatch(media_id):
+            return media_id
+    return None
+
+def _write_media_file(media_id: str, data: bytes) -> bool:
+    """Atomically write a blob unless it already exists (dedup by content)"""
+    path = media_path(media_id)
+    if path.exists():
+        return False
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{media_id}.{uuid.uuid4().hex}.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+    return True
+
+async def register_media(media_id: str, content_type: str, size: int, uploaded_by: Optional[str]):
+    await db.media.update_one(
+        {"id": media_id},
+        {"$setOnInsert": {
+            "id": media_id,
+            "content_type": content_type,
+            "size": size,
+            "uploaded_by": uploaded_by,
+            "created_at": datetime.now(timezone.utc)
+        }},
+        upsert=True
+    )
+
+def _sniff_image_type(source) -> Optional[str]:
+    """Decode the header with Pillow and return the content type for allowed formats"""
+    try:
+        with Image.open(source) as image:
+            image.verify()
+            return MEDIA_ALLOWED_FORMATS.get(image.format)
+    except Exception:
+        return None
+
+def _media_too_large(filename: Optional[str] = None) -> HTTPException:
+    name = f"Slika {filename}" if filename else "Slika"
+    return HTTPException(status_code=413, detail=f"{name} je veća od {MEDIA_MAX_BYTES // (1024 * 1024)} MB")
+
+def _media_not_image(filename: Optional[str] = None) -> HTTPException:
+    detail = "Dozvoljene su samo slike JPEG, PNG, GIF i WebP"
+    return HTTPException(status_code=415, detail=f"{detail} ({filename})" if filename else detail)
+
+def _media_request_too_large() -> HTTPException:
+    return HTTPException(status_code=413,
+                         detail=f"Zahtjev je veći od {MEDIA_MAX_REQUEST_BYTES // (1024 * 1024)} MB")
+
+class MediaUploadLimitMiddleware:
+    """Refuse oversized photo uploads while they stream in.
+
+    Starlette spools the whole multipart body before the endpoint runs, so the
+    per-file check in store_media_upload alone would still accept any amount of
+    data. A declared Content-Length over the limit is refused before reading;
+    otherwise the body is counted as it arrives and the upload is cut off with
+    413 as soon as it crosses MEDIA_MAX_REQUEST_BYTES.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not MEDIA_UPLOAD_PATH.fullmatch(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+        declared = dict(scope["headers"]).get(b"content-length")
+        if declared and declared.isdigit() and int(declared) > MEDIA_MAX_REQUEST_BYTES:
+            error = _media_request_too_large()
+            response = JSONResponse({"detail": error.detail}, status_code=error.status_code,
+                                    headers={"Connection": "close"})
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > MEDIA_MAX_REQUEST_BYTES:
+                    # Raised inside request.form(); FastAPI re-raises HTTPExceptions from body parsing
+                    raise _media_request_too_large()
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+async def store_media_bytes(data: bytes, uploaded_by: Optional[str] = None) -> str:
+    if len(data) > MEDIA_MAX_BYTES:
+        raise _media_too_large()
+    content_type = await asyncio.to_thread(_sniff_image_type, io.BytesIO(data))
+    if content_type is None:
+        raise _media_not_image()
+    media_id = hashlib.sha256(data).hexdigest()
+    await asyncio.to_thread(_write_media_file, media_id, data)
+    await register_media(media_id, content_type, len(data), uploaded_by)
+    schedule_media_variants(media_id, content_type)
+    return media_id
+
+# Derived sizes (longest side in px). Rendered once per content hash in the
+# process pool, re-encoded as JPEG without EXIF (GPS, device data). Clients only
+# ever get a variant: the original keeps its EXIF block and stays on disk as the
+# source for re-rendering.
+MEDIA_VARIANTS = {"thumb": 200, "preview": 800, "full": 2048}
+MEDIA_DEFAULT_VARIANT = "full"
+MEDIA_VARIANT_QUALITY = 82
+_media_variant_jobs: Dict[str, asyncio.Future] = {}
+_background_tasks: set = set()
+
+def media_variant_path(media_id: str, variant: str) -> Path:
+    return MEDIA_ROOT / "variants" / media_id[:2] / f"{media_id}_{variant}.jpg"
+
+def _render_media_variants(source: str, targets: Dict[str, str]) -> Dict[str, int]:
+    """Worker process: decode the original once and write every variant"""
+    with Image.open(source) as original:
+        image = ImageOps.exif_transpose(original)  # bake in the rotation before EXIF is dropped
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        sizes = {}
+        for variant, target in sorted(targets.items(), key=lambda item: -MEDIA_VARIANTS[item[0]]):
+            max_side = MEDIA_VARIANTS[variant]
+            image.thumbnail((max_side, max_side), Image.LANCZOS)  # largest first, each step shrinks further
+            Path(target).parent.mkdir(parents=True, exist_ok=True)
+            tmp_target = f"{target}.{os.getpid()}.tmp"
+            image.save(tmp_target, "JPEG", quality=MEDIA_VARIANT_QUALITY, optimize=True, progressive=True)
+            os.replace(tmp_target, target)
+            sizes[variant] = os.path.getsize(target)
+    return sizes
+
+async def ensure_media_variants(media_id: str) -> bool:
+    """Render missing variants once per media id; concurrent callers share the job"""
+    targets = {variant: str(media_variant_path(media_id, variant)) for variant in MEDIA_VARIANTS}
+    if all(os.path.exists(t) for t in targets.values()):
+        return True
+    job = _media_variant_jobs.get(media_id)
+    if job is None:
+        loop = asyncio.get_running_loop()
+        job = loop.run_in_executor(get_process_pool(), _render_media_variants, str(media_path(media_id)), targets)
+        _media_variant_jobs[media_id] = job
+        job.add_done_callback(lambda _: _media_variant_jobs.pop(media_id, None))
+    try:
+        await asyncio.shield(job)
+        return True
+    except Exception as e:
+        print(f"⚠️ Could not render variants for media {media_id}: {e}")
+        return False
+
+def schedule_media_variants(media_id: str, content_type: str):
+    """Pre-render variants in the background right after an upload"""
+    if content_type not in MEDIA_ALLOWED_FORMATS.values():
+        return
+    task = asyncio.create_task(ensure_media_variants(media_id))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+def _decode_data_url(value: str) -> bytes:
+    """data:image/jpeg;base64,/9j/... -> bytes. The declared type is ignored, the
+    store sniffs the decoded image instead."""
+    header, _, payload = value.partition(',')
+    if not header.endswith(';base64'):
+        raise ValueError("Only base64 data URLs are supported")
+    if len(payload) * 3 // 4 > MEDIA_MAX_BYTES + 3:
+        raise _media_too_large()  # refuse before allocating the decoded copy
+    return base64.b64decode(payload, validate=True)
+
+async def externalize_images(images: Optional[List[str]], uploaded_by: Optional[str] = None) -> List[str]:
+    """Move inline base64 images to the media store and return references"""
+    refs = []
+    for image in images or []:
+        if not isinstance(image, str):
+            raise HTTPException(status_code=400, detail="Neispravan format slike")
+        if image.startswith('data:'):
+            try:
+                data = _decode_data_url(image)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Neispravan format slike")
+            refs.append(media_ref(await store_media_bytes(data, uploaded_by)))
+        elif media_id_from_ref(image) or image.startswith(('https://', 'http://')):
+            refs.append(image)  # already a media reference or an external URL
+        else:
+            raise HTTPException(status_code=400, detail="Neispravan format slike")
+    return refs
+
+def _parse_range_header(range_header: str, size: int) -> Optional[tuple]:
+    """Parse a single 'bytes=start-end' range. Returns None for unsatisfiable ranges."""
+    unit, _, spec = range_header.partition('=')
+    if unit.strip() != 'bytes' or ',' in spec:
+        raise ValueError("Only single byte ranges are supported")
+    start_text, _, end_text = spec.strip().partition('-')
+    if start_text:
+        start = int(start_text)
+        end = int(end_text) if end_text else size - 1
+    else:
+        # Suffix range: last N bytes
+        length = int(end_text)
+        if length <= 0:
+            return None
+        start, end = max(size - length, 0), size - 1
+    end = min(end, size - 1)
+    if start > end or start >= size:
+        return None
+    return start, end
+
+def _iter_file_range(path: Path, start: int, end: int):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(MEDIA_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+def media_file_response(request: Request, path: Path, content_type: str, etag: str):
+    """Stream a file with ETag / conditional GET, long-lived caching and Range support"""
+    headers = {"ETag": etag, "Cache-Control": MEDIA_CACHE_CONTROL, "Accept-Ranges": "bytes", **MEDIA_SECURITY_HEADERS}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(',')]):
+        return Response(status_code=304, headers=headers)
+
+    size = path.stat().st_size
+    start, end, status_code = 0, size - 1, 200
+    range_header = request.headers.get("range")
+    if range_header and size > 0:
+        try:
+            byte_range = _parse_range_header(range_header, size)
+        except ValueError:
+            byte_range = (0, size - 1)  # ignore ranges we don't support and send the whole file
+        if byte_range is None:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        start, end = byte_range
+        if (start, end) != (0, size - 1):
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    headers["Content-Length"] = str(end - start + 1 if size else 0)
+    return StreamingResponse(_iter_file_range(path, start, end), status_code=status_code,
+                             media_type=content_type, headers=headers)
+
+@api_router.get("/media/{media_id}")
+async def get_media(
+    media_id: str,
+    request: Request,
+    size: str = Query(MEDIA_DEFAULT_VARIANT, description="thumb, preview or full")
+):
+    """Serve a stored photo - public like dvd-logos because <img> tags can't send
+    the bearer token; ids are content hashes and can't be enumerated"""
+    if not MEDIA_ID_PATTERN.fullmatch(media_id):
+        raise HTTPException(status_code=404, detail="Media not found")
+    if size not in MEDIA_VARIANTS:
+        raise HTTPException(status_code=400, detail=f"Nepoznata veličina '{size}'")
+    meta = await db.media.find_one({"id": media_id}, {"_id": 0, "content_type": 1})
+    path = media_path(media_id)
+    if not meta or not path.exists():
+        raise HTTPException(status_code=404, detail="Media not found")
+
+    variant_path = media_variant_path(media_id, size)
+    if variant_path.exists() or await ensure_media_variants(media_id):
+        return media_file_response(request, variant_path, "image/jpeg", f'"{media_id}-{size}"')
+    if meta["content_type"] not in MEDIA_ALLOWED_FORMATS.values():
+        # Stored before types were sniffed and not an image - download only, never inline
+        return media_file_response(request, path, "application/octet-stream", f'"{media_id}"')
+    # Undecodable image - its metadata can't be stripped, so the original isn't served either
+    raise HTTPException(status_code=415, detail="Slika se ne može obraditi")
+
+def _finalize_media_file(tmp_path: Path, media_id: str):
+    path = media_path(media_id)
+    if path.exists():
+        tmp_path.unlink(missing_ok=True)  # same content already stored
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(tmp_path, path)
+
+async def store_media_upload(upload: UploadFile, uploaded_by: Optional[str] = None) -> dict:
+    """Stream a multipart upload to disk in chunks, hashing as it goes"""
+    tmp_dir = MEDIA_ROOT / "tmp"
+    await asyncio.to_thread(tmp_dir.mkdir, parents=True, exist_ok=True)
+    tmp_path = tmp_dir / f"{uuid.uuid4().hex}.upload"
+    digest, size = hashlib.sha256(), 0
+    try:
+        with open(tmp_path, 'wb') as out:
+            while chunk := await upload.read(MEDIA_CHUNK_SIZE):
+                size += len(chunk)
+                if size > MEDIA_MAX_BYTES:
+                    raise _media_too_large(upload.filename)
+                digest.update(chunk)
+                await asyncio.to_thread(out.write, chunk)
+        # The client's Content-Type is only a hint - the stored type is what Pillow decodes
+        content_type = await asyncio.to_thread(_sniff_image_type, tmp_path)
+        if content_type is None:
+            raise _media_not_image(upload.filename)
+        media_id = digest.hexdigest()
+        await asyncio.to_thread(_finalize_media_file, tmp_path, media_id)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+    await register_media(media_id, content_type, size, uploaded_by)
+    schedule_media_variants(media_id, content_type)
+    return {"id": media_id, "url": media_ref(media_id), "size": size, "content_type": content_type}
+
+async def store_media_uploads(files: List[UploadFile], uploaded_by: Optional[str]) -> List[dict]:
+    if len(files) > MEDIA_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"Najviše {MEDIA_MAX_FILES} slika odjednom")
+    return [await store_media_upload(f, uploaded_by) for f in files]
+
+@api_router.post("/media")
+async def upload_media(files: List[UploadFile] = File(...), current_user: User = Depends(get_current_user)):
+    """Upload photos before the hydrant/intervention exists - returns media ids and urls"""
+    return await store_media_uploads(files, current_user.id)
+
+async def migrate_inline_images() -> dict:
+    """Move base64 images already stored in hydrants and interventions to the media store"""
+    migrated = {}
+    for collection in (db.hydrants, db.interventions):
+        count = 0
+        async for doc in collection.find({"images": {"$regex": "^data:"}}, {"_id": 0, "id": 1, "images": 1}):
+            try:
+                refs = await externalize_images(doc["images"])
+            except HTTPException as e:
+                print(f"⚠️ {collection.name} {doc['id']}: slike nisu premještene ({e.detail})")
+                continue
+            await collection.update_one({"id": doc["id"]}, {"$set": {"images": refs}})
+            count += 1
+        migrated[collection.name] = count
+    return migrated
+
 # NEW: Intervention/Incident Reports endpoints
 @api_router.get("/interventions", response_model=List[Intervention])
 async def get_interventions(current_user: User = Depends(get_current_user)):
@@ -1060,7 +1953,9 @@ async def create_intervention(intervention: Intervention, current_user: User = D
     intervention.created_by = current_user.id
     intervention.created_by_name = current_user.full_name
     intervention.created_at = datetime.now(timezone.utc)
+    intervention.images = await externalize_images(intervention.images, current_user.id)
     await db.interventions.insert_one(intervention.dict())
+    await index_search_document("intervention", intervention.dict())
     return intervention
 
 class InterventionUpdate(BaseModel):
@@ -1084,10 +1979,13 @@ class InterventionUpdate(BaseModel):
 async def update_intervention(intervention_id: str, intervention_update: InterventionUpdate, current_user: User = Depends(get_current_user)):
     update_data = {k: v for k, v in intervention_update.dict().items() if v is not None}
     update_data['updated_at'] = datetime.now(timezone.utc)
+    if 'images' in update_data:
+        update_data['images'] = await externalize_images(update_data['images'], current_user.id)
     
     result = await db.interventions.update_one({"id": intervention_id}, {"$set": update_data})
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Intervention not found")
+    await reindex_document("intervention", intervention_id)
     
     return {"message": "Intervention updated successfully"}
 
@@ -1099,58 +1997,542 @@ async def delete_intervention(intervention_id: str, current_user: User = Depends
     result = await db.interventions.delete_one({"id": intervention_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Intervention not found")
+    await unindex_search_document("intervention", intervention_id)
     
     return {"message": "Intervention deleted successfully"}
 
+@api_router.post("/interventions/{intervention_id}/photos")
+async def upload_intervention_photos(
+    intervention_id: str,
+    files: List[UploadFile] = File(...),
+    current_user: User = Depends(get_current_user)
+):
+    """Attach photos to an intervention report (multipart/form-data)"""
+    if not await db.interventions.find_one({"id": intervention_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Intervention not found")
+    media = await store_media_uploads(files, current_user.id)
+    await db.interventions.update_one(
+        {"id": intervention_id},
+        {"$push": {"images": {"$each": [m["url"] for m in media]}},
+         "$set": {"updated_at": datetime.now(timezone.utc)}}
+    )
+    return media
+
+# ===== CHAT HISTORY PAGINATION =====
+# History is read newest-first on (created_at, id) and returned oldest-first.
+# Cursors are opaque to clients; the page boundaries come back in the
+# X-Before-Cursor / X-After-Cursor response headers.
+
+CHAT_PAGE_SIZE = 100
+CHAT_PAGE_MAX = 500
+CHAT_CURSOR_HEADERS = ["X-Before-Cursor", "X-After-Cursor"]
+
+def chat_conversation_id(chat_type: str, sender_id: str, recipient_id: Optional[str] = None,
+                         group_id: Optional[str] = None) -> str:
+    if chat_type == "private":
+        return "private:" + ":".join(sorted([sender_id, recipient_id or ""]))
+    return f"group:{group_id}"
+
+def encode_cursor(message: dict) -> str:
+    created_at = message["created_at"]
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+    raw = f"{created_at.isoformat()}|{message['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, message_id = raw.split("|", 1)
+        return datetime.fromisoformat(created_at), message_id
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Neispravan kursor")
+
+async def fetch_chat_page(query: dict, conversation_id: str, response: Response, before: Optional[str],
+                          after: Optional[str], limit: int) -> tuple:
+    """One page of chat messages oldest-first; without a cursor, the newest page.
+    Returns (messages, reached_newest) - whether nothing newer exists past the page."""
+    if before and after:
+        raise HTTPException(status_code=400, detail="Koristite before ili after, ne oboje")
+    direction = 1 if after else -1
+    keyset = None
+    if before or after:
+        keyset = decode_cursor(before or after)
+        created_at, message_id = keyset
+        op = "$gt" if after else "$lt"
+        query = {**query, "$or": [
+            {"created_at": {op: created_at}},
+            {"created_at": created_at, "id": {op: message_id}},
+        ]}
+    messages = await db.chat_messages.find(query, {"_id": 0}) \
+        .sort([("created_at", direction), ("id", direction)]).limit(limit + 1).to_list(length=None)
+
+    # Archived messages are older than everything still in chat_messages: a backward
+    # page continues into the archive, a forward page from an old cursor starts there
+    if direction == -1 and len(messages) <= limit:
+        messages += await read_chat_archive(conversation_id, direction, keyset, limit + 1 - len(messages))
+    elif direction == 1:
+        archived = await read_chat_archive(conversation_id, direction, keyset, limit + 1)
+        messages = (archived + messages)[:limit + 1]
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    if direction == -1:
+        messages.reverse()
+
+    if messages:
+        # Older history exists past a full backward page, and always behind a forward page
+        if has_more or after:
+            response.headers["X-Before-Cursor"] = encode_cursor(messages[0])
+        response.headers["X-After-Cursor"] = encode_cursor(messages[-1])
+    elif after:
+        response.headers["X-After-Cursor"] = after
+    reached_newest = not has_more if after else not before
+    return messages, reached_newest
+
+# ===== CHAT ARCHIVE =====
+# Messages older than CHAT_ARCHIVE_AFTER_DAYS move out of chat_messages into
+# chat_archive: one document per conversation and month (split every
+# CHAT_ARCHIVE_BATCH_SIZE messages) holding the messages as zstd-compressed
+# JSON. The archiver always takes the oldest messages of a conversation, so
+# archived batches never overlap and are all older than the hot collection.
+
+CHAT_ARCHIVE_AFTER_DAYS = int(os.environ.get('CHAT_ARCHIVE_AFTER_DAYS', 180))  # 0 disables the archiver
+CHAT_ARCHIVE_INTERVAL_S = int(os.environ.get('CHAT_ARCHIVE_INTERVAL_S', 3600))
+CHAT_ARCHIVE_BATCH_SIZE = 1000
+CHAT_ARCHIVE_RUN_SIZE = 5000
+CHAT_ARCHIVE_ZSTD_LEVEL = 10
+
+def _pack_chat_batch(messages: List[dict]) -> bytes:
+    rows = [{**m, "created_at": m["created_at"].isoformat()} for m in messages]
+    raw = json.dumps(rows, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return zstandard.ZstdCompressor(level=CHAT_ARCHIVE_ZSTD_LEVEL).compress(raw)
+
+def _unpack_chat_batch(data: bytes) -> List[dict]:
+    rows = json.loads(zstandard.ZstdDecompressor().decompress(data))
+    for row in rows:
+        row["created_at"] = datetime.fromisoformat(row["created_at"])
+    return rows
+
+async def archive_chat_messages(older_than_days: int = CHAT_ARCHIVE_AFTER_DAYS) -> int:
+    """Move old messages into compressed monthly batches; returns the number moved"""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    moved = 0
+    while True:
+        messages = await db.chat_messages.find(
+            {"created_at": {"$lt": cutoff}, "conversation_id": {"$type": "string"}}, {"_id": 0}
+        ).sort([("conversation_id", 1), ("created_at", 1), ("id", 1)]).limit(CHAT_ARCHIVE_RUN_SIZE).to_list(length=None)
+        if not messages:
+            return moved
+
+        batches: List[List[dict]] = []
+        for message in messages:
+            key = (message["conversation_id"], message["created_at"].strftime('%Y-%m'))
+            last = batches[-1] if batches else None
+            if last and (last[0]["conversation_id"], last[0]["created_at"].strftime('%Y-%m')) == key \
+                    and len(last) < CHAT_ARCHIVE_BATCH_SIZE:
+                last.append(message)
+            else:
+                batches.append([message])
+
+        for batch in batches:
+            first, last = batch[0], batch[-1]
+            data = await asyncio.to_thread(_pack_chat_batch, batch)
+            # Deterministic _id: a run interrupted before the delete rewrites the same batch
+            await db.chat_archive.replace_one(
+                {"_id": f"{first['conversation_id']}|{first['created_at'].strftime('%Y-%m')}|{first['id']}"},
+                {
+                    "conversation_id": first["conversation_id"],
+                    "month": first["created_at"].strftime('%Y-%m'),
+                    "first_at": first["created_at"],
+                    "last_at": last["created_at"],
+                    "count": len(batch),
+                    "codec": "zstd",
+                    "data": Binary(data),
+                },
+                upsert=True
+            )
+        await db.chat_messages.delete_many({"id": {"$in": [m["id"] for m in messages]}})
+        moved += len(messages)
+
+async def read_chat_archive(conversation_id: str, direction: int, keyset: Optional[tuple], need: int) -> List[dict]:
+    """Archived messages past the keyset in page order (direction -1: newest first)"""
+    query = {"conversation_id": conversation_id}
+    if direction == -1:
+        if keyset:
+            query["first_at"] = {"$lte": keyset[0]}
+        batches = db.chat_archive.find(query).sort("last_at", -1)
+    else:
+        query["last_at"] = {"$gte": keyset[0]}
+        batches = db.chat_archive.find(query).sort("first_at", 1)
+    found = []
+    async for batch in batches:
+        messages = await asyncio.to_thread(_unpack_chat_batch, batch["data"])
+        if direction == -1:
+            messages.reverse()
+        for message in messages:
+            position = (message["created_at"], message["id"])
+            if keyset and (position >= keyset if direction == -1 else position <= keyset):
+                continue
+            found.append(message)
+            if len(found) >= need:
+                return found
+    return found
+
+async def chat_archiver_loop():
+    while True:
+        try:
+            moved = await archive_chat_messages()
+            if moved:
+                print(f"🗄️ Chat archiver moved {moved} messages older than {CHAT_ARCHIVE_AFTER_DAYS} days")
+        except Exception as e:
+            print(f"❌ Chat archiver failed: {e}")
+        await asyncio.sleep(CHAT_ARCHIVE_INTERVAL_S)
+
+# ===== CHAT READ WATERMARKS =====
+# Read state is one document per (user, conversation) holding the created_at of
+# the newest message the user has seen. Everything after it from someone else
+# is unread, which the (conversation_id, created_at) index answers as a range.
+
+def _read_state_id(user_id: str, conversation_id: str) -> str:
+    return f"{user_id}|{conversation_id}"
+
+async def mark_conversation_read(user_id: str, conversation_id: str, last_read_at: datetime) -> Optional[datetime]:
+    """Advance the watermark; returns the previous one (None if the conversation was never read)"""
+    before = await db.chat_read_state.find_one_and_update(
+        {"_id": _read_state_id(user_id, conversation_id)},
+        {"$max": {"last_read_at": last_read_at},
+         "$setOnInsert": {"user_id": user_id, "conversation_id": conversation_id}},
+        upsert=True,
+        return_document=ReturnDocument.BEFORE
+    )
+    return before.get("last_read_at") if before else None
+
+async def count_acknowledged(user_id: str, conversation_id: str, previous: Optional[datetime], last_read_at: datetime) -> int:
+    """Messages from others that moving the watermark from previous to last_read_at marked as read"""
+    window = {"$lte": last_read_at}
+    if previous is not None:
+        window["$gt"] = previous
+    return await db.chat_messages.count_documents(
+        {"conversation_id": conversation_id, "sender_id": {"$ne": user_id}, "created_at": window}
+    )
+
+async def count_unread(user_id: str, conversation_id: str) -> int:
+    state = await db.chat_read_state.find_one({"_id": _read_state_id(user_id, conversation_id)}, {"last_read_at": 1})
+    query = {"conversation_id": conversation_id, "sender_id": {"$ne": user_id}}
+    if state:
+        query["created_at"] = {"$gt": state["last_read_at"]}
+    return await db.chat_messages.count_documents(query)
+
+async def backfill_read_watermarks():
+    """Seed watermarks from the legacy per-message read flags"""
+    pipeline = [
+        {"$match": {"chat_type": "private", "read": True, "recipient_id": {"$ne": None}}},
+        {"$group": {"_id": {"user": "$recipient_id", "conversation": "$conversation_id"},
+                    "last_read_at": {"$max": "$created_at"}}},
+    ]
+    # Upserts with $max: safe to run on several workers at once and never move
+    # a watermark the user has already advanced back
+    states = [
+        UpdateOne(
+            {"_id": _read_state_id(row["_id"]["user"], row["_id"]["conversation"])},
+            {"$max": {"last_read_at": row["last_read_at"]},
+             "$setOnInsert": {"user_id": row["_id"]["user"], "conversation_id": row["_id"]["conversation"]}},
+            upsert=True
+        )
+        async for row in db.chat_messages.aggregate(pipeline)
+    ]
+    if states:
+        await db.chat_read_state.bulk_write(states, ordered=False)
+    print(f"📖 Read watermarks seeded for {len(states)} conversations")
+
+# ===== UNREAD COUNTERS =====
+# One document per user: {_id: user_id, private: total, by_sender: {sender_id: n}}.
+# Sending a private message increments it; opening the conversation subtracts
+# the messages its read watermark just moved past, so a message that arrives
+# meanwhile stays counted. Both are single atomic updates and the new total is
+# pushed to the user's room as unread_changed.
+
+async def push_unread(user_id: str, unread_private: int):
+    await sio.emit('unread_changed', {"unread_private": unread_private}, room=user_room(user_id))
+
+async def increment_unread(recipient_id: str, sender_id: str):
+    counters = await db.unread_counters.find_one_and_update(
+        {"_id": recipient_id},
+        {"$inc": {"private": 1, f"by_sender.{sender_id}": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    await push_unread(recipient_id, counters["private"])
+
+async def clear_unread(user_id: str, sender_id: str, count: int):
+    """Take count read messages off the sender's share (never below zero)"""
+    field = f"by_sender.{sender_id}"
+    after = await db.unread_counters.find_one_and_update(
+        {"_id": user_id, field: {"$gt": 0}},
+        [
+            {"$set": {"_read": {"$min": [count, f"${field}"]}}},
+            {"$set": {"private": {"$max": [{"$subtract": ["$private", "$_read"]}, 0]},
+                      field: {"$subtract": [f"${field}", "$_read"]}}},
+            {"$unset": "_read"},
+        ],
+        return_document=ReturnDocument.AFTER
+    )
+    if after:
+        await push_unread(user_id, after["private"])
+
+async def get_unread_private(user_id: str) -> int:
+    counters = await db.unread_counters.find_one({"_id": user_id}, {"private": 1})
+    return max((counters or {}).get("private", 0), 0)
+
+async def rebuild_unread_counters():
+    """Recount unread private messages per recipient against the read watermarks"""
+    pipeline = [
+        {"$match": {"chat_type": "private", "recipient_id": {"$ne": None}}},
+        {"$group": {"_id": {"recipient": "$recipient_id", "sender": "$sender_id", "conversation": "$conversation_id"}}},
+    ]
+    counters: Dict[str, dict] = {}
+    async for row in db.chat_messages.aggregate(pipeline):
+        recipient, sender = row["_id"]["recipient"], row["_id"]["sender"]
+        if recipient == sender:
+            continue
+        count = await count_unread(recipient, row["_id"]["conversation"])
+        if count:
+            doc = counters.setdefault(recipient, {"private": 0, "by_sender": {}})
+            doc["private"] += count
+            doc["by_sender"][sender] = count
+    await db.unread_counters.delete_many({})
+    if counters:
+        await db.unread_counters.bulk_write([
+            UpdateOne({"_id": user_id}, {"$set": doc}, upsert=True) for user_id, doc in counters.items()
+        ], ordered=False)
+    print(f"📬 Unread counters rebuilt for {len(counters)} users")
+
+# ===== CONVERSATION LIST =====
+# One document per private conversation, written on every send:
+# {_id: conversation_id, participants, last_message (preview), last_message_at,
+#  unread: {user_id: n}}. The conversation list is one sorted read over it.
+
+CHAT_PREVIEW_LENGTH = 120
+
+async def touch_conversation(message: ChatMessage):
+    preview = {
+        "id": message.id,
+        "sender_id": message.sender_id,
+        "sender_name": message.sender_name,
+        "content": message.content[:CHAT_PREVIEW_LENGTH],
+        "created_at": message.created_at,
+    }
+    unread_field = f"unread.{message.recipient_id}"
+    # Pipeline update so a send that lands late never replaces a newer preview
+    is_newer = {"$gt": [message.created_at, {"$ifNull": ["$last_message_at", datetime.min]}]}
+    await db.conversations.update_one(
+        {"_id": message.conversation_id},
+        [{"$set": {
+            "participants": {"$literal": sorted([message.sender_id, message.recipient_id])},
+            "last_message": {"$cond": [is_newer, {"$literal": preview}, "$last_message"]},
+            "last_message_at": {"$cond": [is_newer, message.created_at, "$last_message_at"]},
+            unread_field: {"$add": [{"$ifNull": [f"${unread_field}", 0]}, 1]},
+        }}],
+        upsert=True
+    )
+
+async def reset_conversation_unread(user_id: str, conversation_id: str):
+    await db.conversations.update_one(
+        {"_id": conversation_id, f"unread.{user_id}": {"$gt": 0}},
+        {"$set": {f"unread.{user_id}": 0}}
+    )
+
+async def rebuild_conversations():
+    """Materialize the conversation list from chat_messages"""
+    pipeline = [
+        {"$match": {"chat_type": "private", "conversation_id": {"$type": "string"}}},
+        {"$sort": {"created_at": 1, "id": 1}},
+        {"$group": {
+            "_id": "$conversation_id",
+            "last": {"$last": "$$ROOT"},
+            "senders": {"$addToSet": "$sender_id"},
+            "recipients": {"$addToSet": "$recipient_id"},
+        }},
+    ]
+    conversations = []
+    async for row in db.chat_messages.aggregate(pipeline, allowDiskUse=True):
+        participants = sorted({p for p in row["senders"] + row["recipients"] if p})
+        last = row["last"]
+        conversations.append(UpdateOne({"_id": row["_id"]}, {"$set": {
+            "participants": participants,
+            "last_message": {
+                "id": last["id"],
+                "sender_id": last["sender_id"],
+                "sender_name": last.get("sender_name"),
+                "content": (last.get("content") or "")[:CHAT_PREVIEW_LENGTH],
+                "created_at": last["created_at"],
+            },
+            "last_message_at": last["created_at"],
+            "unread": {p: await count_unread(p, row["_id"]) for p in participants},
+        }}, upsert=True))
+    await db.conversations.delete_many({})
+    if conversations:
+        await db.conversations.bulk_write(conversations, ordered=False)
+    print(f"💬 Conversation list rebuilt: {len(conversations)} conversations")
+
+def chat_message_rooms(message: ChatMessage) -> List[str]:
+    if message.chat_type == "private":
+        return [user_room(message.recipient_id), user_room(message.sender_id)]
+    return [message.group_id]
+
 # NEW: Chat/Communication endpoints
-@api_router.post("/chat/send", response_model=ChatMessage)
-async def send_chat_message(message_create: ChatMessageCreate, current_user: User = Depends(get_current_user)):
-    """Send a private or group chat message"""
-    # Create full message with sender info
-    message = ChatMessage(
+CHAT_BATCH_MAX = 100
+
+def check_chat_target(message_create: ChatMessageCreate, sender: User):
+    """Group messages only go to the sender's own department groups; group_id doubles as the socket room"""
+    if message_create.chat_type == "group":
+        if message_create.group_id not in chat_groups_for(sender.department, sender.is_operational):
+            raise HTTPException(status_code=403, detail="Nemate pristup ovoj grupi")
+    elif message_create.chat_type == "private":
+        if not message_create.recipient_id:
+            raise HTTPException(status_code=400, detail="Primatelj je obavezan za privatnu poruku")
+    else:
+        raise HTTPException(status_code=400, detail="Nepoznata vrsta poruke")
+
+def build_chat_message(message_create: ChatMessageCreate, sender: User, created_at: datetime) -> ChatMessage:
+    return ChatMessage(
         chat_type=message_create.chat_type,
-        sender_id=current_user.id,
-        sender_name=current_user.full_name,
+        sender_id=sender.id,
+        sender_name=sender.full_name,
         recipient_id=message_create.recipient_id,
         group_id=message_create.group_id,
         content=message_create.content,
         read=False,
-        created_at=datetime.now(timezone.utc)
+        created_at=created_at,
+        conversation_id=chat_conversation_id(message_create.chat_type, sender.id,
+                                             message_create.recipient_id, message_create.group_id),
+        client_msg_id=message_create.client_msg_id
     )
-    
-    await db.chat_messages.insert_one(message.dict())
-    
-    # Broadcast via WebSocket for real-time
-    await sio.emit('new_chat_message', message.dict())
-    
+
+async def publish_chat_message(message: ChatMessage):
+    """Side effects of a newly stored message: search, push, conversation list, unread counters"""
+    await index_search_document("chat", message.dict())
+    # Push only to the recipients: both participants' sockets, or the group room
+    await sio.emit('new_chat_message', jsonable_encoder(message), room=chat_message_rooms(message))
+    if message.chat_type == "private" and message.recipient_id and message.recipient_id != message.sender_id:
+        await touch_conversation(message)
+        await increment_unread(message.recipient_id, message.sender_id)
+
+async def find_client_messages(sender_id: str, client_msg_ids: List[str]) -> Dict[str, dict]:
+    stored = await db.chat_messages.find(
+        {"sender_id": sender_id, "client_msg_id": {"$in": client_msg_ids}}, {"_id": 0}
+    ).to_list(length=None)
+    return {m["client_msg_id"]: m for m in stored}
+
+@api_router.post("/chat/send", response_model=ChatMessage)
+async def send_chat_message(message_create: ChatMessageCreate, current_user: User = Depends(get_current_user)):
+    """Send a private or group chat message"""
+    check_chat_target(message_create, current_user)
+    message = build_chat_message(message_create, current_user, datetime.now(timezone.utc))
+    try:
+        await db.chat_messages.insert_one(message.dict())
+    except DuplicateKeyError:
+        if message.client_msg_id is None:
+            raise
+        # Retry of a message we already have
+        stored = await find_client_messages(current_user.id, [message.client_msg_id])
+        return ChatMessage(**stored[message.client_msg_id])
+    
+    await publish_chat_message(message)
     return message
 
+@api_router.post("/chat/batch")
+async def send_chat_batch(batch: ChatBatchCreate, current_user: User = Depends(get_current_user)):
+    """Store offline-queued messages exactly once, keyed by client_msg_id"""
+    if len(batch.messages) > CHAT_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"Najviše {CHAT_BATCH_MAX} poruka po zahtjevu")
+    # A key repeated inside the batch counts once; queue order becomes created_at order.
+    # Items the sender may not post (e.g. a group left while offline) are rejected
+    # one by one so the rest of the queue still goes through.
+    items, rejected, seen = [], [], set()
+    for item in batch.messages:
+        if item.client_msg_id in seen:
+            continue
+        seen.add(item.client_msg_id)
+        try:
+            check_chat_target(item, current_user)
+        except HTTPException as e:
+            rejected.append({"client_msg_id": item.client_msg_id, "status": "rejected", "detail": e.detail})
+            continue
+        items.append(item)
+    now = datetime.now(timezone.utc)
+    messages = [build_chat_message(item, current_user, now + timedelta(milliseconds=i)) for i, item in enumerate(items)]
+
+    duplicate_indexes = set()
+    if messages:
+        try:
+            await db.chat_messages.insert_many([m.dict() for m in messages], ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                if error.get("code") != 11000:
+                    raise
+                duplicate_indexes.add(error["index"])
+
+    created = [m for i, m in enumerate(messages) if i not in duplicate_indexes]
+    for message in created:
+        await publish_chat_message(message)
+    stored = await find_client_messages(current_user.id, [messages[i].client_msg_id for i in duplicate_indexes]) \
+        if duplicate_indexes else {}
+
+    results = []
+    for i, message in enumerate(messages):
+        if i in duplicate_indexes:
+            existing = stored.get(message.client_msg_id)
+            results.append({"client_msg_id": message.client_msg_id, "status": "duplicate",
+                            "message": ChatMessage(**existing) if existing else None})
+        else:
+            results.append({"client_msg_id": message.client_msg_id, "status": "created", "message": message})
+    return {"created": len(created), "duplicates": len(duplicate_indexes), "rejected": len(rejected),
+            "results": results + rejected}
+
 @api_router.get("/chat/private/{user_id}", response_model=List[ChatMessage])
-async def get_private_chat(user_id: str, current_user: User = Depends(get_current_user)):
-    """Get private chat messages between current user and specified user"""
+async def get_private_chat(
+    user_id: str,
+    response: Response,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = Query(CHAT_PAGE_SIZE, ge=1, le=CHAT_PAGE_MAX),
+    current_user: User = Depends(get_current_user)
+):
+    """Get private chat messages between current user and specified user (paged with before/after cursors)"""
     # Private chat primarily for operational members
     if not current_user.is_operational:
         raise HTTPException(status_code=403, detail="Privatni chat je dostupan operativnim članovima")
     
-    messages = await db.chat_messages.find({
-        "chat_type": "private",
-        "$or": [
-            {"sender_id": current_user.id, "recipient_id": user_id},
-            {"sender_id": user_id, "recipient_id": current_user.id}
-        ]
-    }).sort("created_at", 1).to_list(1000)
-    
-    # Mark messages as read
-    await db.chat_messages.update_many(
-        {"sender_id": user_id, "recipient_id": current_user.id, "read": False},
-        {"$set": {"read": True}}
-    )
+    conversation_id = chat_conversation_id("private", current_user.id, user_id)
+    messages, reached_newest = await fetch_chat_page({"conversation_id": conversation_id}, conversation_id,
+                                                     response, before, after, limit)
+    
+    # Opening the latest page moves the read watermark; scrolling back does not.
+    # The conversation list entry is only zeroed when the page reached the newest
+    # message; the unread counter drops by exactly the messages the watermark
+    # moved past, so one that arrives meanwhile stays counted.
+    if messages and not before:
+        last_read_at = messages[-1]["created_at"]
+        previous = await mark_conversation_read(current_user.id, conversation_id, last_read_at)
+        if reached_newest:
+            await reset_conversation_unread(current_user.id, conversation_id)
+        acknowledged = await count_acknowledged(current_user.id, conversation_id, previous, last_read_at)
+        if acknowledged:
+            await clear_unread(current_user.id, user_id, acknowledged)
     
     return [ChatMessage(**msg) for msg in messages]
 
 @api_router.get("/chat/group/{group_type}", response_model=List[ChatMessage])
-async def get_group_chat(group_type: str, current_user: User = Depends(get_current_user)):
-    """Get group chat messages - group_type: 'operational' or 'all'"""
+async def get_group_chat(
+    group_type: str,
+    response: Response,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = Query(CHAT_PAGE_SIZE, ge=1, le=CHAT_PAGE_MAX),
+    current_user: User = Depends(get_current_user)
+):
+    """Get group chat messages - group_type: 'operational' or 'all' (paged with before/after cursors)"""
     # For operational chat - only operational members
     if group_type == 'operational' and not current_user.is_operational:
         raise HTTPException(status_code=403, detail="Samo operativni članovi imaju pristup")
@@ -1158,73 +2540,1064 @@ async def get_group_chat(group_type: str, current_user: User = Depends(get_curre
     # Group ID format: "DVD_Name_operational" or "DVD_Name_all"
     group_id = f"{current_user.department}_{group_type}"
     
-    messages = await db.chat_messages.find({
-        "chat_type": "group",
-        "group_id": group_id
-    }).sort("created_at", 1).to_list(1000)
+    conversation_id = chat_conversation_id("group", current_user.id, group_id=group_id)
+    messages, _ = await fetch_chat_page({"chat_type": "group", "group_id": group_id}, conversation_id,
+                                        response, before, after, limit)
     
     return [ChatMessage(**msg) for msg in messages]
 
 @api_router.get("/chat/unread-count")
 async def get_unread_count(current_user: User = Depends(get_current_user)):
     """Get count of unread messages"""
-    private_count = await db.chat_messages.count_documents({
-        "chat_type": "private",
-        "recipient_id": current_user.id,
-        "read": False
-    })
-    
-    return {"unread_private": private_count}
+    return {"unread_private": await get_unread_private(current_user.id)}
 
 @api_router.get("/chat/conversations")
-async def get_conversations(current_user: User = Depends(get_current_user)):
-    """Get list of users current user has chatted with"""
-    # Get unique user IDs from sent and received messages
-    pipeline = [
-        {
-            "$match": {
-                "chat_type": "private",
-                "$or": [
-                    {"sender_id": current_user.id},
-                    {"recipient_id": current_user.id}
-                ]
-            }
-        },
-        {
-            "$group": {
-                "_id": {
-                    "$cond": [
-                        {"$eq": ["$sender_id", current_user.id]},
-                        "$recipient_id",
-                        "$sender_id"
-                    ]
-                },
-                "last_message": {"$last": "$$ROOT"}
-            }
-        },
-        {"$sort": {"last_message.created_at": -1}}
-    ]
-    
-    conversations = await db.chat_messages.aggregate(pipeline).to_list(100)
-    
-    return conversations
+async def get_conversations(
+    limit: int = Query(100, ge=1, le=500),
+    current_user: User = Depends(get_current_user)
+):
+    """Get list of users current user has chatted with, most recent first"""
+    conversations = await db.conversations.find({"participants": current_user.id}) \
+        .sort("last_message_at", -1).limit(limit).to_list(length=None)
+    return [{
+        "conversation_id": c["_id"],
+        "user_id": next((p for p in c["participants"] if p != current_user.id), current_user.id),
+        "last_message": c["last_message"],
+        "last_message_at": c["last_message_at"],
+        "unread": (c.get("unread") or {}).get(current_user.id, 0),
+    } for c in conversations]
+
+# ===== SEARCH =====
+# In-process inverted index over alerts, chat, interventions and equipment.
+# Text is folded to lowercase ASCII (č/ć→c, š→s, ž→z, đ→d) so "pozar" finds
+# "požar". Every document carries visibility scopes that mirror the list
+# endpoints; a result is returned only if the user holds one of its scopes.
+# Built on startup and patched on writes; each uvicorn worker keeps its own.
+# Writes also land in search_changes (kept SEARCH_CHANGE_RETENTION), which the
+# other workers poll every SEARCH_INDEX_REFRESH_S to re-read what changed.
+
+SEARCH_MIN_TOKEN = 2
+SEARCH_SNIPPET_LENGTH = 160
+SEARCH_PROJECTIONS = {
+    "message": {"_id": 0, "id": 1, "title": 1, "content": 1, "sent_to_departments": 1, "created_at": 1},
+    "chat": {"_id": 0, "id": 1, "chat_type": 1, "sender_id": 1, "sender_name": 1, "recipient_id": 1,
+             "group_id": 1, "content": 1, "created_at": 1},
+    "intervention": {"_id": 0, "id": 1, "intervention_type": 1, "address": 1, "description": 1,
+                     "actions_taken": 1, "departments": 1, "date": 1, "created_at": 1},
+    "equipment": {"_id": 0, "id": 1, "name": 1, "serial_number": 1, "type": 1, "department": 1},
+}
+_SEARCH_FOLD = str.maketrans({"đ": "d", "Đ": "d", "ß": "ss"})
+_SEARCH_TOKEN = re.compile(r"[a-z0-9]+")
+
+def fold_text(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.translate(_SEARCH_FOLD))
+    return "".join(c for c in text if not unicodedata.combining(c)).lower()
+
+def search_tokens(text: str) -> List[str]:
+    return [t for t in _SEARCH_TOKEN.findall(fold_text(text)) if len(t) >= SEARCH_MIN_TOKEN]
+
+def _search_document(kind: str, doc: dict) -> Optional[dict]:
+    """Searchable text, display fields and visibility scopes for one source document"""
+    if kind == "message":
+        departments = doc.get("sent_to_departments") or []
+        scopes = {"all"} if "all" in departments else {f"dept:{d}" for d in departments}
+        return {"title": doc.get("title") or "", "text": f"{doc.get('title') or ''} {doc.get('content') or ''}",
+                "snippet": doc.get("content") or "", "created_at": doc.get("created_at"), "scopes": scopes}
+    if kind == "chat":
+        if doc.get("chat_type") == "private":
+            scopes = {f"user:{doc.get('sender_id')}", f"user:{doc.get('recipient_id')}"}
+        else:
+            scopes = {f"group:{doc.get('group_id')}"}
+        return {"title": doc.get("sender_name") or "", "text": doc.get("content") or "",
+                "snippet": doc.get("content") or "", "created_at": doc.get("created_at"), "scopes": scopes}
+    if kind == "intervention":
+        parts = [doc.get(f) or "" for f in ("description", "address", "actions_taken")]
+        return {"title": " - ".join(p for p in (doc.get("intervention_type"), doc.get("address")) if p),
+                "text": " ".join(parts), "snippet": doc.get("description") or "",
+                "created_at": doc.get("date") or doc.get("created_at"),
+                "scopes": {"vzo"} | {f"dept:{d}" for d in doc.get("departments") or []}}
+    if kind == "equipment":
+        return {"title": doc.get("name") or "", "text": f"{doc.get('name') or ''} {doc.get('serial_number') or ''}",
+                "snippet": " · ".join(p for p in (doc.get("type"), doc.get("serial_number")) if p),
+                "created_at": None, "scopes": {"vzo", f"dept:{doc.get('department')}"}}
+    return None
+
+def search_scopes_for(user: User) -> set:
+    scopes = {"all", f"dept:{user.department}", f"user:{user.id}", f"group:{user.department}_all"}
+    if user.is_operational:
+        scopes.add(f"group:{user.department}_operational")
+    if has_vzo_full_access(user):
+        scopes.add("vzo")
+    return scopes
+
+class SearchIndex:
+    """BM25 over folded tokens; the last query token also matches as a prefix"""
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.postings: Dict[str, Dict[tuple, int]] = {}
+        self.documents: Dict[tuple, dict] = {}
+        self.total_length = 0
+        self._vocabulary: List[str] = []
+        self._vocabulary_dirty = False
+
+    def upsert(self, kind: str, doc: dict):
+        key = (kind, doc["id"])
+        self.remove(kind, doc["id"])
+        entry = _search_document(kind, doc)
+        tokens = search_tokens(entry["text"]) if entry else []
+        if not tokens:
+            return
+        counts: Dict[str, int] = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token, tf in counts.items():
+            posting = self.postings.get(token)
+            if posting is None:
+                posting = self.postings[token] = {}
+                self._vocabulary_dirty = True
+            posting[key] = tf
+        del entry["text"]
+        entry["snippet"] = entry["snippet"][:SEARCH_SNIPPET_LENGTH]
+        self.documents[key] = {**entry, "tokens": list(counts), "length": len(tokens)}
+        self.total_length += len(tokens)
+
+    def remove(self, kind: str, doc_id: str):
+        key = (kind, doc_id)
+        entry = self.documents.pop(key, None)
+        if entry is None:
+            return
+        self.total_length -= entry["length"]
+        for token in entry["tokens"]:
+            posting = self.postings.get(token)
+            if posting is not None:
+                posting.pop(key, None)
+                if not posting:
+                    del self.postings[token]
+                    self._vocabulary_dirty = True
+
+    def _expand_prefix(self, prefix: str) -> List[str]:
+        if self._vocabulary_dirty:
+            self._vocabulary = sorted(self.postings)
+            self._vocabulary_dirty = False
+        start = bisect.bisect_left(self._vocabulary, prefix)
+        end = bisect.bisect_left(self._vocabulary, prefix + "\uffff")
+        return self._vocabulary[start:end]
+
+    def search(self, query: str, scopes: set, kinds: Optional[set] = None, offset: int = 0, limit: int = 20) -> dict:
+        terms = search_tokens(query)
+        if not terms or not self.documents:
+            return {"total": 0, "results": []}
+        # Every term must match; each term is a group of index tokens (prefix expansion for the last)
+        groups = [[t] if t in self.postings else [] for t in terms[:-1]]
+        groups.append(self._expand_prefix(terms[-1]))
+        if any(not g for g in groups):
+            return {"total": 0, "results": []}
+        group_docs = []
+        for group in groups:
+            keys = set()
+            for token in group:
+                keys.update(self.postings[token])
+            group_docs.append(keys)
+        group_docs.sort(key=len)
+        candidates = set.intersection(*group_docs)
+
+        n = len(self.documents)
+        average_length = self.total_length / n
+        scored = []
+        for key in candidates:
+            entry = self.documents[key]
+            if kinds and key[0] not in kinds:
+                continue
+            if not entry["scopes"] & scopes:
+                continue
+            score = 0.0
+            norm = self.K1 * (1 - self.B + self.B * entry["length"] / average_length)
+            for group in groups:
+                for token in group:
+                    tf = self.postings[token].get(key)
+                    if tf:
+                        df = len(self.postings[token])
+                        idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+                        score += idf * tf * (self.K1 + 1) / (tf + norm)
+            created_at = entry["created_at"]
+            scored.append((score, created_at.timestamp() if isinstance(created_at, datetime) else 0, key))
+        top = heapq.nlargest(offset + limit, scored)[offset:]
+        return {
+            "total": len(scored),
+            "results": [{
+                "kind": key[0],
+                "id": key[1],
+                "title": self.documents[key]["title"],
+                "snippet": self.documents[key]["snippet"],
+                "created_at": self.documents[key]["created_at"],
+                "score": round(score, 3),
+            } for score, _, key in top],
+        }
+
+search_index = SearchIndex()
+
+SEARCH_SOURCES = {
+    "message": "messages",
+    "chat": "chat_messages",
+    "intervention": "interventions",
+    "equipment": "equipment",
+}
+
+SEARCH_INDEX_REFRESH_S = float(os.environ.get('SEARCH_INDEX_REFRESH_S', 5))
+SEARCH_CHANGE_RETENTION = timedelta(hours=1)  # a worker further behind rebuilds instead
+SEARCH_REFRESH_OVERLAP = timedelta(seconds=5)  # changes logged by slow requests around the last poll
+_search_worker_id = uuid.uuid4().hex
+_search_index_synced_at: Optional[datetime] = None
+
+async def rebuild_search_index():
+    global _search_index_synced_at
+    _search_index_synced_at = datetime.now(timezone.utc)  # before reading, so later changes are replayed
+    search_index.clear()
+    for kind, collection in SEARCH_SOURCES.items():
+        async for doc in db[collection].find({}, SEARCH_PROJECTIONS[kind]):
+            if doc.get("id"):
+                search_index.upsert(kind, doc)
+    # Archived chat stays searchable - archiving moves messages to cold storage,
+    # it doesn't take them out of the history
+    async for batch in db.chat_archive.find({}, {"data": 1}):
+        for message in await asyncio.to_thread(_unpack_chat_batch, batch["data"]):
+            search_index.upsert("chat", message)
+    print(f"🔎 Search index built: {len(search_index.documents)} documents, {len(search_index.postings)} terms")
+
+async def _log_search_change(kind: str, doc_id: str):
+    await db.search_changes.insert_one(
+        {"kind": kind, "id": doc_id, "worker": _search_worker_id, "at": datetime.now(timezone.utc)}
+    )
+
+async def _reload_search_document(kind: str, doc_id: str):
+    doc = await db[SEARCH_SOURCES[kind]].find_one({"id": doc_id}, SEARCH_PROJECTIONS[kind])
+    if doc:
+        search_index.upsert(kind, doc)
+    else:
+        search_index.remove(kind, doc_id)
+
+async def index_search_document(kind: str, doc: dict):
+    """Index a newly written document here and announce it to the other workers"""
+    search_index.upsert(kind, doc)
+    await _log_search_change(kind, doc["id"])
+
+async def unindex_search_document(kind: str, doc_id: str):
+    search_index.remove(kind, doc_id)
+    await _log_search_change(kind, doc_id)
+
+async def reindex_document(kind: str, doc_id: str):
+    """Re-read one source document after a partial update"""
+    await _reload_search_document(kind, doc_id)
+    await _log_search_change(kind, doc_id)
+
+async def refresh_search_index():
+    """Re-read documents other workers changed since the last refresh"""
+    global _search_index_synced_at
+    started = datetime.now(timezone.utc)
+    if _search_index_synced_at is None or started - _search_index_synced_at > SEARCH_CHANGE_RETENTION:
+        await rebuild_search_index()
+        return
+    changes = db.search_changes.find(
+        {"at": {"$gt": _search_index_synced_at - SEARCH_REFRESH_OVERLAP}, "worker": {"$ne": _search_worker_id}},
+        {"_id": 0, "kind": 1, "id": 1}
+    )
+    changed = {(change["kind"], change["id"]) async for change in changes}
+    for kind, doc_id in changed:
+        await _reload_search_document(kind, doc_id)
+    _search_index_synced_at = started
+
+async def search_index_refresh_loop():
+    while True:
+        await asyncio.sleep(SEARCH_INDEX_REFRESH_S)
+        try:
+            await refresh_search_index()
+        except Exception as e:
+            print(f"❌ Search index refresh failed: {e}")
+
+@api_router.get("/search")
+async def search(
+    q: str = Query(..., min_length=2),
+    kind: Optional[str] = Query(None, description="Comma-separated: message, chat, intervention, equipment"),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    current_user: User = Depends(get_current_user)
+):
+    """Ranked search over alerts, chat, interventions and equipment visible to the user"""
+    kinds = None
+    if kind:
+        kinds = {k.strip() for k in kind.split(',') if k.strip()}
+        if not kinds <= set(SEARCH_SOURCES):
+            raise HTTPException(status_code=400, detail=f"Podržane vrste: {', '.join(SEARCH_SOURCES)}")
+    result = search_index.search(q, search_scopes_for(current_user), kinds, offset, limit)
+    return {"query": q, "offset": offset, "limit": limit, **result}
+
+# ===== CLIENT SYNC =====
+# One poll for the dashboard: presence deltas, unread counter, new alerts and
+# new chat messages since the client's cursor. The cursor is the server time
+# of the previous sync minus SYNC_OVERLAP, so writes that were in flight then
+# are not missed; items in the overlap can repeat and clients dedupe by id.
+# Alerts and chat are read oldest first; when either stream hits SYNC_LIMIT the
+# cursor stops at its last returned item and has_more tells the client to poll
+# again right away, so a burst is delivered in pages instead of being dropped.
+
+SYNC_OVERLAP = timedelta(seconds=2)
+SYNC_LIMIT = 100
+PRESENCE_DEPARTURE_RETENTION = timedelta(minutes=10)
+
+def _encode_sync_cursor(at: datetime) -> str:
+    return base64.urlsafe_b64encode(at.isoformat().encode()).decode().rstrip("=")
+
+def _decode_sync_cursor(cursor: str) -> datetime:
+    try:
+        at = datetime.fromisoformat(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Neispravan kursor")
+    return at if at.tzinfo else at.replace(tzinfo=timezone.utc)
+
+def presence_delta(since: Optional[datetime]) -> dict:
+    prune_presence()
+    now = datetime.now(timezone.utc)
+    for user_id, left_at in list(presence_departures.items()):
+        if now - left_at > PRESENCE_DEPARTURE_RETENTION:
+            del presence_departures[user_id]
+    users = list(active_connections.values())
+    if since is None or now - since > PRESENCE_DEPARTURE_RETENTION:
+        return {"full": True, "users": users}
+    since_iso = since.isoformat()
+    present = {u.get("user_id") for u in users}
+    return {
+        "full": False,
+        "updated": [u for u in users if u.get("timestamp", "") > since_iso],
+        "removed": [user_id for user_id, left_at in presence_departures.items()
+                    if left_at > since and user_id not in present],
+    }
+
+async def _sync_alerts(user: User, since: datetime) -> List[dict]:
+    return await db.messages.find(
+        {"sent_to_departments": {"$in": [user.department, "all"]}, "created_at": {"$gt": since}}, {"_id": 0}
+    ).sort([("created_at", 1), ("id", 1)]).limit(SYNC_LIMIT).to_list(length=None)
+
+async def _sync_chat(user: User, since: datetime) -> List[dict]:
+    groups = chat_groups_for(user.department, user.is_operational)
+    return await db.chat_messages.find({
+        "created_at": {"$gt": since},
+        "$or": [
+            {"recipient_id": user.id},
+            {"sender_id": user.id},
+            {"chat_type": "group", "group_id": {"$in": groups}},
+        ]
+    }, {"_id": 0}).sort([("created_at", 1), ("id", 1)]).limit(SYNC_LIMIT).to_list(length=None)
+
+async def _no_items() -> List[dict]:
+    return []
+
+@api_router.get("/sync")
+async def sync(cursor: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    """Everything the dashboard polls for, since the cursor of the previous call.
+
+    Without a cursor only presence (full snapshot) and the unread counter are
+    returned, plus a cursor to continue from; alerts and chat come from their
+    own endpoints on first load.
+    """
+    started = datetime.now(timezone.utc)
+    since = _decode_sync_cursor(cursor) if cursor else None
+    unread, alerts, chat = await asyncio.gather(
+        get_unread_private(current_user.id),
+        _sync_alerts(current_user, since) if since else _no_items(),
+        _sync_chat(current_user, since) if since else _no_items(),
+    )
+    next_since = started - SYNC_OVERLAP
+    for items in (alerts, chat):
+        if len(items) >= SYNC_LIMIT:
+            # Back off a millisecond (Mongo's precision) so items sharing the
+            # last timestamp are read again rather than skipped
+            last_at = items[-1]["created_at"]
+            last_at = last_at if last_at.tzinfo else last_at.replace(tzinfo=timezone.utc)
+            next_since = min(next_since, last_at - timedelta(milliseconds=1))
+    return {
+        "cursor": _encode_sync_cursor(next_since),
+        "server_time": started.isoformat(),
+        "presence": presence_delta(since),
+        "unread": {"unread_private": unread},
+        "messages": [Message(**m) for m in alerts],
+        "chat": [ChatMessage(**m) for m in chat],
+        "has_more": {"messages": len(alerts) >= SYNC_LIMIT, "chat": len(chat) >= SYNC_LIMIT},
+    }
 
 @api_router.get("/locations/active")
 async def get_active_locations():
     return list(active_connections.values())
 
+# ===== COORDINATE TRANSFORMS =====
+# HTRS96/TM (EPSG:3765) is the Croatian national projection used by the DVD area
+# file and the water utility's register. Same definition as proj4 in the frontend:
+# +proj=tmerc +lat_0=0 +lon_0=16.5 +k=0.9999 +x_0=500000 +y_0=0 +ellps=GRS80
+
+HTRS96_CRS_NAMES = {"EPSG:3765", "urn:ogc:def:crs:EPSG::3765"}
+WGS84_CRS_NAMES = {"EPSG:4326", "urn:ogc:def:crs:EPSG::4326", "urn:ogc:def:crs:OGC:1.3:CRS84", "CRS84"}
+
+_GRS80_A = 6378137.0
+_GRS80_F = 1 / 298.257222101
+_TM_E2 = _GRS80_F * (2 - _GRS80_F)
+_TM_EP2 = _TM_E2 / (1 - _TM_E2)
+_TM_K0 = 0.9999
+_TM_LON0 = math.radians(16.5)
+_TM_FALSE_EASTING = 500000.0
+
+def _tm_meridian_arc(phi: float) -> float:
+    e2, e4, e6 = _TM_E2, _TM_E2 ** 2, _TM_E2 ** 3
+    return _GRS80_A * ((1 - e2 / 4 - 3 * e4 / 64 - 5 * e6 / 256) * phi
+                       - (3 * e2 / 8 + 3 * e4 / 32 + 45 * e6 / 1024) * math.sin(2 * phi)
+                       + (15 * e4 / 256 + 45 * e6 / 1024) * math.sin(4 * phi)
+                       - (35 * e6 / 3072) * math.sin(6 * phi))
+
+def wgs84_to_htrs96(lat: float, lon: float) -> tuple:
+    """WGS84 lat/lon -> HTRS96/TM (x, y) in meters"""
+    phi = math.radians(lat)
+    sin_phi, cos_phi, tan_phi = math.sin(phi), math.cos(phi), math.tan(phi)
+    n = _GRS80_A / math.sqrt(1 - _TM_E2 * sin_phi ** 2)
+    t = tan_phi ** 2
+    c = _TM_EP2 * cos_phi ** 2
+    a = (math.radians(lon) - _TM_LON0) * cos_phi
+    x = _TM_FALSE_EASTING + _TM_K0 * n * (
+        a + (1 - t + c) * a ** 3 / 6 + (5 - 18 * t + t ** 2 + 72 * c - 58 * _TM_EP2) * a ** 5 / 120)
+    y = _TM_K0 * (_tm_meridian_arc(phi) + n * tan_phi * (
+        a ** 2 / 2 + (5 - t + 9 * c + 4 * c ** 2) * a ** 4 / 24
+        + (61 - 58 * t + t ** 2 + 600 * c - 330 * _TM_EP2) * a ** 6 / 720))
+    return x, y
+
+def htrs96_to_wgs84(x: float, y: float) -> tuple:
+    """HTRS96/TM (x, y) in meters -> WGS84 (lat, lon)"""
+    e2 = _TM_E2
+    mu = (y / _TM_K0) / (_GRS80_A * (1 - e2 / 4 - 3 * e2 ** 2 / 64 - 5 * e2 ** 3 / 256))
+    e1 = (1 - math.sqrt(1 - e2)) / (1 + math.sqrt(1 - e2))
+    phi1 = (mu + (3 * e1 / 2 - 27 * e1 ** 3 / 32) * math.sin(2 * mu)
+            + (21 * e1 ** 2 / 16 - 55 * e1 ** 4 / 32) * math.sin(4 * mu)
+            + (151 * e1 ** 3 / 96) * math.sin(6 * mu)
+            + (1097 * e1 ** 4 / 512) * math.sin(8 * mu))
+    sin1, cos1, tan1 = math.sin(phi1), math.cos(phi1), math.tan(phi1)
+    n1 = _GRS80_A / math.sqrt(1 - e2 * sin1 ** 2)
+    r1 = _GRS80_A * (1 - e2) / (1 - e2 * sin1 ** 2) ** 1.5
+    t1 = tan1 ** 2
+    c1 = _TM_EP2 * cos1 ** 2
+    d = (x - _TM_FALSE_EASTING) / (n1 * _TM_K0)
+    phi = phi1 - (n1 * tan1 / r1) * (
+        d ** 2 / 2 - (5 + 3 * t1 + 10 * c1 - 4 * c1 ** 2 - 9 * _TM_EP2) * d ** 4 / 24
+        + (61 + 90 * t1 + 298 * c1 + 45 * t1 ** 2 - 252 * _TM_EP2 - 3 * c1 ** 2) * d ** 6 / 720)
+    lam = _TM_LON0 + (d - (1 + 2 * t1 + c1) * d ** 3 / 6
+                      + (5 - 2 * c1 + 28 * t1 - 3 * c1 ** 2 + 8 * _TM_EP2 + 24 * t1 ** 2) * d ** 5 / 120) / cos1
+    return math.degrees(phi), math.degrees(lam)
+
+def to_wgs84(x: float, y: float, crs: Optional[str]) -> tuple:
+    """GeoJSON-order coordinates in crs -> (lat, lon)"""
+    if crs in HTRS96_CRS_NAMES:
+        return htrs96_to_wgs84(x, y)
+    if crs is None or crs in WGS84_CRS_NAMES:
+        return y, x
+    raise ValueError(f"Nepodržan koordinatni sustav '{crs}' (podržani: EPSG:4326, EPSG:3765)")
+
+# ===== DVD AREAS =====
+# Area polygons come from the same GeoJSON the frontend draws (EPSG:3765) and
+# are kept in projected meters, which is what point-in-polygon and rasters need.
+
+DVD_AREAS_PATH = Path(os.environ.get('DVD_AREAS_PATH', ROOT_DIR.parent / 'frontend' / 'public' / 'dvd-podrucja.geojson'))
+DVD_AREA_NAME_PROPERTY = 'vlastita oznaka naziv'
+NO_DVD_AREA = "bez_podrucja"
+
+def _load_dvd_areas() -> List[dict]:
+    """[{name, polygons: [[ring of (x, y)], ...], bbox: (min_x, min_y, max_x, max_y)}]"""
+    try:
+        with open(DVD_AREAS_PATH, encoding='utf-8') as f:
+            collection = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ DVD areas not loaded from {DVD_AREAS_PATH}: {e}")
+        return []
+    crs = ((collection.get("crs") or {}).get("properties") or {}).get("name")
+    areas = []
+    for feature in collection.get("features", []):
+        geometry = feature.get("geometry") or {}
+        polygons = geometry.get("coordinates") or []
+        if geometry.get("type") == "Polygon":
+            polygons = [polygons]
+        elif geometry.get("type") != "MultiPolygon":
+            continue
+        if crs not in HTRS96_CRS_NAMES:
+            polygons = [[[wgs84_to_htrs96(pt[1], pt[0]) for pt in ring] for ring in polygon] for polygon in polygons]
+        else:
+            polygons = [[[(pt[0], pt[1]) for pt in ring] for ring in polygon] for polygon in polygons]
+        xs = [x for polygon in polygons for x, _ in polygon[0]]
+        ys = [y for polygon in polygons for _, y in polygon[0]]
+        areas.append({
+            "name": (feature.get("properties") or {}).get(DVD_AREA_NAME_PROPERTY) or f"Područje {len(areas) + 1}",
+            "polygons": polygons,
+            "bbox": (min(xs), min(ys), max(xs), max(ys)),
+        })
+    return areas
+
+def _point_in_ring(x: float, y: float, ring: List[tuple]) -> bool:
+    inside = False
+    j = len(ring) - 1
+    for i in range(len(ring)):
+        xi, yi = ring[i]
+        xj, yj = ring[j]
+        if (yi > y) != (yj > y) and x < (xj - xi) * (y - yi) / (yj - yi) + xi:
+            inside = not inside
+        j = i
+    return inside
+
+DVD_AREAS = _load_dvd_areas()
+
+def dvd_area_for(lat: float, lon: float) -> Optional[str]:
+    """Name of the DVD area containing the point, None outside all areas"""
+    x, y = wgs84_to_htrs96(lat, lon)
+    for area in DVD_AREAS:
+        min_x, min_y, max_x, max_y = area["bbox"]
+        if not (min_x <= x <= max_x and min_y <= y <= max_y):
+            continue
+        for outer, *holes in area["polygons"]:
+            if _point_in_ring(x, y, outer) and not any(_point_in_ring(x, y, hole) for hole in holes):
+                return area["name"]
+    return None
+
+# ===== HYDRANT IN-MEMORY INDEXES =====
+# Built from the hydrants collection on startup and patched on every hydrant
+# write. Each uvicorn worker keeps its own copy.
+
+HYDRANT_INDEX_PROJECTION = {"_id": 0, "id": 1, "latitude": 1, "longitude": 1, "status": 1, "tip_hidranta": 1, "address": 1}
+CLUSTER_MAX_ZOOM = int(os.environ.get('CLUSTER_MAX_ZOOM', 16))
+CLUSTER_RADIUS_PX = int(os.environ.get('CLUSTER_RADIUS_PX', 60))
+CLUSTER_TILE_SIZE = 256
+
+def _mercator_x(lon: float) -> float:
+    return lon / 360 + 0.5
+
+def _mercator_y(lat: float) -> float:
+    sin_lat = math.sin(math.radians(max(min(lat, 85.05112878), -85.05112878)))
+    return 0.5 - 0.25 * math.log((1 + sin_lat) / (1 - sin_lat)) / math.pi
+
+def _mercator_lon(x: float) -> float:
+    return (x - 0.5) * 360
+
+def _mercator_lat(y: float) -> float:
+    return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y))))
+
+class HydrantClusterIndex:
+    """Hierarchical grid clustering (supercluster-style) over all zoom levels.
+
+    Every zoom level keeps a grid of cells CLUSTER_RADIUS_PX wide. A hydrant is
+    counted in exactly one cell per level, so insert/remove is O(zoom levels)
+    and a viewport query touches only the cells visible on screen.
+    """
+
+    def __init__(self, max_zoom: int = CLUSTER_MAX_ZOOM, radius_px: int = CLUSTER_RADIUS_PX):
+        self.max_zoom = max_zoom
+        self.cell_sizes = [radius_px / (CLUSTER_TILE_SIZE * 2 ** z) for z in range(max_zoom + 1)]
+        self.levels: List[Dict[tuple, dict]] = [{} for _ in range(max_zoom + 1)]
+        self.points: Dict[str, tuple] = {}  # id -> (x, y, status, tip_hidranta)
+
+    def clear(self):
+        self.levels = [{} for _ in range(self.max_zoom + 1)]
+        self.points = {}
+
+    def __len__(self):
+        return len(self.points)
+
+    def _cell_key(self, zoom: int, x: float, y: float) -> tuple:
+        size = self.cell_sizes[zoom]
+        return int(x / size), int(y / size)
+
+    def upsert(self, hydrant: dict):
+        hydrant_id = hydrant["id"]
+        if hydrant_id in self.points:
+            self.remove(hydrant_id)
+        try:
+            x, y = _mercator_x(float(hydrant["longitude"])), _mercator_y(float(hydrant["latitude"]))
+        except (KeyError, TypeError, ValueError):
+            return
+        point = (x, y, hydrant.get("status") or "working", hydrant.get("tip_hidranta") or "nadzemni")
+        self.points[hydrant_id] = point
+        for zoom in range(self.max_zoom + 1):
+            cell = self.levels[zoom].setdefault(self._cell_key(zoom, x, y), {
+                "count": 0, "sx": 0.0, "sy": 0.0, "by_status": {}, "by_type": {}, "ids": set()
+            })
+            cell["count"] += 1
+            cell["sx"] += x
+            cell["sy"] += y
+            cell["by_status"][point[2]] = cell["by_status"].get(point[2], 0) + 1
+            cell["by_type"][point[3]] = cell["by_type"].get(point[3], 0) + 1
+            cell["ids"].add(hydrant_id)
+
+    def remove(self, hydrant_id: str):
+        point = self.points.pop(hydrant_id, None)
+        if point is None:
+            return
+        x, y, status, tip = point
+        for zoom in range(self.max_zoom + 1):
+            key = self._cell_key(zoom, x, y)
+            cell = self.levels[zoom].get(key)
+            if cell is None:
+                continue
+            cell["count"] -= 1
+            if cell["count"] <= 0:
+                del self.levels[zoom][key]
+                continue
+            cell["sx"] -= x
+            cell["sy"] -= y
+            for counts, value in ((cell["by_status"], status), (cell["by_type"], tip)):
+                counts[value] -= 1
+                if counts[value] <= 0:
+                    del counts[value]
+            cell["ids"].discard(hydrant_id)
+
+    def _point_feature(self, hydrant_id: str) -> dict:
+        x, y, status, tip = self.points[hydrant_id]
+        return {"type": "hydrant", "id": hydrant_id, "latitude": _mercator_lat(y),
+                "longitude": _mercator_lon(x), "status": status, "tip_hidranta": tip}
+
+    def query(self, zoom: int, bbox: Optional[List[float]] = None) -> List[dict]:
+        """Clusters and single hydrants visible at zoom inside bbox (minLon, minLat, maxLon, maxLat)"""
+        level = min(max(zoom, 0), self.max_zoom)
+        cells = self.levels[level]
+        if bbox:
+            min_lon, min_lat, max_lon, max_lat = bbox
+            x0, y0 = self._cell_key(level, _mercator_x(min_lon), _mercator_y(max_lat))
+            x1, y1 = self._cell_key(level, _mercator_x(max_lon), _mercator_y(min_lat))
+            if (x1 - x0 + 1) * (y1 - y0 + 1) <= len(cells):
+                keys = ((cx, cy) for cx in range(x0, x1 + 1) for cy in range(y0, y1 + 1))
+                visible = [(key, cells[key]) for key in keys if key in cells]
+            else:
+                visible = [(key, cell) for key, cell in cells.items()
+                           if x0 <= key[0] <= x1 and y0 <= key[1] <= y1]
+        else:
+            visible = list(cells.items())
+
+        features = []
+        for (cx, cy), cell in visible:
+            # Past the last clustered zoom every hydrant is shown on its own
+            if cell["count"] == 1 or zoom > self.max_zoom:
+                features.extend(self._point_feature(hydrant_id) for hydrant_id in cell["ids"])
+                continue
+            features.append({
+                "type": "cluster",
+                "id": f"{level}/{cx}/{cy}",
+                "latitude": _mercator_lat(cell["sy"] / cell["count"]),
+                "longitude": _mercator_lon(cell["sx"] / cell["count"]),
+                "count": cell["count"],
+                "by_status": dict(cell["by_status"]),
+                "by_type": dict(cell["by_type"]),
+            })
+        return features
+
+EARTH_RADIUS_M = 6371008.8
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+def _unit_vector(lat: float, lon: float) -> tuple:
+    """Point on the unit sphere - chord length is monotonic in great-circle distance"""
+    phi, lam = math.radians(lat), math.radians(lon)
+    return (math.cos(phi) * math.cos(lam), math.cos(phi) * math.sin(lam), math.sin(phi))
+
+def _dist2(a: tuple, b: tuple) -> float:
+    return (a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2 + (a[2] - b[2]) ** 2
+
+class _KDTree:
+    """Static 3-d tree over unit vectors. Nodes are (vector, id, axis, left, right)."""
+
+    def __init__(self, items: List[tuple]):
+        self.size = len(items)
+        self.root = self._build(list(items), 0)
+
+    def _build(self, items: List[tuple], depth: int):
+        if not items:
+            return None
+        axis = depth % 3
+        items.sort(key=lambda item: item[0][axis])
+        mid = len(items) // 2
+        vector, hydrant_id = items[mid]
+        return (vector, hydrant_id, axis,
+                self._build(items[:mid], depth + 1), self._build(items[mid + 1:], depth + 1))
+
+    def nearest(self, target: tuple, k: int, skip: set, heap: list):
+        """Push the k nearest ids into heap as (-dist2, id), ignoring ids in skip"""
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            vector, hydrant_id, axis, left, right = node
+            if hydrant_id not in skip:
+                d2 = _dist2(vector, target)
+                if len(heap) < k:
+                    heapq.heappush(heap, (-d2, hydrant_id))
+                elif d2 < -heap[0][0]:
+                    heapq.heapreplace(heap, (-d2, hydrant_id))
+            diff = target[axis] - vector[axis]
+            near_side, far_side = (left, right) if diff < 0 else (right, left)
+            # Far side only if the splitting plane is closer than the current k-th best
+            if far_side is not None and (len(heap) < k or diff * diff < -heap[0][0]):
+                stack.append(far_side)
+            stack.append(near_side)
+
+class HydrantNearestIndex:
+    """Nearest-hydrant lookup, one KD-tree per (status, tip_hidranta) partition.
+
+    Writes don't rebuild the tree: new or moved hydrants go to a small pending
+    list that is scanned linearly, removed ones are skipped. A partition is
+    rebuilt lazily once its pending/removed sets grow past sqrt(n).
+    """
+
+    def __init__(self):
+        self.points: Dict[str, dict] = {}
+        self.partitions: Dict[tuple, dict] = {}
+
+    def clear(self):
+        self.points = {}
+        self.partitions = {}
+
+    def _partition(self, key: tuple) -> dict:
+        return self.partitions.setdefault(key, {"tree": None, "tree_ids": set(), "pending": set(), "removed": set()})
+
+    def upsert(self, hydrant: dict):
+        self.remove(hydrant["id"])
+        try:
+            lat, lon = float(hydrant["latitude"]), float(hydrant["longitude"])
+        except (KeyError, TypeError, ValueError):
+            return
+        key = (hydrant.get("status") or "working", hydrant.get("tip_hidranta") or "nadzemni")
+        self.points[hydrant["id"]] = {
+            "id": hydrant["id"], "latitude": lat, "longitude": lon, "status": key[0],
+            "tip_hidranta": key[1], "address": hydrant.get("address"), "vector": _unit_vector(lat, lon), "key": key
+        }
+        # A tree copy of this id (if any) stays in removed: it holds the old position
+        self._partition(key)["pending"].add(hydrant["id"])
+
+    def remove(self, hydrant_id: str):
+        point = self.points.pop(hydrant_id, None)
+        if point is None:
+            return
+        partition = self._partition(point["key"])
+        partition["pending"].discard(hydrant_id)
+        if hydrant_id in partition["tree_ids"]:
+            partition["removed"].add(hydrant_id)
+
+    def _rebuild(self, key: tuple):
+        partition = self._partition(key)
+        items = [(p["vector"], hydrant_id) for hydrant_id, p in self.points.items() if p["key"] == key]
+        partition["tree"] = _KDTree(items) if items else None
+        partition["tree_ids"] = {hydrant_id for _, hydrant_id in items}
+        partition["pending"] = set()
+        partition["removed"] = set()
+
+    def rebuild_all(self):
+        for key in {p["key"] for p in self.points.values()} | set(self.partitions):
+            self._rebuild(key)
+
+    def nearest(self, lat: float, lon: float, k: int, statuses: Optional[List[str]] = None,
+                types: Optional[List[str]] = None) -> List[dict]:
+        target = _unit_vector(lat, lon)
+        heap: list = []
+        for key in list(self.partitions):
+            if (statuses and key[0] not in statuses) or (types and key[1] not in types):
+                continue
+            partition = self.partitions[key]
+            churn = len(partition["pending"]) + len(partition["removed"])
+            if churn > max(32, math.isqrt(len(partition["tree_ids"]))):
+                self._rebuild(key)
+            if partition["tree"] is not None:
+                partition["tree"].nearest(target, k, partition["removed"], heap)
+            for hydrant_id in partition["pending"]:
+                d2 = _dist2(self.points[hydrant_id]["vector"], target)
+                if len(heap) < k:
+                    heapq.heappush(heap, (-d2, hydrant_id))
+                elif d2 < -heap[0][0]:
+                    heapq.heapreplace(heap, (-d2, hydrant_id))
+
+        results = []
+        for _, hydrant_id in sorted(heap, reverse=True):
+            point = self.points[hydrant_id]
+            results.append({
+                **{field: point[field] for field in ("id", "latitude", "longitude", "status", "tip_hidranta", "address")},
+                "distance_m": round(haversine_m(lat, lon, point["latitude"], point["longitude"]), 1)
+            })
+        return results
+
+hydrant_clusters = HydrantClusterIndex()
+hydrant_nearest = HydrantNearestIndex()
+
+# Each worker tracks the hydrant version its indexes reflect and polls the
+# counter, so writes made by other workers or the import CLI show up within
+# HYDRANT_INDEX_REFRESH_S without a restart.
+HYDRANT_INDEX_REFRESH_S = float(os.environ.get('HYDRANT_INDEX_REFRESH_S', 5))
+HYDRANT_INDEX_DELTA_LIMIT = 2000  # larger gaps reload everything
+_hydrant_index_version = 0
+
+async def rebuild_hydrant_indexes():
+    """Reload all in-memory hydrant indexes from the database"""
+    global _hydrant_index_version
+    version = await committed_hydrant_version()  # before reading, so later writes are refreshed
+    hydrants = await db.hydrants.find({}, HYDRANT_INDEX_PROJECTION).to_list(length=None)
+    hydrant_clusters.clear()
+    hydrant_nearest.clear()
+    for hydrant in hydrants:
+        hydrant_clusters.upsert(hydrant)
+        hydrant_nearest.upsert(hydrant)
+    hydrant_nearest.rebuild_all()
+    await run_coverage(hydrant_coverage.load, hydrants)
+    _hydrant_index_version = version
+    print(f"🗺️ Hydrant indexes built: {len(hydrants)} hydrants")
+
+async def refresh_hydrant_indexes():
+    """Apply hydrant writes committed since the indexes were last loaded"""
+    global _hydrant_index_version
+    committed = await committed_hydrant_version()
+    if committed <= _hydrant_index_version:
+        return
+    changes, has_more = await fetch_hydrant_changes(
+        _hydrant_index_version, committed, HYDRANT_INDEX_DELTA_LIMIT, {**HYDRANT_INDEX_PROJECTION, "version": 1}
+    )
+    if has_more:
+        await rebuild_hydrant_indexes()
+        return
+    for kind, _, doc in changes:
+        if kind == "upsert":
+            on_hydrant_saved(doc)
+        else:
+            on_hydrant_deleted(doc["id"])
+    _hydrant_index_version = committed
+
+async def hydrant_index_refresh_loop():
+    while True:
+        await asyncio.sleep(HYDRANT_INDEX_REFRESH_S)
+        try:
+            await refresh_hydrant_indexes()
+        except Exception as e:
+            print(f"❌ Hydrant index refresh failed: {e}")
+
+def on_hydrant_saved(hydrant: dict):
+    """Patch in-memory indexes after a hydrant insert/update"""
+    hydrant_clusters.upsert(hydrant)
+    hydrant_nearest.upsert(hydrant)
+    submit_coverage(hydrant_coverage.upsert, hydrant)
+
+def on_hydrant_deleted(hydrant_id: str):
+    hydrant_clusters.remove(hydrant_id)
+    hydrant_nearest.remove(hydrant_id)
+    submit_coverage(hydrant_coverage.remove, hydrant_id)
+
+# ===== HYDRANT VERSIONING (DELTA SYNC) =====
+# Every hydrant write takes the next value of a monotonic counter; deletes leave
+# a tombstone with their own version. Clients keep the last version they saw
+# and ask /api/hydrants/changes?since=<version> for the difference.
+# Reserved-but-unwritten versions are recorded on the counter document itself
+# (atomically with the $inc), so every worker sees them; a lease that outlives
+# HYDRANT_VERSION_LEASE (crashed writer) no longer holds the feed back.
+
+HYDRANT_VERSION_LEASE = timedelta(seconds=60)
+
+@asynccontextmanager
+async def hydrant_versions(count: int = 1):
+    """Reserve versions for a write. The changes feed stops below any version
+    still in flight, so a slow write can't be skipped by a client cursor."""
+    counter = await db.counters.find_one_and_update(
+        {"_id": "hydrants"},
+        [{"$set": {
+            "seq": {"$add": [{"$ifNull": ["$seq", 0]}, count]},
+            "pending": {"$concatArrays": [{"$ifNull": ["$pending", []]}, [{
+                "first": {"$add": [{"$ifNull": ["$seq", 0]}, 1]},
+                "at": "$$NOW",
+            }]]},
+        }}],
+        upsert=True, return_document=ReturnDocument.AFTER
+    )
+    last = counter["seq"]
+    first = last - count + 1
+    try:
+        yield list(range(first, last + 1))
+    finally:
+        await db.counters.update_one({"_id": "hydrants"}, {"$pull": {"pending": {"$or": [
+            {"first": first},
+            {"at": {"$lt": datetime.now(timezone.utc) - HYDRANT_VERSION_LEASE}},
+        ]}}})
+
+async def committed_hydrant_version() -> int:
+    """Highest version below which every reserved version has been written"""
+    counter = await db.counters.find_one({"_id": "hydrants"}) or {}
+    lease_cutoff = datetime.now(timezone.utc) - HYDRANT_VERSION_LEASE
+    pending = [
+        lease["first"] for lease in counter.get("pending", [])
+        if lease["at"].replace(tzinfo=lease["at"].tzinfo or timezone.utc) > lease_cutoff
+    ]
+    return min([counter.get("seq", 0)] + [first - 1 for first in pending])
+
+async def fetch_hydrant_changes(since: int, until: int, limit: int, projection: dict) -> tuple:
+    """([(kind, version, doc)] in version order for since < version <= until, has_more)"""
+    version_filter = {"$gt": since, "$lte": until}
+    upserts, tombstones = await asyncio.gather(
+        db.hydrants.find({"version": version_filter}, projection)
+            .sort("version", 1).limit(limit).to_list(length=None),
+        db.hydrant_tombstones.find({"version": version_filter}, {"_id": 0, "id": 1, "version": 1})
+            .sort("version", 1).limit(limit).to_list(length=None),
+    )
+    changes = sorted(
+        [("upsert", doc["version"], doc) for doc in upserts] + [("delete", doc["version"], doc) for doc in tombstones],
+        key=lambda change: change[1]
+    )
+    has_more = len(changes) > limit or len(upserts) == limit or len(tombstones) == limit
+    return changes[:limit], has_more
+
+def hydrant_geo_point(latitude: float, longitude: float) -> dict:
+    """GeoJSON point for the 2dsphere index (GeoJSON order is lon, lat)"""
+    return {"type": "Point", "coordinates": [longitude, latitude]}
+
+def _parse_coordinates(value: str, count: int, name: str) -> List[float]:
+    try:
+        parts = [float(p) for p in value.split(',')]
+    except ValueError:
+        parts = []
+    if len(parts) != count or not all(math.isfinite(p) for p in parts):
+        raise HTTPException(status_code=400, detail=f"Neispravan parametar '{name}'")
+    return parts
+
+def _parse_bbox(value: str) -> List[float]:
+    """minLon,minLat,maxLon,maxLat clamped to valid coordinates - Leaflet reports
+    longitudes beyond +-180 at low zoom"""
+    min_lon, min_lat, max_lon, max_lat = _parse_coordinates(value, 4, "bbox")
+    if min_lon > max_lon or min_lat > max_lat:
+        raise HTTPException(status_code=400, detail="Neispravan parametar 'bbox'")
+    return [max(min_lon, -180.0), max(min_lat, -90.0), min(max_lon, 180.0), min(max_lat, 90.0)]
+
+def _bbox_filter(bbox: List[float]) -> Optional[dict]:
+    """$geoWithin polygon for a clamped bbox, None when it spans half the world or
+    more (2dsphere would pick the smaller side of such a polygon)"""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    if max_lon - min_lon >= 180:
+        return None
+    return {"$geoWithin": {"$geometry": {
+        "type": "Polygon",
+        "coordinates": [[
+            [min_lon, min_lat], [max_lon, min_lat], [max_lon, max_lat],
+            [min_lon, max_lat], [min_lon, min_lat]
+        ]]
+    }}}
+
+def _parse_point(value: str) -> tuple:
+    lat, lon = _parse_coordinates(value, 2, "near")
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise HTTPException(status_code=400, detail="Neispravan parametar 'near'")
+    return lat, lon
+
+# Without bbox/near the list is capped like the old to_list(1000); maps send their viewport
+HYDRANT_LIST_LIMIT = 1000
+HYDRANT_LIST_MAX_LIMIT = 5000
+
 @api_router.get("/hydrants", response_model=List[Hydrant])
-async def get_hydrants(current_user: User = Depends(get_current_user)):
-    hydrants = await db.hydrants.find().to_list(1000)
+async def get_hydrants(
+    bbox: Optional[str] = Query(None, description="minLon,minLat,maxLon,maxLat (Leaflet toBBoxString)"),
+    near: Optional[str] = Query(None, description="lat,lon - results sorted by distance"),
+    radius: float = Query(1000, gt=0, description="Search radius in meters for near="),
+    limit: Optional[int] = Query(None, ge=1, le=HYDRANT_LIST_MAX_LIMIT),
+    current_user: User = Depends(get_current_user)
+):
+    """Hydrants in the map viewport (bbox) / around a point (near), otherwise the
+    first HYDRANT_LIST_LIMIT"""
+    if bbox and near:
+        raise HTTPException(status_code=400, detail="Koristite bbox ili near, ne oboje")
+
+    query = {}
+    if bbox:
+        bounds = _parse_bbox(bbox)
+        if bounds[0] >= bounds[2] or bounds[1] >= bounds[3]:
+            return []  # viewport entirely outside the valid range
+        within = _bbox_filter(bounds)
+        if within:
+            query["location"] = within
+    elif near:
+        lat, lon = _parse_point(near)
+        query["location"] = {"$nearSphere": {"$geometry": hydrant_geo_point(lat, lon), "$maxDistance": radius}}
+    else:
+        limit = limit or HYDRANT_LIST_LIMIT
+
+    cursor = db.hydrants.find(query, {"_id": 0, "location": 0})
+    if limit:
+        cursor = cursor.limit(limit)
+    hydrants = await cursor.to_list(length=None)
     return [Hydrant(**hydrant) for hydrant in hydrants]
 
+@api_router.get("/hydrants/changes")
+async def get_hydrant_changes(
+    since: int = Query(0, ge=0, description="Last version the client has seen, 0 for a full snapshot"),
+    limit: int = Query(500, ge=1, le=5000),
+    current_user: User = Depends(get_current_user)
+):
+    """Hydrant inserts/updates and deletes after a version, for offline caches"""
+    # Snapshot first: writes that reserve a version while the queries run are
+    # above the bound and are picked up by the next call
+    committed = await committed_hydrant_version()
+    changes, has_more = await fetch_hydrant_changes(since, max(since, committed), limit, {"_id": 0, "location": 0})
+    cursor = changes[-1][1] if has_more else max(since, committed)
+
+    return {
+        "version": cursor,
+        "has_more": has_more,
+        "upserts": [Hydrant(**doc) for kind, _, doc in changes if kind == "upsert"],
+        "deleted": [doc["id"] for kind, _, doc in changes if kind == "delete"],
+    }
+
+@api_router.get("/hydrants/clusters")
+async def get_hydrant_clusters(
+    zoom: int = Query(..., ge=0, le=22),
+    bbox: Optional[str] = Query(None, description="minLon,minLat,maxLon,maxLat"),
+    current_user: User = Depends(get_current_user)
+):
+    """Clustered hydrant markers for a map viewport - payload size depends on the screen, not the dataset"""
+    bounds = _parse_bbox(bbox) if bbox else None
+    features = hydrant_clusters.query(zoom, bounds)
+    return {"zoom": zoom, "total": len(hydrant_clusters), "features": features}
+
+@api_router.get("/hydrants/nearest")
+async def get_nearest_hydrants(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    k: int = Query(5, ge=1, le=100),
+    status: Optional[str] = Query("working", description="Comma separated, empty for any status"),
+    tip_hidranta: Optional[str] = Query(None, description="nadzemni, podzemni or both comma separated"),
+    current_user: User = Depends(get_current_user)
+):
+    """Nearest hydrants to an incident location with haversine distances"""
+    statuses = [v.strip() for v in status.split(',') if v.strip()] if status else None
+    types = [v.strip() for v in tip_hidranta.split(',') if v.strip()] if tip_hidranta else None
+    started = time.perf_counter()
+    results = hydrant_nearest.nearest(lat, lon, k, statuses, types)
+    return {"results": results, "took_ms": round((time.perf_counter() - started) * 1000, 3)}
+
 @api_router.post("/hydrants", response_model=Hydrant)
 async def create_hydrant(hydrant: HydrantCreate, current_user: User = Depends(get_current_user)):
     if not has_hydrant_management_permission(current_user):
         raise HTTPException(status_code=403, detail="Access denied")
     
-    hydrant_obj = Hydrant(**hydrant.dict(), checked_by=current_user.id)
-    await db.hydrants.insert_one(hydrant_obj.dict())
+    hydrant_data = hydrant.dict()
+    hydrant_data['images'] = await externalize_images(hydrant_data.get('images'), current_user.id)
+    now = datetime.now(timezone.utc)
+    async with hydrant_versions() as (version,):
+        hydrant_obj = Hydrant(**hydrant_data, checked_by=current_user.id,
+                              version=version, updated_at=now,
+                              dvd_area=dvd_area_for(hydrant_data['latitude'], hydrant_data['longitude']))
+        await db.hydrants.insert_one({
+            **hydrant_obj.dict(),
+            "location": hydrant_geo_point(hydrant_obj.latitude, hydrant_obj.longitude)
+        })
+    on_hydrant_saved(hydrant_obj.dict())
+    await apply_hydrant_rollup(None, hydrant_obj.dict())
     return hydrant_obj
 
 @api_router.put("/hydrants/{hydrant_id}")
@@ -1233,26 +3606,843 @@ async def update_hydrant(hydrant_id: str, hydrant_update: HydrantUpdate, current
         raise HTTPException(status_code=403, detail="Access denied")
     
     update_data = {k: v for k, v in hydrant_update.dict().items() if v is not None}
+    if "images" in update_data:
+        update_data["images"] = await externalize_images(update_data["images"], current_user.id)
     update_data["last_check"] = datetime.now(timezone.utc)
     update_data["checked_by"] = current_user.id
     
-    result = await db.hydrants.update_one({"id": hydrant_id}, {"$set": update_data})
-    if result.modified_count == 0:
+    async with hydrant_versions() as (version,):
+        update_data["version"] = version
+        update_data["updated_at"] = update_data["last_check"]
+        before = await db.hydrants.find_one_and_update(
+            {"id": hydrant_id}, {"$set": update_data},
+            projection=HYDRANT_ROLLUP_PROJECTION, return_document=ReturnDocument.BEFORE
+        )
+    if before is None:
         raise HTTPException(status_code=404, detail="Hydrant not found")
+    after = {**before, **update_data}
+    on_hydrant_saved(after)
+    await record_hydrant_inspection(before, after, current_user)
+    await apply_hydrant_rollup(before, after)
     
-    return {"message": "Hydrant updated successfully"}
+    return {"message": "Hydrant updated successfully", "version": version}
 
 @api_router.delete("/hydrants/{hydrant_id}")
 async def delete_hydrant(hydrant_id: str, current_user: User = Depends(get_current_user)):
     if not has_hydrant_management_permission(current_user):
         raise HTTPException(status_code=403, detail="Access denied")
     
-    result = await db.hydrants.delete_one({"id": hydrant_id})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Hydrant not found")
+    async with hydrant_versions() as (version,):
+        deleted = await db.hydrants.find_one_and_delete({"id": hydrant_id}, projection=HYDRANT_ROLLUP_PROJECTION)
+        if deleted is None:
+            raise HTTPException(status_code=404, detail="Hydrant not found")
+        # Tombstone so offline clients learn about the delete on their next sync
+        await db.hydrant_tombstones.update_one(
+            {"id": hydrant_id},
+            {"$set": {"id": hydrant_id, "version": version, "deleted_at": datetime.now(timezone.utc), "deleted_by": current_user.id}},
+            upsert=True
+        )
+    on_hydrant_deleted(hydrant_id)
+    await apply_hydrant_rollup(deleted, None)
     
     return {"message": "Hydrant deleted successfully"}
 
+# ===== HYDRANT INSPECTIONS & ROLLUPS =====
+# Every check is appended to hydrant_inspections, so history is never overwritten.
+# hydrant_rollups holds one summary document maintained with $inc on each write;
+# the dashboard reads it with a single point lookup.
+
+HYDRANT_ROLLUP_PROJECTION = {**HYDRANT_INDEX_PROJECTION, "dvd_area": 1, "last_check": 1}
+HYDRANT_INSPECTION_INTERVAL_DAYS = int(os.environ.get('HYDRANT_INSPECTION_INTERVAL_DAYS', 365))
+HYDRANT_ROLLUP_ID = "summary"
+
+def hydrant_inspection_entry(before: Optional[dict], after: dict, checked_by: str, checked_by_name: str,
+                             checked_at: Optional[datetime] = None) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "hydrant_id": after["id"],
+        "status": after.get("status"),
+        "previous_status": before.get("status") if before else None,
+        "tip_hidranta": after.get("tip_hidranta"),
+        "dvd_area": after.get("dvd_area"),
+        "notes": after.get("notes"),
+        "checked_by": checked_by,
+        "checked_by_name": checked_by_name,
+        "checked_at": checked_at or datetime.now(timezone.utc),
+    }
+
+async def record_hydrant_inspection(before: Optional[dict], after: dict, inspector: User):
+    await db.hydrant_inspections.insert_one(
+        hydrant_inspection_entry(before, after, inspector.id, inspector.full_name, after.get("last_check"))
+    )
+
+def _check_month(last_check) -> str:
+    if isinstance(last_check, str):
+        try:
+            last_check = datetime.fromisoformat(last_check.replace('Z', '+00:00'))
+        except ValueError:
+            return "never"
+    return last_check.strftime('%Y-%m') if isinstance(last_check, datetime) else "never"
+
+def hydrant_rollup_contributions(hydrant: dict) -> Dict[str, int]:
+    """Dotted rollup counters one hydrant adds to the summary"""
+    status = hydrant.get("status") or "working"
+    area = (hydrant.get("dvd_area") or NO_DVD_AREA).replace('.', '_')
+    return {
+        "total": 1,
+        f"by_status.{status}": 1,
+        f"by_type.{hydrant.get('tip_hidranta') or 'nadzemni'}": 1,
+        f"by_area.{area}.total": 1,
+        f"by_area.{area}.{status}": 1,
+        f"by_check_month.{_check_month(hydrant.get('last_check'))}": 1,
+    }
+
+async def apply_hydrant_rollup(before: Optional[dict], after: Optional[dict]):
+    increments: Dict[str, int] = {}
+    for hydrant, sign in ((before, -1), (after, 1)):
+        if hydrant:
+            for key, value in hydrant_rollup_contributions(hydrant).items():
+                increments[key] = increments.get(key, 0) + sign * value
+    increments = {k: v for k, v in increments.items() if v}
+    if increments:
+        await db.hydrant_rollups.update_one({"_id": HYDRANT_ROLLUP_ID}, {"$inc": increments}, upsert=True)
+
+async def rebuild_hydrant_rollups():
+    """Recompute the summary from scratch (startup when missing, after bulk imports)"""
+    summary: Dict[str, Any] = {}
+    async for hydrant in db.hydrants.find({}, HYDRANT_ROLLUP_PROJECTION):
+        for key, value in hydrant_rollup_contributions(hydrant).items():
+            *parents, leaf = key.split('.')
+            node = summary
+            for part in parents:
+                node = node.setdefault(part, {})
+            node[leaf] = node.get(leaf, 0) + value
+    await db.hydrant_rollups.replace_one({"_id": HYDRANT_ROLLUP_ID}, summary, upsert=True)
+
+@api_router.get("/hydrants/stats")
+async def get_hydrant_stats(current_user: User = Depends(get_current_user)):
+    """Counts by status, type and DVD area plus overdue inspections, from the rollup document"""
+    summary = await db.hydrant_rollups.find_one({"_id": HYDRANT_ROLLUP_ID}, {"_id": 0}) or {}
+    # Month granularity: checks from before the cutoff month are overdue
+    cutoff_month = (datetime.now(timezone.utc) - timedelta(days=HYDRANT_INSPECTION_INTERVAL_DAYS)).strftime('%Y-%m')
+    by_month = summary.pop("by_check_month", {})
+    overdue = sum(count for month, count in by_month.items() if month == "never" or month < cutoff_month)
+    return {
+        "total": summary.get("total", 0),
+        "by_status": summary.get("by_status", {}),
+        "by_type": summary.get("by_type", {}),
+        "by_area": summary.get("by_area", {}),
+        "overdue_inspections": overdue,
+        "inspection_interval_days": HYDRANT_INSPECTION_INTERVAL_DAYS,
+    }
+
+@api_router.post("/hydrants/{hydrant_id}/photos")
+async def upload_hydrant_photos(
+    hydrant_id: str,
+    files: List[UploadFile] = File(...),
+    current_user: User = Depends(get_current_user)
+):
+    """Attach photos to a hydrant (multipart/form-data)"""
+    if not has_hydrant_management_permission(current_user):
+        raise HTTPException(status_code=403, detail="Access denied")
+    if not await db.hydrants.find_one({"id": hydrant_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Hydrant not found")
+    media = await store_media_uploads(files, current_user.id)
+    async with hydrant_versions() as (version,):
+        await db.hydrants.update_one(
+            {"id": hydrant_id},
+            {"$push": {"images": {"$each": [m["url"] for m in media]}},
+             "$set": {"version": version, "updated_at": datetime.now(timezone.utc)}}
+        )
+    return media
+
+@api_router.get("/hydrants/{hydrant_id}/inspections")
+async def get_hydrant_inspections(
+    hydrant_id: str,
+    limit: int = Query(50, ge=1, le=500),
+    current_user: User = Depends(get_current_user)
+):
+    """Inspection history of a hydrant, newest first"""
+    return await db.hydrant_inspections.find({"hydrant_id": hydrant_id}, {"_id": 0}) \
+        .sort("checked_at", -1).limit(limit).to_list(length=None)
+
+# ===== HYDRANT COVERAGE =====
+# DVD areas rasterized into a grid in EPSG:3765 meters. For every cell we keep
+# the squared distance to the nearest working hydrant and that hydrant's slot,
+# so a status change only touches the cells the hydrant can reach: adding one
+# lowers distances inside its window, removing one re-seeds only the cells it
+# was nearest to. Distances beyond HYDRANT_COVERAGE_MAX_DISTANCE_M stay inf.
+# The model is only touched from one background thread, so raster updates and
+# summaries never block the event loop and never see each other half-done.
+
+HYDRANT_COVERAGE_CELL_M = float(os.environ.get('HYDRANT_COVERAGE_CELL_M', 25))
+HYDRANT_COVERAGE_RADIUS_M = float(os.environ.get('HYDRANT_COVERAGE_RADIUS_M', 150))
+HYDRANT_COVERAGE_MAX_DISTANCE_M = float(os.environ.get('HYDRANT_COVERAGE_MAX_DISTANCE_M', 600))
+HYDRANT_COVERAGE_MAX_GAPS = 500
+
+def _rasterize_polygons(polygons: List[list], xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+    """Boolean mask of cell centers inside any polygon (even-odd per polygon, so holes stay out)"""
+    mask = np.zeros((len(ys), len(xs)), dtype=bool)
+    for polygon in polygons:
+        edges = []
+        for ring in polygon:
+            pts = np.asarray(ring, dtype=float)[:, :2]
+            edges.append(np.hstack([pts, np.roll(pts, -1, axis=0)]))
+        x1, y1, x2, y2 = np.vstack(edges).T
+        y_low, y_high = np.minimum(y1, y2), np.maximum(y1, y2)
+        for row, y in enumerate(ys):
+            # Half-open span so a vertex on the scanline is counted once; flat edges never match
+            crossing = (y_low <= y) & (y < y_high)
+            if not crossing.any():
+                continue
+            cx = x1[crossing] + (y - y1[crossing]) * (x2[crossing] - x1[crossing]) / (y2[crossing] - y1[crossing])
+            cx.sort()
+            mask[row] |= np.searchsorted(cx, xs) % 2 == 1
+    return mask
+
+class HydrantCoverageModel:
+    def __init__(self, areas: List[dict], cell_m: float, max_distance_m: float):
+        self.cell = cell_m
+        self.max_distance = max_distance_m
+        self.areas = areas
+        if areas:
+            min_x = min(a["bbox"][0] for a in areas)
+            min_y = min(a["bbox"][1] for a in areas)
+            max_x = max(a["bbox"][2] for a in areas)
+            max_y = max(a["bbox"][3] for a in areas)
+        else:
+            min_x = min_y = max_x = max_y = 0.0
+        self.x0, self.y0 = min_x, min_y
+        nx = max(int(math.ceil((max_x - min_x) / cell_m)), 1)
+        ny = max(int(math.ceil((max_y - min_y) / cell_m)), 1)
+        self.xs = min_x + (np.arange(nx) + 0.5) * cell_m
+        self.ys = min_y + (np.arange(ny) + 0.5) * cell_m
+        self.area_masks = [_rasterize_polygons(a["polygons"], self.xs, self.ys) for a in areas]
+        self.clear()
+
+    def clear(self):
+        shape = (len(self.ys), len(self.xs))
+        self.dist2 = np.full(shape, np.inf)
+        self.nearest = np.full(shape, -1, dtype=np.int32)
+        self.slots: Dict[str, int] = {}
+        self.hx: List[float] = []
+        self.hy: List[float] = []
+        self.active: List[bool] = []
+        self._summaries: Dict[float, dict] = {}
+
+    def load(self, hydrants: List[dict]):
+        self.clear()
+        for hydrant in hydrants:
+            self.upsert(hydrant)
+
+    def quantize_radius(self, radius_m: float) -> float:
+        """Whole cells up to the max distance - finer radii can't change the raster answer"""
+        return min(max(round(radius_m / self.cell), 1) * self.cell, self.max_distance)
+
+    def _window(self, x: float, y: float):
+        d = self.max_distance
+        i0 = max(int((x - d - self.x0) // self.cell), 0)
+        i1 = min(int((x + d - self.x0) // self.cell) + 1, len(self.xs))
+        j0 = max(int((y - d - self.y0) // self.cell), 0)
+        j1 = min(int((y + d - self.y0) // self.cell) + 1, len(self.ys))
+        return i0, i1, j0, j1
+
+    def _seed(self, slot: int):
+        x, y = self.hx[slot], self.hy[slot]
+        i0, i1, j0, j1 = self._window(x, y)
+        if i0 >= i1 or j0 >= j1:
+            return
+        d2 = (self.xs[i0:i1] - x)[None, :] ** 2 + (self.ys[j0:j1] - y)[:, None] ** 2
+        d2[d2 > self.max_distance ** 2] = np.inf
+        dist2 = self.dist2[j0:j1, i0:i1]
+        better = d2 < dist2
+        dist2[better] = d2[better]
+        self.nearest[j0:j1, i0:i1][better] = slot
+
+    def _unseed(self, slot: int):
+        self.active[slot] = False
+        affected = self.nearest == slot
+        if not affected.any():
+            return
+        self.dist2[affected] = np.inf
+        self.nearest[affected] = -1
+        rows, cols = np.nonzero(affected)
+        reach = self.max_distance
+        min_x, max_x = self.xs[cols.min()] - reach, self.xs[cols.max()] + reach
+        min_y, max_y = self.ys[rows.min()] - reach, self.ys[rows.max()] + reach
+        hx, hy, active = np.asarray(self.hx), np.asarray(self.hy), np.asarray(self.active)
+        candidates = np.nonzero(active & (hx >= min_x) & (hx <= max_x) & (hy >= min_y) & (hy <= max_y))[0]
+        # Re-seeding whole windows is safe: cells not affected already hold their minimum
+        for candidate in candidates:
+            self._seed(int(candidate))
+
+    def upsert(self, hydrant: dict):
+        """Add, move or drop a hydrant depending on its status; returns True if the raster changed"""
+        hydrant_id = hydrant["id"]
+        working = hydrant.get("status") == "working"
+        slot = self.slots.get(hydrant_id)
+        if working:
+            x, y = wgs84_to_htrs96(hydrant["latitude"], hydrant["longitude"])
+            if slot is not None and self.active[slot] and (self.hx[slot], self.hy[slot]) == (x, y):
+                return False
+        elif slot is None or not self.active[slot]:
+            return False
+        if slot is not None and self.active[slot]:
+            self._unseed(slot)
+        if working:
+            if slot is None:
+                slot = len(self.hx)
+                self.slots[hydrant_id] = slot
+                self.hx.append(x)
+                self.hy.append(y)
+                self.active.append(True)
+            else:
+                self.hx[slot], self.hy[slot] = x, y
+                self.active[slot] = True
+            self._seed(slot)
+        self._summaries.clear()
+        return True
+
+    def remove(self, hydrant_id: str):
+        slot = self.slots.get(hydrant_id)
+        if slot is not None and self.active[slot]:
+            self._unseed(slot)
+            self._summaries.clear()
+
+    def _gap_polygons(self, gaps: np.ndarray) -> tuple:
+        """Merge uncovered cells into rectangles (row runs stacked while they line up), as lon/lat rings"""
+        rectangles, open_runs = [], {}
+        for row in range(gaps.shape[0] + 1):
+            runs = set()
+            if row < gaps.shape[0]:
+                edges = np.diff(np.concatenate(([0], gaps[row].view(np.int8), [0])))
+                runs = set(zip(np.nonzero(edges == 1)[0].tolist(), np.nonzero(edges == -1)[0].tolist()))
+            for run in list(open_runs):
+                if run not in runs:
+                    rectangles.append((run[0], run[1], open_runs.pop(run), row))
+            for run in runs:
+                open_runs.setdefault(run, row)
+        rectangles.sort(key=lambda r: (r[1] - r[0]) * (r[3] - r[2]), reverse=True)
+        polygons = []
+        for i0, i1, j0, j1 in rectangles[:HYDRANT_COVERAGE_MAX_GAPS]:
+            x0, x1 = self.x0 + i0 * self.cell, self.x0 + i1 * self.cell
+            y0, y1 = self.y0 + j0 * self.cell, self.y0 + j1 * self.cell
+            ring = [htrs96_to_wgs84(x, y) for x, y in ((x0, y0), (x1, y0), (x1, y1), (x0, y1), (x0, y0))]
+            polygons.append([[[round(lon, 6), round(lat, 6)] for lat, lon in ring]])
+        return polygons, len(rectangles)
+
+    def summary(self, radius_m: float) -> dict:
+        """Coverage per area for the given radius (rounded to whole cells); cached until the next raster change"""
+        radius_m = self.quantize_radius(radius_m)
+        cached = self._summaries.get(radius_m)
+        if cached is not None:
+            return cached
+        covered = self.dist2 <= radius_m ** 2
+        cell_area = self.cell ** 2
+        areas = []
+        for area, mask in zip(self.areas, self.area_masks):
+            total = int(mask.sum())
+            gaps = mask & ~covered
+            covered_cells = total - int(gaps.sum())
+            polygons, gap_count = self._gap_polygons(gaps)
+            areas.append({
+                "name": area["name"],
+                "area_m2": total * cell_area,
+                "covered_m2": covered_cells * cell_area,
+                "gap_m2": (total - covered_cells) * cell_area,
+                "coverage_pct": round(100 * covered_cells / total, 1) if total else None,
+                "gap_count": gap_count,
+                "gaps": {"type": "MultiPolygon", "coordinates": polygons},
+            })
+        self._summaries[radius_m] = {
+            "radius_m": radius_m,
+            "cell_size_m": self.cell,
+            "working_hydrants": sum(self.active),
+            "computed_at": datetime.now(timezone.utc).isoformat(),
+            "areas": areas,
+        }
+        return self._summaries[radius_m]
+
+hydrant_coverage = HydrantCoverageModel(DVD_AREAS, HYDRANT_COVERAGE_CELL_M, HYDRANT_COVERAGE_MAX_DISTANCE_M)
+_coverage_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="hydrant-coverage")
+
+async def run_coverage(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_coverage_executor, fn, *args)
+
+def _report_coverage_error(future):
+    if not future.cancelled() and future.exception() is not None:
+        print(f"❌ Hydrant coverage update failed: {future.exception()}")
+
+def submit_coverage(fn, *args):
+    """Queue a raster update behind earlier ones without waiting for it"""
+    _coverage_executor.submit(fn, *args).add_done_callback(_report_coverage_error)
+
+@api_router.get("/hydrants/coverage")
+async def get_hydrant_coverage(
+    radius: float = Query(HYDRANT_COVERAGE_RADIUS_M, gt=0, le=HYDRANT_COVERAGE_MAX_DISTANCE_M),
+    area: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Share of each DVD area within `radius` meters of a working hydrant, with gap polygons (GeoJSON, WGS84)"""
+    if not hydrant_coverage.areas:
+        raise HTTPException(status_code=503, detail="DVD područja nisu učitana")
+    result = await run_coverage(hydrant_coverage.summary, radius)
+    if area:
+        areas = [a for a in result["areas"] if a["name"] == area]
+        if not areas:
+            raise HTTPException(status_code=404, detail="Područje nije pronađeno")
+        result = {**result, "areas": areas}
+    return result
+
+# ===== HYDRANT BULK IMPORT =====
+# Streams GeoJSON (feature by feature) or CSV (chunk by chunk) from a file object,
+# reprojects, validates and writes batches with bulk_write. Rows that carry an
+# external ID are upserted on it, so the utility's register can be re-imported;
+# an ID repeated within one file is reported as a row error, and status changes
+# of existing hydrants go to the inspection history like a manual update.
+
+HYDRANT_IMPORT_BATCH_SIZE = 500
+HYDRANT_IMPORT_READ_SIZE = 256 * 1024
+HYDRANT_STATUSES = ["working", "broken", "maintenance"]
+HYDRANT_TYPES = ["nadzemni", "podzemni"]
+HYDRANT_IMPORT_ID_FIELDS = ["external_id", "id", "ID", "oznaka", "broj"]
+
+GEOJSON_TAIL_PROBE_SIZE = 64 * 1024
+_JSON_MEMBER_SEPARATOR = re.compile(r'[\s,]*')
+_JSON_COLON = re.compile(r'\s*:\s*')
+
+def _geojson_crs_name(crs_obj) -> Optional[str]:
+    try:
+        return (crs_obj.get("properties") or {}).get("name")
+    except AttributeError:
+        return None
+
+def _parse_trailing_members(text: str, pos: int) -> Optional[dict]:
+    """Members from pos up to the closing brace of the top-level object, or None
+    if text[pos:] isn't the end of the object (e.g. it's inside a feature)"""
+    decoder = json.JSONDecoder()
+    members = {}
+    while True:
+        pos = _JSON_MEMBER_SEPARATOR.match(text, pos).end()
+        if pos >= len(text):
+            return members  # tolerate a missing closing brace
+        if text[pos] == "}":
+            return members if not text[pos + 1:].strip() else None
+        try:
+            key, pos = decoder.raw_decode(text, pos)
+            colon = _JSON_COLON.match(text, pos)
+            if not isinstance(key, str) or not colon:
+                return None
+            members[key], pos = decoder.raw_decode(text, colon.end())
+        except ValueError:
+            return None
+
+def _probe_trailing_geojson_crs(fileobj) -> Optional[str]:
+    """crs member after the features array, looked for in the end of a seekable file"""
+    if not fileobj.seekable():
+        return None
+    start = fileobj.tell()
+    fileobj.seek(0, os.SEEK_END)
+    fileobj.seek(max(start, fileobj.tell() - GEOJSON_TAIL_PROBE_SIZE))
+    tail = fileobj.read().decode('utf-8', errors='ignore')
+    fileobj.seek(start)
+    decoder = json.JSONDecoder()
+    for match in reversed(list(re.finditer(r'"crs"\s*:\s*', tail))):
+        try:
+            crs_obj, end = decoder.raw_decode(tail, match.end())
+        except ValueError:
+            continue
+        if _parse_trailing_members(tail, end) is not None:
+            return _geojson_crs_name(crs_obj)
+    return None
+
+async def _scan_geojson(fileobj):
+    """Stream a FeatureCollection: yield ("crs", name) for the top-level crs member,
+    wherever it is, and ("feature", obj) for each feature"""
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    buffer, pos, stage, eof = "", 0, "header", False
+
+    while True:
+        if stage == "header":
+            marker = re.search(r'"features"\s*:\s*\[', buffer)
+            if marker:
+                header = buffer[:marker.start()]
+                crs_match = re.search(r'"crs"\s*:\s*', header)
+                if crs_match:
+                    try:
+                        crs_obj, _ = decoder.raw_decode(header, crs_match.end())
+                        yield "crs", _geojson_crs_name(crs_obj)
+                    except ValueError:
+                        pass
+                pos, stage = marker.end(), "features"
+            elif eof:
+                raise ValueError("GeoJSON nema 'features' listu")
+        if stage == "features":
+            while True:
+                while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                    pos += 1
+                if pos < len(buffer) and buffer[pos] == "]":
+                    pos, stage = pos + 1, "tail"
+                    break
+                try:
+                    feature, end = decoder.raw_decode(buffer, pos)
+                except ValueError:
+                    if eof:
+                        raise ValueError("GeoJSON je neispravan ili nepotpun")
+                    break  # feature continues in the next chunk
+                pos = end
+                yield "feature", feature
+            buffer, pos = buffer[pos:], 0
+        if eof:
+            if stage == "tail":
+                # Members after the array are small, parsed once the file is read
+                crs_obj = (_parse_trailing_members(buffer, 0) or {}).get("crs")
+                if crs_obj is not None:
+                    yield "crs", _geojson_crs_name(crs_obj)
+            return
+        chunk = await asyncio.to_thread(fileobj.read, HYDRANT_IMPORT_READ_SIZE)
+        eof = not chunk
+        buffer += text_decoder.decode(chunk or b"", final=eof)
+
+async def _iter_geojson_features(fileobj):
+    """Yield (crs_name, feature) from a FeatureCollection without loading the whole file.
+    A crs placed after the features array is probed from the end of the file first;
+    if it only turns up after features were already yielded, the import fails
+    instead of placing points in the wrong reference system."""
+    crs = await asyncio.to_thread(_probe_trailing_geojson_crs, fileobj)
+    yielded = False
+    async for kind, value in _scan_geojson(fileobj):
+        if kind == "feature":
+            yielded = True
+            yield crs, value
+        elif not yielded or value == crs:
+            crs = value
+        else:
+            raise ValueError("GeoJSON 'crs' je iza 'features' - navedite crs parametrom")
+
+async def _iter_csv_rows(fileobj):
+    reader = await asyncio.to_thread(
+        pd.read_csv, fileobj, dtype=str, keep_default_na=False,
+        chunksize=HYDRANT_IMPORT_BATCH_SIZE, sep=None, engine='python'
+    )
+    while True:
+        chunk = await asyncio.to_thread(next, reader, None)
+        if chunk is None:
+            return
+        for row in chunk.to_dict(orient="records"):
+            yield {str(k).strip(): v for k, v in row.items()}
+
+def _pick(properties: dict, *names):
+    lowered = {str(k).lower(): v for k, v in properties.items()}
+    for name in names:
+        value = lowered.get(name.lower())
+        if value not in (None, ""):
+            return value
+    return None
+
+def _normalize_import_record(properties: dict, x, y, crs: Optional[str], id_field: Optional[str]) -> dict:
+    """Validate one source record and map it to hydrant fields"""
+    if x in (None, "") or y in (None, ""):
+        raise ValueError("Nedostaju koordinate")
+    x, y = float(str(x).replace(',', '.')), float(str(y).replace(',', '.'))
+    if crs is None and (abs(x) > 180 or abs(y) > 90):
+        raise ValueError("Koordinate izgledaju projicirano - navedite crs=EPSG:3765")
+    lat, lon = to_wgs84(x, y, crs)
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError(f"Koordinate izvan raspona: {lat}, {lon}")
+
+    record = {"latitude": round(lat, 7), "longitude": round(lon, 7)}
+    external_id = _pick(properties, id_field) if id_field else _pick(properties, *HYDRANT_IMPORT_ID_FIELDS)
+    if external_id is not None:
+        record["external_id"] = str(external_id).strip()
+
+    status = _pick(properties, "status", "stanje")
+    if status is not None:
+        status = str(status).strip().lower()
+        if status not in HYDRANT_STATUSES:
+            raise ValueError(f"Nepoznat status '{status}'")
+        record["status"] = status
+    tip = _pick(properties, "tip_hidranta", "tip", "vrsta")
+    if tip is not None:
+        tip = str(tip).strip().lower()
+        if tip not in HYDRANT_TYPES:
+            raise ValueError(f"Nepoznat tip hidranta '{tip}'")
+        record["tip_hidranta"] = tip
+    for field, names in (("address", ("address", "adresa")), ("notes", ("notes", "napomena"))):
+        value = _pick(properties, *names)
+        if value is not None:
+            record[field] = str(value)
+    return record
+
+async def _iter_hydrant_import_records(fileobj, file_format: str, crs: Optional[str], id_field: Optional[str]):
+    """Yield (row_number, record or None, error or None)"""
+    row_number = 0
+    if file_format == "geojson":
+        async for file_crs, feature in _iter_geojson_features(fileobj):
+            row_number += 1
+            try:
+                geometry = feature.get("geometry") or {}
+                coordinates = geometry.get("coordinates")
+                if geometry.get("type") == "MultiPoint" and coordinates:
+                    coordinates = coordinates[0]
+                if geometry.get("type") not in ("Point", "MultiPoint") or not coordinates:
+                    raise ValueError(f"Geometrija mora biti Point, a ne {geometry.get('type')}")
+                properties = feature.get("properties") or {}
+                if id_field is None and feature.get("id") is not None:
+                    properties = {"external_id": feature["id"], **properties}
+                yield row_number, _normalize_import_record(properties, coordinates[0], coordinates[1], crs or file_crs, id_field), None
+            except (ValueError, TypeError, AttributeError, IndexError) as e:
+                yield row_number, None, str(e)
+    else:
+        row_number = 1  # header
+        async for row in _iter_csv_rows(fileobj):
+            row_number += 1
+            try:
+                if crs in HTRS96_CRS_NAMES:
+                    x, y = _pick(row, "x", "easting", "e"), _pick(row, "y", "northing", "n")
+                else:
+                    x, y = _pick(row, "longitude", "lon", "lng", "x"), _pick(row, "latitude", "lat", "y")
+                yield row_number, _normalize_import_record(row, x, y, crs, id_field), None
+            except (ValueError, TypeError) as e:
+                yield row_number, None, str(e)
+
+async def _write_hydrant_import_batch(rows: List[tuple], imported_by: str, imported_by_name: str, report: dict):
+    """Upsert records with an external ID, insert the rest"""
+    now = datetime.now(timezone.utc)
+    external_ids = [record["external_id"] for _, record in rows if "external_id" in record]
+    existing = {}
+    if external_ids:
+        async for hydrant in db.hydrants.find({"external_id": {"$in": external_ids}},
+                                              {**HYDRANT_ROLLUP_PROJECTION, "external_id": 1, "notes": 1}):
+            existing[hydrant["external_id"]] = hydrant
+
+    async with hydrant_versions(len(rows)) as versions:
+        operations = []
+        for (row_number, record), version in zip(rows, versions):
+            fields = {**record, "location": hydrant_geo_point(record["latitude"], record["longitude"]),
+                      "dvd_area": dvd_area_for(record["latitude"], record["longitude"]),
+                      "version": version, "updated_at": now}
+            defaults = {"status": "working", "tip_hidranta": "nadzemni", "address": None, "notes": None}
+            on_insert = {"id": str(uuid.uuid4()), "images": [], "last_check": None,
+                         "checked_by": imported_by, "created_at": now,
+                         **{k: v for k, v in defaults.items() if k not in fields}}
+            if "external_id" in record:
+                operations.append(UpdateOne({"external_id": record["external_id"]},
+                                            {"$set": fields, "$setOnInsert": on_insert}, upsert=True))
+            else:
+                operations.append(InsertOne({**on_insert, **fields}))
+        failed_indexes = set()
+        try:
+            result = await db.hydrants.bulk_write(operations, ordered=False)
+            bulk_result = result.bulk_api_result
+        except BulkWriteError as e:
+            bulk_result = e.details
+            for err in e.details.get("writeErrors", []):
+                failed_indexes.add(err["index"])
+                report["failed"] += 1
+                report["errors"].append({"row": rows[err["index"]][0], "error": err.get("errmsg", "Write error")})
+    report["inserted"] += bulk_result.get("nInserted", 0) + bulk_result.get("nUpserted", 0)
+    report["updated"] += bulk_result.get("nMatched", 0)
+
+    inspections = []
+    for i, (_, record) in enumerate(rows):
+        before = existing.get(record.get("external_id"))
+        if i in failed_indexes or before is None or record.get("status", before.get("status")) == before.get("status"):
+            continue
+        after = {**before, **record, "dvd_area": dvd_area_for(record["latitude"], record["longitude"])}
+        inspections.append(hydrant_inspection_entry(before, after, imported_by, imported_by_name, now))
+    if inspections:
+        await db.hydrant_inspections.insert_many(inspections)
+
+async def import_hydrants(fileobj, file_format: str, crs: Optional[str] = None, id_field: Optional[str] = None,
+                          imported_by: str = "import", dry_run: bool = False,
+                          imported_by_name: str = "Uvoz hidranata") -> dict:
+    started = time.perf_counter()
+    report = {"processed": 0, "inserted": 0, "updated": 0, "failed": 0, "errors": []}
+    batch = []
+    first_rows: Dict[str, int] = {}  # external ID -> row that used it first
+    async for row_number, record, error in _iter_hydrant_import_records(fileobj, file_format, crs, id_field):
+        report["processed"] += 1
+        external_id = record.get("external_id") if record else None
+        if not error and external_id is not None:
+            if external_id in first_rows:
+                error = f"Vanjski ID {external_id} već je u retku {first_rows[external_id]}"
+            else:
+                first_rows[external_id] = row_number
+        if error:
+            report["failed"] += 1
+            report["errors"].append({"row": row_number, "error": error})
+            continue
+        batch.append((row_number, record))
+        if len(batch) >= HYDRANT_IMPORT_BATCH_SIZE:
+            if not dry_run:
+                await _write_hydrant_import_batch(batch, imported_by, imported_by_name, report)
+            batch = []
+    if batch and not dry_run:
+        await _write_hydrant_import_batch(batch, imported_by, imported_by_name, report)
+    if not dry_run and (report["inserted"] or report["updated"]):
+        await rebuild_hydrant_indexes()
+        await rebuild_hydrant_rollups()
+
+    elapsed = time.perf_counter() - started
+    report["elapsed_ms"] = round(elapsed * 1000)
+    report["rows_per_second"] = round(report["processed"] / elapsed) if elapsed > 0 else report["processed"]
+    report["dry_run"] = dry_run
+    report["errors"] = report["errors"][:500]
+    return report
+
+def _detect_import_format(filename: Optional[str], file_format: Optional[str]) -> str:
+    if file_format:
+        file_format = file_format.lower()
+    elif filename and filename.lower().endswith('.csv'):
+        file_format = "csv"
+    else:
+        file_format = "geojson"
+    if file_format not in ("geojson", "csv"):
+        raise HTTPException(status_code=400, detail="Podržani formati: geojson, csv")
+    return file_format
+
+@api_router.post("/hydrants/import")
+async def import_hydrants_endpoint(
+    file: UploadFile = File(...),
+    format: Optional[str] = Query(None, description="geojson or csv, detected from the file name by default"),
+    crs: Optional[str] = Query(None, description="Source CRS, e.g. EPSG:3765. GeoJSON 'crs' member is used otherwise"),
+    id_field: Optional[str] = Query(None, description="Property holding the external hydrant ID"),
+    dry_run: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    """Bulk import hydrants from GeoJSON or CSV, upserting on the external ID"""
+    if not has_hydrant_management_permission(current_user):
+        raise HTTPException(status_code=403, detail="Access denied")
+    file_format = _detect_import_format(file.filename, format)
+    try:
+        report = await import_hydrants(file.file, file_format, crs, id_field, current_user.id, dry_run,
+                                       current_user.full_name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    print(f"📥 Hydrant import by {current_user.username}: {report['inserted']} inserted, {report['updated']} updated, {report['failed']} failed ({report['rows_per_second']} rows/s)")
+    return report
+
+# ===== HYDRANT EXPORT =====
+# Streams the register straight from the cursor in ~64 KB chunks; image
+# references are left out, the recipients get positions and attributes only.
+
+HYDRANT_EXPORT_FIELDS = ["id", "external_id", "latitude", "longitude", "address", "status", "tip_hidranta",
+                         "dvd_area", "last_check", "checked_by", "notes", "created_at", "updated_at", "version"]
+HYDRANT_EXPORT_CHUNK_SIZE = 64 * 1024
+HYDRANT_EXPORT_FORMATS = {
+    "geojson": ("application/geo+json", "geojson"),
+    "kml": ("application/vnd.google-earth.kml+xml", "kml"),
+    "csv": ("text/csv; charset=utf-8", "csv"),
+}
+
+def _export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def _hydrant_geojson_feature(hydrant: dict, projected: bool) -> str:
+    if projected:
+        x, y = wgs84_to_htrs96(hydrant["latitude"], hydrant["longitude"])
+        coordinates = [round(x, 3), round(y, 3)]
+    else:
+        coordinates = [hydrant["longitude"], hydrant["latitude"]]
+    properties = {field: _export_value(hydrant.get(field)) for field in HYDRANT_EXPORT_FIELDS
+                  if field not in ("id", "latitude", "longitude")}
+    return json.dumps({"type": "Feature", "id": hydrant["id"],
+                       "geometry": {"type": "Point", "coordinates": coordinates},
+                       "properties": properties}, ensure_ascii=False)
+
+def _hydrant_kml_placemark(hydrant: dict) -> str:
+    data = "".join(
+        f'<Data name="{field}"><value>{xml_escape(str(_export_value(hydrant[field])))}</value></Data>'
+        for field in HYDRANT_EXPORT_FIELDS if hydrant.get(field) not in (None, "")
+    )
+    name = xml_escape(hydrant.get("address") or hydrant.get("external_id") or hydrant["id"])
+    return (f'<Placemark id="{xml_escape(hydrant["id"])}"><name>{name}</name>'
+            f'<ExtendedData>{data}</ExtendedData>'
+            f'<Point><coordinates>{hydrant["longitude"]},{hydrant["latitude"]}</coordinates></Point></Placemark>\n')
+
+async def iter_hydrant_export(query: dict, file_format: str, projected: bool = False):
+    """Yield the export as encoded chunks, reading the cursor in batches"""
+    cursor = db.hydrants.find(query, {"_id": 0, "images": 0, "location": 0}).sort("id", 1).batch_size(500)
+    parts, size = [], 0
+    csv_buffer = io.StringIO()
+    csv_writer = csv.writer(csv_buffer)
+
+    if file_format == "geojson":
+        crs = '"crs":{"type":"name","properties":{"name":"EPSG:3765"}},' if projected else ""
+        parts.append(f'{{"type":"FeatureCollection",{crs}"features":[\n')
+    elif file_format == "kml":
+        parts.append('<?xml version="1.0" encoding="UTF-8"?>\n'
+                     '<kml xmlns="http://www.opengis.net/kml/2.2"><Document><name>Hidranti</name>\n')
+    else:
+        # BOM so Excel opens the Croatian characters correctly
+        columns = ["x", "y"] + HYDRANT_EXPORT_FIELDS if projected else HYDRANT_EXPORT_FIELDS
+        csv_writer.writerow(columns)
+        parts.append("\ufeff" + csv_buffer.getvalue())
+
+    first = True
+    async for hydrant in cursor:
+        if file_format == "geojson":
+            part = ("" if first else ",\n") + _hydrant_geojson_feature(hydrant, projected)
+        elif file_format == "kml":
+            part = _hydrant_kml_placemark(hydrant)
+        else:
+            csv_buffer.seek(0)
+            csv_buffer.truncate()
+            row = [_export_value(hydrant.get(field)) for field in HYDRANT_EXPORT_FIELDS]
+            if projected:
+                x, y = wgs84_to_htrs96(hydrant["latitude"], hydrant["longitude"])
+                row = [round(x, 3), round(y, 3)] + row
+            csv_writer.writerow(row)
+            part = csv_buffer.getvalue()
+        first = False
+        parts.append(part)
+        size += len(part)
+        if size >= HYDRANT_EXPORT_CHUNK_SIZE:
+            yield "".join(parts).encode("utf-8")
+            parts, size = [], 0
+
+    if file_format == "geojson":
+        parts.append("\n]}\n")
+    elif file_format == "kml":
+        parts.append("</Document></kml>\n")
+    if parts:
+        yield "".join(parts).encode("utf-8")
+
+@api_router.get("/hydrants/export")
+async def export_hydrants(
+    format: str = Query("geojson", description="geojson, kml or csv"),
+    crs: Optional[str] = Query(None, description="EPSG:3765 for HTRS96/TM coordinates (geojson, csv); WGS84 by default"),
+    status: Optional[str] = None,
+    dvd_area: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Download the hydrant register without images"""
+    file_format = format.lower()
+    if file_format not in HYDRANT_EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Podržani formati: geojson, kml, csv")
+    projected = crs in HTRS96_CRS_NAMES
+    if crs is not None and not projected and crs not in WGS84_CRS_NAMES:
+        raise HTTPException(status_code=400, detail=f"Nepodržan CRS '{crs}'")
+    if projected and file_format == "kml":
+        raise HTTPException(status_code=400, detail="KML je uvijek u WGS84")
+
+    query = {}
+    if status:
+        query["status"] = status
+    if dvd_area:
+        query["dvd_area"] = dvd_area
+    media_type, extension = HYDRANT_EXPORT_FORMATS[file_format]
+    filename = f"hidranti_{datetime.now().strftime('%Y%m%d')}.{extension}"
+    return StreamingResponse(
+        iter_hydrant_export(query, file_format, projected),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
 # ===== DVD LOGO MANAGEMENT =====
 
 @api_router.post("/init-logos")
@@ -1806,12 +4996,15 @@ async def root():
 # Include the router in the main app
 app.include_router(api_router)
 
+app.add_middleware(MediaUploadLimitMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=CHAT_CURSOR_HEADERS,
 )
 
 # Configure logging
@@ -1821,9 +5014,185 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+async def run_startup_backfill(name: str, target, backfill):
+    """Run a backfill once per database; a target that already holds data counts as done.
+
+    Every worker calls this at startup, so the backfills themselves are written
+    as idempotent upserts - two workers racing through the same one end up
+    with the same documents instead of a DuplicateKeyError.
+    """
+    if await db.migrations.find_one({"_id": name}, {"_id": 1}):
+        return
+    if not await target.find_one({}, {"_id": 1}):
+        await backfill()
+    await db.migrations.update_one(
+        {"_id": name}, {"$setOnInsert": {"completed_at": datetime.now(timezone.utc)}}, upsert=True
+    )
+
+@app.on_event("startup")
+async def ensure_indexes():
+    """Create indexes and backfill fields that queries depend on"""
+    # Hydrants: GeoJSON point for viewport (bbox) and near queries
+    await db.hydrants.update_many(
+        {"location": {"$exists": False}, "latitude": {"$type": "number"}, "longitude": {"$type": "number"}},
+        [{"$set": {"location": {"type": "Point", "coordinates": ["$longitude", "$latitude"]}}}]
+    )
+    await db.hydrants.create_index("id", unique=True)
+    try:
+        await db.hydrants.create_index([("location", "2dsphere")])
+    except Exception as e:
+        print(f"❌ Could not create 2dsphere index on hydrants (invalid coordinates?): {e}")
+
+    # Hydrants: versions for delta sync (legacy documents get one on first start)
+    unversioned = await db.hydrants.find({"version": {"$exists": False}}, {"_id": 0, "id": 1}).to_list(length=None)
+    if unversioned:
+        async with hydrant_versions(len(unversioned)) as versions:
+            await db.hydrants.bulk_write([
+                UpdateOne({"id": doc["id"]}, {"$set": {"version": version}})
+                for doc, version in zip(unversioned, versions)
+            ], ordered=False)
+    await db.hydrants.create_index("version")
+    await db.hydrants.create_index("external_id", unique=True,
+                                   partialFilterExpression={"external_id": {"$type": "string"}})
+    await db.hydrant_tombstones.create_index("id", unique=True)
+    await db.hydrant_tombstones.create_index("version")
+
+    # Hydrants: DVD area for rollups, inspection history, rollup summary
+    async for hydrant in db.hydrants.find({"dvd_area": {"$exists": False}}, {"_id": 0, "id": 1, "latitude": 1, "longitude": 1}):
+        try:
+            area = dvd_area_for(float(hydrant["latitude"]), float(hydrant["longitude"]))
+        except (KeyError, TypeError, ValueError):
+            area = None
+        await db.hydrants.update_one({"id": hydrant["id"]}, {"$set": {"dvd_area": area}})
+    await db.hydrant_inspections.create_index([("hydrant_id", 1), ("checked_at", -1)])
+    if not await db.hydrant_rollups.find_one({"_id": HYDRANT_ROLLUP_ID}, {"_id": 1}):
+        await rebuild_hydrant_rollups()
+
+    await rebuild_hydrant_indexes()
+
+    # Chat: conversation key for private history, compound indexes for keyset pages
+    await db.chat_messages.update_many(
+        {"conversation_id": {"$exists": False}, "chat_type": "private"},
+        [{"$set": {"conversation_id": {"$concat": [
+            "private:",
+            {"$cond": [{"$lt": ["$sender_id", "$recipient_id"]},
+                       {"$concat": ["$sender_id", ":", "$recipient_id"]},
+                       {"$concat": ["$recipient_id", ":", "$sender_id"]}]}
+        ]}}}]
+    )
+    await db.chat_messages.update_many(
+        {"conversation_id": {"$exists": False}, "chat_type": "group"},
+        [{"$set": {"conversation_id": {"$concat": ["group:", "$group_id"]}}}]
+    )
+    await db.chat_messages.create_index([("chat_type", 1), ("group_id", 1), ("created_at", 1), ("id", 1)])
+    await db.chat_messages.create_index([("conversation_id", 1), ("created_at", 1), ("id", 1)])
+    await db.chat_messages.create_index([("sender_id", 1), ("client_msg_id", 1)], unique=True,
+                                        partialFilterExpression={"client_msg_id": {"$type": "string"}})
+    await db.chat_messages.create_index([("recipient_id", 1), ("created_at", 1)])
+    await db.chat_messages.create_index([("sender_id", 1), ("created_at", 1)])
+    await run_startup_backfill("read_watermarks", db.chat_read_state, backfill_read_watermarks)
+    await db.chat_read_state.create_index("user_id")
+    await run_startup_backfill("unread_counters", db.unread_counters, rebuild_unread_counters)
+    await db.conversations.create_index([("participants", 1), ("last_message_at", -1)])
+
+    # Messages (alerts): multikey index for the department feed, delivery acks
+    await db.messages.create_index([("sent_to_departments", 1), ("created_at", -1), ("id", -1)])
+    await db.message_deliveries.create_index([("message_id", 1), ("user_id", 1)], unique=True)
+
+    await db.chat_archive.create_index([("conversation_id", 1), ("last_at", -1)])
+    await db.chat_archive.create_index([("conversation_id", 1), ("first_at", 1)])
+
+    await db.search_changes.create_index("at", expireAfterSeconds=int(SEARCH_CHANGE_RETENTION.total_seconds()))
+    await rebuild_search_index()
+    await run_startup_backfill("conversations", db.conversations, rebuild_conversations)
+
+_chat_archiver_task: Optional[asyncio.Task] = None
+_hydrant_index_task: Optional[asyncio.Task] = None
+_search_index_task: Optional[asyncio.Task] = None
+
+@app.on_event("startup")
+async def start_background_workers():
+    global _chat_archiver_task, _hydrant_index_task, _search_index_task
+    alert_dispatcher.start()
+    if CHAT_ARCHIVE_AFTER_DAYS > 0:
+        _chat_archiver_task = asyncio.create_task(chat_archiver_loop())
+    if HYDRANT_INDEX_REFRESH_S > 0:
+        _hydrant_index_task = asyncio.create_task(hydrant_index_refresh_loop())
+    if SEARCH_INDEX_REFRESH_S > 0:
+        _search_index_task = asyncio.create_task(search_index_refresh_loop())
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await alert_dispatcher.stop()
+    for task in (_chat_archiver_task, _hydrant_index_task, _search_index_task):
+        if task is not None:
+            task.cancel()
     client.close()
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+    _coverage_executor.shutdown(wait=False, cancel_futures=True)
 
 # Socket.IO is already wrapped in socket_app via socketio.ASGIApp(sio, app)
-# No need to mount it separately - this was causing the routing issue!
\ No newline at end of file
+# No need to mount it separately - this was causing the routing issue!
+
+# ===== CLI =====
+# Administrative commands: python server.py <command> --help
+
+cli = typer.Typer(help="Vatrogasna zajednica - administrativne naredbe")
+
+@cli.command("calibrate-hash")
+def calibrate_hash_command(
+    target_ms: float = typer.Option(250, help="Latency budget for a single password hash"),
+    scheme: str = typer.Option(PASSWORD_HASH_SCHEME, help="bcrypt or argon2"),
+):
+    """Measure hash cost settings and suggest the strongest one within the budget"""
+    results = calibrate_password_hash(target_ms, scheme)
+    for r in results:
+        marker = "  <== recommended" if r["recommended"] else ""
+        print(f"{r['param']}={r['value']:<3} {r['ms']:>8.1f} ms{marker}")
+    recommended = next((r for r in results if r["recommended"]), None)
+    if recommended is None:
+        print(f"⚠️ Even the cheapest setting exceeds {target_ms} ms on this machine")
+        return
+    print("\nAdd to backend/.env:")
+    print(f"PASSWORD_HASH_SCHEME={scheme}")
+    print(f"{recommended['param'].upper()}={recommended['value']}")
+
+@cli.command("migrate-media")
+def migrate_media_command():
+    """Move inline base64 images from hydrants and interventions to the media store"""
+    migrated = asyncio.run(migrate_inline_images())
+    for collection, count in migrated.items():
+        print(f"✅ {collection}: {count} documents migrated")
+
+@cli.command("import-hydrants")
+def import_hydrants_command(
+    path: Path = typer.Argument(..., exists=True, dir_okay=False, help="GeoJSON or CSV file"),
+    format: Optional[str] = typer.Option(None, help="geojson or csv (default: from file extension)"),
+    crs: Optional[str] = typer.Option(None, help="Source CRS, e.g. EPSG:3765"),
+    id_field: Optional[str] = typer.Option(None, help="Property holding the external hydrant ID"),
+    dry_run: bool = typer.Option(False, help="Validate only, don't write"),
+):
+    """Bulk import hydrants from the utility's register"""
+    file_format = _detect_import_format(path.name, format)
+
+    async def run():
+        with open(path, 'rb') as f:
+            return await import_hydrants(f, file_format, crs, id_field, "cli", dry_run)
+
+    report = asyncio.run(run())
+    for error in report["errors"][:20]:
+        print(f"  ❌ row {error['row']}: {error['error']}")
+    print(f"✅ processed {report['processed']}, inserted {report['inserted']}, updated {report['updated']}, "
+          f"failed {report['failed']} in {report['elapsed_ms']} ms ({report['rows_per_second']} rows/s)")
+
+@cli.command("archive-chat")
+def archive_chat_command(
+    older_than_days: int = typer.Option(CHAT_ARCHIVE_AFTER_DAYS, help="Archive messages older than this many days"),
+):
+    """Move old chat messages into the compressed archive now"""
+    moved = asyncio.run(archive_chat_messages(older_than_days))
+    print(f"✅ {moved} messages archived")
+
+if __name__ == "__main__":
+    cli()
\ No newline at end of file
@@ -50,6 +50,21 @@ const transformCoordinates = (coords) => {
   return [lng, lat];
 };
 
+// Upload photos as multipart/form-data - returns media URLs to store in `images`
+const uploadImages = async (files) => {
+  const formData = new FormData();
+  files.forEach(file => formData.append('files', file));
+  const response = await axios.post(`${API}/media`, formData);
+  return response.data.map(media => media.url);
+};
+
+// Absolute URL for media store images (the API may be on another origin than the app),
+// optionally a smaller server-side rendition (thumb, preview, full)
+const mediaUrl = (url, size) => {
+  if (typeof url !== 'string' || !url.startsWith('/api/media/')) return url;
+  return size ? `${BACKEND_URL}${url}?size=${size}` : `${BACKEND_URL}${url}`;
+};
+
 // DVD colors for different areas (using GeoJSON property names)
 const DVD_COLORS = {
   'Područje DVD Lužan Biškupečki': '#ef4444',      // Red
@@ -510,12 +525,25 @@ const MapClickHandler = ({ onMapClick }) => {
   return null;
 };
 
+// Reports the visible map area (minLon,minLat,maxLon,maxLat) on load and after every pan/zoom
+const MapViewportHandler = ({ onViewportChange }) => {
+  const map = useMapEvents({
+    moveend: () => onViewportChange(map.getBounds().toBBoxString()),
+  });
+  useEffect(() => {
+    onViewportChange(map.getBounds().toBBoxString());
+  }, []);
+  return null;
+};
+
 // Main Dashboard Component
 const Dashboard = () => {
   const { user, logout } = useAuth();
   const navigate = useNavigate();
   const [activeUsers, setActiveUsers] = useState([]);
   const [hydrants, setHydrants] = useState([]);
+  const [mapHydrants, setMapHydrants] = useState([]); // Hidranti u vidljivom dijelu karte
+  const mapBbox = useRef(null);
   const [gpsEnabled, setGpsEnabled] = useState(true); // Default: GPS uključen
   const [showDvdAreas, setShowDvdAreas] = useState(true); // Default: DVD područja prikazana
   const [userLocation, setUserLocation] = useState(null);
@@ -529,15 +557,21 @@ const Dashboard = () => {
   const [vehicles, setVehicles] = useState([]);
   const [equipment, setEquipment] = useState([]);
   const [events, setEvents] = useState([]); // Novi: događaji (osiguranja, školovanja, provjere)
-  const [messages, setMessages] = useState([]); // Novi: grupne poruke
+  // Novi: grupne poruke + kursor za starije obavijesti (null = nema ih)
+  const [alertHistory, setAlertHistory] = useState({ messages: [], before: null });
+  const { messages, before: messagesBefore } = alertHistory;
   const [interventions, setInterventions] = useState([]); // Novi: intervencije/izvještaji
-  const [chatMessages, setChatMessages] = useState([]); // Novi: chat poruke
+  // Novi: chat poruke + kursor za starije poruke (null = nema ih)
+  const [chatHistory, setChatHistory] = useState({ messages: [], before: null });
+  const { messages: chatMessages, before: chatBeforeCursor } = chatHistory;
+  const chatUrl = useRef(null); // Endpoint trenutno otvorenog chata
   const [selectedChatUser, setSelectedChatUser] = useState(null); // Za privatni chat
   const [selectedChatType, setSelectedChatType] = useState('group_all'); // 'private', 'group_operational', ili 'group_all'
   const [unreadCount, setUnreadCount] = useState(0);
   const [dvdAreas, setDvdAreas] = useState(null); // GeoJSON data for DVD areas
   const [availableDvds, setAvailableDvds] = useState([]); // List of DVDs actually in GeoJSON
   const watchId = useRef(null);
+  const syncCursor = useRef(null); // Kursor za /api/sync
 
   useEffect(() => {
     // Initialize socket connection
@@ -545,6 +579,8 @@ const Dashboard = () => {
     const newSocket = io(BACKEND_URL, {
       transports: ['websocket', 'polling'],
       path: '/socket.io/',
+      // JWT for the server to put this socket in the user's and department's rooms
+      auth: (cb) => cb({ token: localStorage.getItem('token') }),
       reconnection: true,
       reconnectionDelay: 1000,
       reconnectionAttempts: 5
@@ -601,6 +637,8 @@ const Dashboard = () => {
 
     newSocket.on('new_message', (message) => {
       console.log('🚨 Nova uzbuna/obavijest:', message);
+      // Delivery receipt before anything that could block (alert() below)
+      newSocket.emit('message_ack', { message_id: message.id });
       
       // Play notification sound
       try {
@@ -624,6 +662,10 @@ const Dashboard = () => {
       alert(`${priority} Nova poruka: ${message.title}\n${message.content}`);
     });
 
+    newSocket.on('unread_changed', (data) => {
+      setUnreadCount(data.unread_private);
+    });
+
     newSocket.on('new_chat_message', (message) => {
       console.log('📨 Nova chat poruka:', message);
       
@@ -641,9 +683,6 @@ const Dashboard = () => {
         navigator.vibrate([200, 100, 200]);
       }
       
-      // Refresh unread count
-      fetchUnreadCount();
-      
       // If viewing current chat, refresh it immediately
       if (selectedChatType === 'private' && selectedChatUser && 
           (message.sender_id === selectedChatUser.id || message.recipient_id === selectedChatUser.id)) {
@@ -683,14 +722,42 @@ const Dashboard = () => {
     console.log('🔄 activeUsers state changed:', activeUsers.length, activeUsers);
   }, [activeUsers]);
 
-  // Fetch active user locations via HTTP polling
-  const fetchActiveLocations = async () => {
+  // One HTTP poll for presence and new alerts since the last cursor (unread count is pushed over the socket)
+  const syncDashboard = async () => {
     try {
-      const response = await axios.get(`${API}/locations/active`);
-      console.log('📥 HTTP polling - primljeno korisnika:', response.data.length);
-      setActiveUsers(response.data);
+      const response = await axios.get(`${API}/sync`, {
+        params: syncCursor.current ? { cursor: syncCursor.current } : {}
+      });
+      const { cursor, presence, messages: newMessages, has_more: hasMore } = response.data;
+      syncCursor.current = cursor;
+
+      if (presence.full) {
+        setActiveUsers(presence.users);
+      } else if (presence.updated.length || presence.removed.length) {
+        setActiveUsers(prev => {
+          const byUser = new Map(prev.map(u => [u.user_id, u]));
+          presence.removed.forEach(id => byUser.delete(id));
+          presence.updated.forEach(u => byUser.set(u.user_id, u));
+          return Array.from(byUser.values());
+        });
+      }
+
+      if (newMessages.length) {
+        setAlertHistory(prev => {
+          const seen = new Set(prev.messages.map(m => m.id));
+          // Sync returns alerts oldest first, the list shows newest first
+          const fresh = newMessages.filter(m => !seen.has(m.id)).reverse();
+          return fresh.length ? { ...prev, messages: [...fresh, ...prev.messages] } : prev;
+        });
+      }
+      if (hasMore?.messages) {
+        syncDashboard(); // Burst larger than one page - fetch the rest right away
+      }
     } catch (error) {
-      console.error('Error fetching active locations:', error);
+      if (error.response?.status === 400) {
+        syncCursor.current = null; // Neispravan kursor - sljedeći poziv kreće ispočetka
+      }
+      console.error('Error syncing dashboard:', error);
     }
   };
 
@@ -704,19 +771,16 @@ const Dashboard = () => {
       fetchEvents(); // Fetch events
       fetchMessages(); // Fetch messages
       fetchInterventions(); // Fetch interventions
-      fetchUnreadCount(); // Fetch unread chat count
       fetchDvdAreas(); // Load DVD areas
       
-      // Start polling for active locations every 3 seconds
-      const locationInterval = setInterval(fetchActiveLocations, 3000);
-      
-      // Poll for unread messages every 10 seconds
-      const chatInterval = setInterval(fetchUnreadCount, 10000);
+      // Presence, unread count and new alerts in one poll every 3 seconds
+      syncCursor.current = null;
+      syncDashboard();
+      const syncInterval = setInterval(syncDashboard, 3000);
       
       // Cleanup on unmount
       return () => {
-        clearInterval(locationInterval);
-        clearInterval(chatInterval);
+        clearInterval(syncInterval);
       };
     }
   }, [user]);
@@ -728,6 +792,21 @@ const Dashboard = () => {
     } catch (error) {
       console.error('Error fetching hydrants:', error);
     }
+    fetchMapHydrants();
+  };
+
+  // Map markers come from the visible area only, refetched on pan/zoom
+  const fetchMapHydrants = async (bbox = mapBbox.current) => {
+    if (!bbox) return;
+    mapBbox.current = bbox;
+    try {
+      const response = await axios.get(`${API}/hydrants`, { params: { bbox } });
+      if (mapBbox.current === bbox) {
+        setMapHydrants(response.data);
+      }
+    } catch (error) {
+      console.error('Error fetching map hydrants:', error);
+    }
   };
 
   const fetchDvdAreas = async () => {
@@ -1172,16 +1251,41 @@ const Dashboard = () => {
     }
   };
 
-  // Fetch messages
+  // Newest page of alerts. A refresh keeps the older pages already loaded with
+  // "Učitaj starije obavijesti" as long as the new page connects to them.
   const fetchMessages = async () => {
     try {
       const response = await axios.get(`${API}/messages`);
-      setMessages(response.data);
+      const page = response.data;
+      const pageCursor = response.headers['x-before-cursor'] || null;
+      setAlertHistory(prev => {
+        const joinAt = page.length ? prev.messages.findIndex(m => m.id === page[page.length - 1].id) : -1;
+        if (joinAt >= 0 && joinAt < prev.messages.length - 1) {
+          return { messages: [...page, ...prev.messages.slice(joinAt + 1)], before: prev.before };
+        }
+        return { messages: page, before: pageCursor };
+      });
     } catch (error) {
       console.error('Error fetching messages:', error);
     }
   };
 
+  const loadOlderMessages = async () => {
+    if (!messagesBefore) return;
+    try {
+      const response = await axios.get(`${API}/messages`, { params: { before: messagesBefore } });
+      setAlertHistory(prev => {
+        const loaded = new Set(prev.messages.map(m => m.id));
+        return {
+          messages: [...prev.messages, ...response.data.filter(m => !loaded.has(m.id))],
+          before: response.headers['x-before-cursor'] || null
+        };
+      });
+    } catch (error) {
+      console.error('Error loading older messages:', error);
+    }
+  };
+
   // Fetch interventions
   const fetchInterventions = async () => {
     try {
@@ -1299,31 +1403,55 @@ const Dashboard = () => {
     }
   };
 
-  const fetchPrivateChat = async (userId) => {
+  // Newest page of a chat. Refreshing the open chat keeps the older pages already
+  // loaded with "Učitaj starije poruke" as long as the new page connects to them.
+  const fetchChatPage = async (url) => {
+    const response = await axios.get(url);
+    const page = response.data;
+    const pageCursor = response.headers['x-before-cursor'] || null;
+    const sameChat = chatUrl.current === url;
+    chatUrl.current = url;
+    setChatHistory(prev => {
+      const joinAt = sameChat && page.length ? prev.messages.findIndex(m => m.id === page[0].id) : -1;
+      if (joinAt > 0) {
+        return { messages: [...prev.messages.slice(0, joinAt), ...page], before: prev.before };
+      }
+      return { messages: page, before: pageCursor };
+    });
+  };
+
+  const loadOlderChat = async () => {
+    const url = chatUrl.current;
+    if (!url || !chatBeforeCursor) return;
     try {
-      const response = await axios.get(`${API}/chat/private/${userId}`);
-      setChatMessages(response.data);
+      const response = await axios.get(url, { params: { before: chatBeforeCursor } });
+      if (chatUrl.current !== url) return; // user switched chats meanwhile
+      setChatHistory(prev => {
+        const loaded = new Set(prev.messages.map(m => m.id));
+        return {
+          messages: [...response.data.filter(m => !loaded.has(m.id)), ...prev.messages],
+          before: response.headers['x-before-cursor'] || null
+        };
+      });
     } catch (error) {
-      console.error('Error fetching private chat:', error);
+      console.error('Error loading older chat messages:', error);
     }
   };
 
-  const fetchGroupChat = async (groupType) => {
+  const fetchPrivateChat = async (userId) => {
     try {
-      // groupType može biti 'operational' ili 'general'
-      const response = await axios.get(`${API}/chat/group/${groupType}`);
-      setChatMessages(response.data);
+      await fetchChatPage(`${API}/chat/private/${userId}`);
     } catch (error) {
-      console.error('Error fetching group chat:', error);
+      console.error('Error fetching private chat:', error);
     }
   };
 
-  const fetchUnreadCount = async () => {
+  const fetchGroupChat = async (groupType) => {
     try {
-      const response = await axios.get(`${API}/chat/unread-count`);
-      setUnreadCount(response.data.unread_private);
+      // groupType može biti 'operational' ili 'general'
+      await fetchChatPage(`${API}/chat/group/${groupType}`);
     } catch (error) {
-      console.error('Error fetching unread count:', error);
+      console.error('Error fetching group chat:', error);
     }
   };
 
@@ -1814,6 +1942,7 @@ const Dashboard = () => {
                     
                     {/* Map click handler for adding hydrants */}
                     <MapClickHandler onMapClick={handleMapClick} />
+                    <MapViewportHandler onViewportChange={fetchMapHydrants} />
                     
                     {/* DVD Stations - Vidljive i draggable */}
                     {dvdStations.map((station) => (
@@ -1889,7 +2018,7 @@ const Dashboard = () => {
                     })}
 
                     {/* Hydrants */}
-                    {hydrants.map((hydrant) => (
+                    {mapHydrants.map((hydrant) => (
                       <Marker
                         key={hydrant.id}
                         position={[hydrant.latitude, hydrant.longitude]}
@@ -1922,7 +2051,7 @@ const Dashboard = () => {
                               <div className="mt-2">
                                 <p><strong>Slike:</strong></p>
                                 {hydrant.images.map((image, idx) => (
-                                  <img key={idx} src={image} alt="Hidrant" className="w-16 h-16 object-cover rounded mt-1" />
+                                  <img key={idx} src={mediaUrl(image, 'thumb')} alt="Hidrant" className="w-16 h-16 object-cover rounded mt-1" />
                                 ))}
                               </div>
                             )}
@@ -2013,6 +2142,7 @@ const Dashboard = () => {
                 />
                 
                 <MapClickHandler onMapClick={handleMapClick} />
+                <MapViewportHandler onViewportChange={fetchMapHydrants} />
 
                 {/* DVD Areas */}
                 {dvdAreas && showDvdAreas && (
@@ -2075,7 +2205,7 @@ const Dashboard = () => {
                 })}
 
                 {/* Hydrants */}
-                {hydrants.map((hydrant) => (
+                {mapHydrants.map((hydrant) => (
                   <Marker
                     key={hydrant.id}
                     position={[hydrant.latitude, hydrant.longitude]}
@@ -2327,7 +2457,7 @@ const Dashboard = () => {
                               <p><strong>Slike:</strong></p>
                               <div className="flex space-x-2 mt-1">
                                 {hydrant.images.map((image, idx) => (
-                                  <img key={idx} src={image} alt="Hidrant" className="w-20 h-20 object-cover rounded" />
+                                  <img key={idx} src={mediaUrl(image, 'thumb')} alt="Hidrant" className="w-20 h-20 object-cover rounded" />
                                 ))}
                               </div>
                             </div>
@@ -2693,6 +2823,13 @@ const Dashboard = () => {
                 <CardContent className="flex flex-col" style={{height: '500px'}}>
                   {/* Messages */}
                   <div className="flex-1 overflow-y-auto mb-4 space-y-2 p-2 bg-gray-50 rounded">
+                    {chatBeforeCursor && (
+                      <div className="text-center">
+                        <Button variant="outline" size="sm" onClick={loadOlderChat}>
+                          Učitaj starije poruke
+                        </Button>
+                      </div>
+                    )}
                     {chatMessages.length === 0 ? (
                       <p className="text-gray-500 text-center mt-10">Nema poruka</p>
                     ) : (
@@ -2755,7 +2892,7 @@ const Dashboard = () => {
                   {messages.length === 0 ? (
                     <p className="text-gray-500">Nema obavijesti</p>
                   ) : (
-                    messages.slice().reverse().map((message) => (
+                    messages.map((message) => (
                       <div key={message.id} className={`p-4 border rounded-lg ${
                         message.priority === 'urgent' ? 'border-red-500 bg-red-50' : 
                         message.priority === 'normal' ? 'border-blue-500 bg-blue-50' : 
@@ -2788,6 +2925,13 @@ const Dashboard = () => {
                       </div>
                     ))
                   )}
+                  {messagesBefore && (
+                    <div className="text-center">
+                      <Button variant="outline" size="sm" onClick={loadOlderMessages}>
+                        Učitaj starije obavijesti
+                      </Button>
+                    </div>
+                  )}
                 </div>
               </CardContent>
             </Card>
@@ -2905,10 +3049,10 @@ const Dashboard = () => {
                               {intervention.images.map((img, idx) => (
                                 <img 
                                   key={idx} 
-                                  src={img} 
+                                  src={mediaUrl(img, 'preview')} 
                                   alt={`Slika ${idx + 1}`}
                                   className="w-full h-24 object-cover rounded cursor-pointer hover:scale-105 transition"
-                                  onClick={() => window.open(img, '_blank')}
+                                  onClick={() => window.open(mediaUrl(img, 'full'), '_blank')}
                                 />
                               ))}
                             </div>
@@ -3094,17 +3238,16 @@ const HydrantUpdateDialog = ({ hydrant, onUpdate }) => {
   const [images, setImages] = useState(hydrant.images || []);
   const [open, setOpen] = useState(false);
 
-  const handleImageUpload = (event) => {
+  const handleImageUpload = async (event) => {
     const files = Array.from(event.target.files);
     
-    files.forEach(file => {
-      const reader = new FileReader();
-      reader.onload = (e) => {
-        const imageDataUrl = e.target.result;
-        setImages(prev => [...prev, imageDataUrl]);
-      };
-      reader.readAsDataURL(file);
-    });
+    try {
+      const urls = await uploadImages(files);
+      setImages(prev => [...prev, ...urls]);
+    } catch (error) {
+      console.error('Error uploading images:', error);
+      alert('Greška pri učitavanju slika: ' + (error.response?.data?.detail || error.message));
+    }
   };
 
   const removeImage = (index) => {
@@ -3181,7 +3324,7 @@ const HydrantUpdateDialog = ({ hydrant, onUpdate }) => {
               <div className="grid grid-cols-3 gap-2">
                 {images.map((image, index) => (
                   <div key={index} className="relative">
-                    <img src={image} alt="Hidrant" className="w-full h-16 object-cover rounded" />
+                    <img src={mediaUrl(image, 'thumb')} alt="Hidrant" className="w-full h-16 object-cover rounded" />
                     <Button
                       size="sm"
                       variant="destructive"
@@ -3259,17 +3402,16 @@ const AddHydrantDialog = ({ onAdd }) => {
     }
   };
 
-  const handleImageUpload = (event) => {
+  const handleImageUpload = async (event) => {
     const files = Array.from(event.target.files);
     
-    files.forEach(file => {
-      const reader = new FileReader();
-      reader.onload = (e) => {
-        const imageDataUrl = e.target.result;
-        setImages(prev => [...prev, imageDataUrl]);
-      };
-      reader.readAsDataURL(file);
-    });
+    try {
+      const urls = await uploadImages(files);
+      setImages(prev => [...prev, ...urls]);
+    } catch (error) {
+      console.error('Error uploading images:', error);
+      alert('Greška pri učitavanju slika: ' + (error.response?.data?.detail || error.message));
+    }
   };
 
   const removeImage = (index) => {
@@ -3388,7 +3530,7 @@ const AddHydrantDialog = ({ onAdd }) => {
               <div className="grid grid-cols-3 gap-2">
                 {images.map((image, index) => (
                   <div key={index} className="relative">
-                    <img src={image} alt="Hidrant" className="w-full h-16 object-cover rounded" />
+                    <img src={mediaUrl(image, 'thumb')} alt="Hidrant" className="w-full h-16 object-cover rounded" />
                     <Button
                       size="sm"
                       variant="destructive"
@@ -5512,21 +5654,23 @@ const AddInterventionDialog = ({ onAdd, allUsers, vehicles, userDepartment }) =>
   });
   const [images, setImages] = useState([]);
 
-  const handleImageUpload = (e) => {
-    const files = Array.from(e.target.files);
-    
-    files.forEach(file => {
+  const handleImageUpload = async (e) => {
+    const files = Array.from(e.target.files).filter(file => {
       if (file.size > 5000000) {
         alert('Slika je prevelika! Maksimalno 5MB po slici.');
-        return;
+        return false;
       }
-
-      const reader = new FileReader();
-      reader.onload = (e) => {
-        setImages(prev => [...prev, e.target.result]);
-      };
-      reader.readAsDataURL(file);
+      return true;
     });
+    if (files.length === 0) return;
+
+    try {
+      const urls = await uploadImages(files);
+      setImages(prev => [...prev, ...urls]);
+    } catch (error) {
+      console.error('Error uploading images:', error);
+      alert('Greška pri učitavanju slika: ' + (error.response?.data?.detail || error.message));
+    }
   };
 
   const removeImage = (index) => {
@@ -5754,7 +5898,7 @@ const AddInterventionDialog = ({ onAdd, allUsers, vehicles, userDepartment }) =>
               <div className="grid grid-cols-5 gap-2 mt-2">
                 {images.map((img, idx) => (
                   <div key={idx} className="relative">
-                    <img src={img} alt={`Slika ${idx + 1}`} className="w-full h-20 object-cover rounded" />
+                    <img src={mediaUrl(img, 'thumb')} alt={`Slika ${idx + 1}`} className="w-full h-20 object-cover rounded" />
                     <button
                       onClick={() => removeImage(idx)}
                       className="absolute top-0 right-0 bg-red-600 text-white rounded-full w-5 h-5 flex items-center justify-center text-xs"
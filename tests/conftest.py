@@ -0,0 +1,9 @@
+import os
+import sys
+from pathlib import Path
+
+# server.py lives in backend/ and is imported as a top-level module. The Motor
+# client connects lazily, so pure functions can be tested without MongoDB.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "vatrogasci_test")
@@ -0,0 +1,163 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import Response
+
+import server
+
+def bson(value):
+    """Mongo stores datetimes as naive UTC, like Motor returns them"""
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+_OPERATORS = {
+    "$lt": lambda value, arg: value is not None and value < bson(arg),
+    "$lte": lambda value, arg: value is not None and value <= bson(arg),
+    "$gt": lambda value, arg: value is not None and value > bson(arg),
+    "$gte": lambda value, arg: value is not None and value >= bson(arg),
+    "$in": lambda value, arg: value in arg,
+    "$type": lambda value, arg: arg == "string" and isinstance(value, str),
+}
+
+
+def matches(doc, query):
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches(doc, branch) for branch in condition):
+                return False
+        elif isinstance(condition, dict):
+            if not all(_OPERATORS[op](doc.get(key), arg) for op, arg in condition.items()):
+                return False
+        elif doc.get(key) != bson(condition):
+            return False
+    return True
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, key, direction=None):
+        keys = key if isinstance(key, list) else [(key, direction)]
+        for field, order in reversed(keys):
+            self.docs.sort(key=lambda doc: doc[field], reverse=order == -1)
+        return self
+
+    def limit(self, count):
+        self.docs = self.docs[:count]
+        return self
+
+    async def to_list(self, length=None):
+        return [dict(doc) for doc in self.docs]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self.docs:
+            yield dict(doc)
+
+
+class FakeCollection:
+    """Just enough of a Motor collection for the archiver and the page reader"""
+
+    def __init__(self):
+        self.docs = []
+
+    def find(self, query=None, projection=None):
+        return FakeCursor([doc for doc in self.docs if matches(doc, query or {})])
+
+    async def replace_one(self, query, replacement, upsert=False):
+        self.docs = [doc for doc in self.docs if not matches(doc, query)]
+        self.docs.append({**query, **replacement})
+
+    async def delete_many(self, query):
+        self.docs = [doc for doc in self.docs if not matches(doc, query)]
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.chat_messages = FakeCollection()
+        self.chat_archive = FakeCollection()
+
+
+CONVERSATION = "private:u1:u2"
+NOW = datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+@pytest.fixture
+def chat(monkeypatch):
+    """30 messages, 2 per day; with a 5 day cutoff the 22 oldest get archived"""
+    database = FakeDatabase()
+    monkeypatch.setattr(server, "db", database)
+    monkeypatch.setattr(server, "CHAT_ARCHIVE_BATCH_SIZE", 4)
+    messages = []
+    for i in range(30):
+        created_at = NOW - timedelta(days=15 - i // 2, hours=6 + i % 2)
+        messages.append({"id": f"m{i:02d}", "conversation_id": CONVERSATION, "chat_type": "private",
+                         "sender_id": "u1", "recipient_id": "u2", "content": f"poruka {i}",
+                         "created_at": created_at})
+    # Same timestamp twice: the id breaks the tie in the keyset
+    messages[21]["created_at"] = messages[20]["created_at"]
+    messages.sort(key=lambda m: (m["created_at"], m["id"]))
+    database.chat_messages.docs = [dict(m) for m in messages]
+    moved = asyncio.run(server.archive_chat_messages(older_than_days=5))
+    return database, messages, moved
+
+
+def page(before=None, after=None, limit=7):
+    response = Response()
+    messages, reached_newest = asyncio.run(server.fetch_chat_page(
+        {"conversation_id": CONVERSATION}, CONVERSATION, response, before, after, limit))
+    return messages, reached_newest, response.headers
+
+
+def test_archiver_moves_old_messages(chat):
+    database, messages, moved = chat
+    cutoff = NOW - timedelta(days=5)
+    assert moved == sum(m["created_at"] < cutoff for m in messages)
+    assert all(m["created_at"] >= cutoff for m in database.chat_messages.docs)
+    assert all(batch["count"] <= 4 for batch in database.chat_archive.docs)
+    assert sum(batch["count"] for batch in database.chat_archive.docs) == moved
+
+
+def test_pack_round_trip():
+    batch = [{"id": "a", "content": "Požar – Đurđevac", "created_at": datetime(2024, 1, 2, 3, 4, 5, 6)}]
+    assert server._unpack_chat_batch(server._pack_chat_batch(batch)) == batch
+
+
+def test_backward_paging_crosses_into_archive(chat):
+    _, messages, _ = chat
+    collected, before = [], None
+    while True:
+        items, reached_newest, headers = page(before=before)
+        assert reached_newest == (before is None)
+        collected = items + collected
+        before = headers.get("x-before-cursor")
+        if not before:
+            break
+    assert [m["id"] for m in collected] == [m["id"] for m in messages]
+
+
+def test_forward_paging_from_archive_into_hot(chat):
+    _, messages, _ = chat
+    collected, after = [], server.encode_cursor(messages[2])
+    while True:
+        items, reached_newest, headers = page(after=after)
+        collected += items
+        if reached_newest:
+            break
+        after = headers["x-after-cursor"]
+    assert [m["id"] for m in collected] == [m["id"] for m in messages[3:]]
+
+
+def test_read_chat_archive_respects_keyset(chat):
+    _, messages, moved = chat
+    keyset = (messages[10]["created_at"], messages[10]["id"])
+    older = asyncio.run(server.read_chat_archive(CONVERSATION, -1, keyset, 100))
+    assert [m["id"] for m in older] == [m["id"] for m in reversed(messages[:10])]
+    newer = asyncio.run(server.read_chat_archive(CONVERSATION, 1, keyset, 100))
+    assert [m["id"] for m in newer] == [m["id"] for m in messages[11:moved]]
@@ -0,0 +1,43 @@
+import pytest
+
+import server
+
+
+def member(department="DVD_Cakovec", is_operational=False):
+    return server.User(username="ivan", email="ivan@example.com", full_name="Ivan Horvat",
+                       department=department, is_operational=is_operational)
+
+
+def group_message(group_id):
+    return server.ChatMessageCreate(chat_type="group", group_id=group_id, content="Pozdrav")
+
+
+def test_socket_rooms_match_chat_groups():
+    user = {"id": "u1", "department": "DVD_Cakovec", "is_operational": True}
+    assert server.socket_rooms_for(user) == ["user_u1", "DVD_Cakovec_all", "DVD_Cakovec_operational"]
+
+
+@pytest.mark.parametrize("group_id,is_operational", [
+    ("DVD_Cakovec_all", False),
+    ("DVD_Cakovec_all", True),
+    ("DVD_Cakovec_operational", True),
+])
+def test_own_groups_allowed(group_id, is_operational):
+    server.check_chat_target(group_message(group_id), member(is_operational=is_operational))
+
+
+@pytest.mark.parametrize("group_id", [
+    "DVD_Cakovec_operational",  # not operational
+    "DVD_Strahoninec_all",      # another department
+    "user_u2",                  # someone's private socket room
+    None,
+])
+def test_foreign_groups_rejected(group_id):
+    with pytest.raises(server.HTTPException) as e:
+        server.check_chat_target(group_message(group_id), member())
+    assert e.value.status_code == 403
+
+
+def test_private_needs_recipient():
+    with pytest.raises(server.HTTPException):
+        server.check_chat_target(server.ChatMessageCreate(chat_type="private", content="Bok"), member())
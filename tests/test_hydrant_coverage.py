@@ -0,0 +1,98 @@
+import random
+
+import numpy as np
+
+import server
+
+
+def square_area(name, min_x, min_y, size):
+    ring = [(min_x, min_y), (min_x + size, min_y), (min_x + size, min_y + size), (min_x, min_y + size), (min_x, min_y)]
+    return {"name": name, "polygons": [[ring]], "bbox": (min_x, min_y, min_x + size, min_y + size)}
+
+
+class TestHydrantCoverageModel:
+    CELL = 50.0
+    MAX_DISTANCE = 400.0
+
+    def make_model(self):
+        x0, y0 = server.wgs84_to_htrs96(46.2, 16.3)
+        return server.HydrantCoverageModel([square_area("A", x0, y0, 3000)], self.CELL, self.MAX_DISTANCE)
+
+    def hydrants_in(self, model, rng, count):
+        hydrants = []
+        for i in range(count):
+            x = rng.uniform(model.xs[0], model.xs[-1])
+            y = rng.uniform(model.ys[0], model.ys[-1])
+            lat, lon = server.htrs96_to_wgs84(x, y)
+            hydrants.append({"id": f"h{i}", "latitude": lat, "longitude": lon,
+                             "status": rng.choice(["working", "working", "broken"])})
+        return hydrants
+
+    def brute_force_dist2(self, model, hydrants):
+        dist2 = np.full((len(model.ys), len(model.xs)), np.inf)
+        for hydrant in hydrants:
+            if hydrant["status"] != "working":
+                continue
+            x, y = server.wgs84_to_htrs96(hydrant["latitude"], hydrant["longitude"])
+            d2 = (model.xs[None, :] - x) ** 2 + (model.ys[:, None] - y) ** 2
+            d2[d2 > self.MAX_DISTANCE ** 2] = np.inf
+            dist2 = np.minimum(dist2, d2)
+        return dist2
+
+    def test_rasterized_square_covers_whole_grid(self):
+        model = self.make_model()
+        assert model.area_masks[0].all()
+
+    def test_incremental_updates_match_full_recompute(self):
+        rng = random.Random(4)
+        model = self.make_model()
+        hydrants = {h["id"]: h for h in self.hydrants_in(model, rng, 60)}
+        for hydrant in hydrants.values():
+            model.upsert(hydrant)
+        np.testing.assert_array_equal(model.dist2, self.brute_force_dist2(model, hydrants.values()))
+
+        for _ in range(80):
+            hydrant_id = rng.choice(sorted(hydrants))
+            action = rng.random()
+            if action < 0.3:
+                model.remove(hydrant_id)
+                del hydrants[hydrant_id]
+            elif action < 0.6:
+                hydrants[hydrant_id] = {**hydrants[hydrant_id],
+                                        "status": "broken" if hydrants[hydrant_id]["status"] == "working" else "working"}
+                model.upsert(hydrants[hydrant_id])
+            else:
+                (moved,) = self.hydrants_in(model, rng, 1)
+                hydrants[hydrant_id] = {**moved, "id": hydrant_id}
+                model.upsert(hydrants[hydrant_id])
+            if not hydrants:
+                break
+        np.testing.assert_array_equal(model.dist2, self.brute_force_dist2(model, hydrants.values()))
+
+    def test_summary_totals(self):
+        rng = random.Random(5)
+        model = self.make_model()
+        for hydrant in self.hydrants_in(model, rng, 30):
+            model.upsert(hydrant)
+        (area,) = model.summary(150)["areas"]
+        assert area["covered_m2"] + area["gap_m2"] == area["area_m2"]
+        expected = int((model.dist2 <= 150 ** 2).sum()) * self.CELL ** 2
+        assert area["covered_m2"] == expected
+
+    def test_summary_cache_invalidated_on_change(self):
+        model = self.make_model()
+        before = model.summary(150)
+        lat, lon = server.htrs96_to_wgs84(model.xs[10], model.ys[10])
+        model.upsert({"id": "a", "latitude": lat, "longitude": lon, "status": "working"})
+        after = model.summary(150)
+        assert after is not before
+        assert after["areas"][0]["covered_m2"] > before["areas"][0]["covered_m2"]
+
+    def test_radius_is_quantized_to_cells(self):
+        model = self.make_model()
+        assert model.quantize_radius(149.9) == model.quantize_radius(150) == 150
+        assert model.quantize_radius(0.001) == self.CELL
+        assert model.quantize_radius(10_000) == self.MAX_DISTANCE
+        for radius in [0.5 + i * 1.37 for i in range(500)]:
+            model.summary(radius)
+        assert len(model._summaries) == self.MAX_DISTANCE / self.CELL
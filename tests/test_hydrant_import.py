@@ -0,0 +1,172 @@
+import asyncio
+import io
+import json
+from contextlib import asynccontextmanager
+
+import pytest
+
+import server
+
+HTRS96_CRS = {"type": "name", "properties": {"name": "urn:ogc:def:crs:EPSG::3765"}}
+
+
+def features(count):
+    return [{
+        "type": "Feature",
+        "id": f"H-{i}",
+        "geometry": {"type": "Point", "coordinates": [16.3 + i / 1000, 46.2]},
+        "properties": {"adresa": f"Ulica {i} – Čakovec", "status": "working"},
+    } for i in range(count)]
+
+
+def read_features(data: bytes, seekable: bool = True):
+    fileobj = io.BytesIO(data)
+    if not seekable:
+        fileobj.seekable = lambda: False
+
+    async def collect():
+        return [item async for item in server._iter_geojson_features(fileobj)]
+    return asyncio.run(collect())
+
+
+@pytest.fixture
+def small_reads(monkeypatch):
+    # Split features, keys and multi-byte characters across read boundaries
+    monkeypatch.setattr(server, "HYDRANT_IMPORT_READ_SIZE", 7)
+
+
+@pytest.mark.parametrize("read_size", [1, 7, 64, 256 * 1024])
+def test_features_across_chunk_boundaries(monkeypatch, read_size):
+    monkeypatch.setattr(server, "HYDRANT_IMPORT_READ_SIZE", read_size)
+    collection = {"type": "FeatureCollection", "features": features(25)}
+    data = ("\ufeff" + json.dumps(collection, ensure_ascii=False, indent=1)).encode("utf-8")
+    result = read_features(data)
+    assert [feature for _, feature in result] == collection["features"]
+    assert {crs for crs, _ in result} == {None}
+
+
+def test_crs_before_features(small_reads):
+    data = json.dumps({"type": "FeatureCollection", "crs": HTRS96_CRS, "features": features(3)}).encode()
+    assert {crs for crs, _ in read_features(data)} == {"urn:ogc:def:crs:EPSG::3765"}
+
+
+def test_crs_after_features(small_reads):
+    data = json.dumps({"type": "FeatureCollection", "features": features(3), "crs": HTRS96_CRS,
+                       "bbox": [1, 2, 3, 4]}).encode()
+    assert {crs for crs, _ in read_features(data)} == {"urn:ogc:def:crs:EPSG::3765"}
+
+
+def test_crs_inside_last_feature_is_not_top_level(small_reads):
+    items = features(2)
+    items[-1]["properties"]["crs"] = HTRS96_CRS
+    data = json.dumps({"type": "FeatureCollection", "features": items}).encode()
+    assert {crs for crs, _ in read_features(data)} == {None}
+
+
+def test_crs_after_features_unseekable_fails(small_reads):
+    data = json.dumps({"type": "FeatureCollection", "features": features(3), "crs": HTRS96_CRS}).encode()
+    with pytest.raises(ValueError):
+        read_features(data, seekable=False)
+
+
+def test_missing_features(small_reads):
+    with pytest.raises(ValueError):
+        read_features(b'{"type": "FeatureCollection"}')
+
+
+def test_truncated_feature(small_reads):
+    with pytest.raises(ValueError):
+        read_features(b'{"type": "FeatureCollection", "features": [{"type": "Feature", "geometry": ')
+
+
+def test_normalize_projected_record():
+    x, y = server.wgs84_to_htrs96(46.3, 16.34)
+    record = server._normalize_import_record({"oznaka": 17, "tip": "Podzemni"}, x, y, "EPSG:3765", None)
+    assert record["latitude"] == pytest.approx(46.3, abs=1e-6)
+    assert record["longitude"] == pytest.approx(16.34, abs=1e-6)
+    assert record["external_id"] == "17"
+    assert record["tip_hidranta"] == "podzemni"
+
+
+def test_normalize_rejects_projected_without_crs():
+    with pytest.raises(ValueError):
+        server._normalize_import_record({}, 480000, 5130000, None, None)
+
+
+def run_import(items, **kwargs):
+    data = json.dumps({"type": "FeatureCollection", "features": items}).encode()
+    return asyncio.run(server.import_hydrants(io.BytesIO(data), "geojson", **kwargs))
+
+
+def test_repeated_external_id_is_a_row_error():
+    items = features(4)
+    items[2]["id"] = items[0]["id"]
+    report = run_import(items, dry_run=True)
+    assert report["failed"] == 1
+    assert report["errors"] == [{"row": 3, "error": "Vanjski ID H-0 već je u retku 1"}]
+
+
+class FakeImportDatabase:
+    """hydrants.find/bulk_write and hydrant_inspections.insert_many for one import batch"""
+
+    def __init__(self, existing):
+        self.existing = existing
+        self.inspections = []
+        self.hydrants = self
+        self.hydrant_inspections = self
+
+    async def _iterate(self, docs):
+        for doc in docs:
+            yield dict(doc)
+
+    def find(self, query, projection=None):
+        return self._iterate([doc for doc in self.existing if doc["external_id"] in query["external_id"]["$in"]])
+
+    async def bulk_write(self, operations, ordered=True):
+        matched = sum(1 for op in operations if any(
+            doc["external_id"] == op._filter.get("external_id") for doc in self.existing))
+        return type("Result", (), {"bulk_api_result": {"nMatched": matched, "nUpserted": len(operations) - matched}})
+
+    async def insert_many(self, docs):
+        self.inspections.extend(docs)
+
+
+def test_status_changes_are_logged(monkeypatch):
+    @asynccontextmanager
+    async def versions(count=1):
+        yield list(range(1, count + 1))
+
+    existing = [{"id": "a", "external_id": "H-0", "status": "working"},
+                {"id": "b", "external_id": "H-1", "status": "working"}]
+    database = FakeImportDatabase(existing)
+    monkeypatch.setattr(server, "db", database)
+    monkeypatch.setattr(server, "hydrant_versions", versions)
+    monkeypatch.setattr(server, "rebuild_hydrant_indexes", lambda: asyncio.sleep(0))
+    monkeypatch.setattr(server, "rebuild_hydrant_rollups", lambda: asyncio.sleep(0))
+
+    items = features(3)
+    items[0]["properties"]["status"] = "broken"  # H-0 changes, H-1 stays, H-2 is new
+    report = run_import(items, imported_by="u1", imported_by_name="Ana")
+    assert (report["inserted"], report["updated"]) == (1, 2)
+    (entry,) = database.inspections
+    assert (entry["hydrant_id"], entry["previous_status"], entry["status"]) == ("a", "working", "broken")
+    assert (entry["checked_by"], entry["checked_by_name"]) == ("u1", "Ana")
+
+
+class TestHtrs96:
+    @pytest.mark.parametrize("lat,lon", [(46.3057, 16.3366), (45.8150, 15.9819), (42.6507, 18.0944), (45.3271, 14.4422)])
+    def test_round_trip(self, lat, lon):
+        x, y = server.wgs84_to_htrs96(lat, lon)
+        back_lat, back_lon = server.htrs96_to_wgs84(x, y)
+        assert back_lat == pytest.approx(lat, abs=1e-7)
+        assert back_lon == pytest.approx(lon, abs=1e-7)
+
+    def test_central_meridian(self):
+        x, _ = server.wgs84_to_htrs96(45.0, 16.5)
+        assert x == pytest.approx(500000.0, abs=1e-6)
+
+    def test_to_wgs84_crs_names(self):
+        assert server.to_wgs84(16.3, 46.2, None) == (46.2, 16.3)
+        assert server.to_wgs84(16.3, 46.2, "urn:ogc:def:crs:OGC:1.3:CRS84") == (46.2, 16.3)
+        with pytest.raises(ValueError):
+            server.to_wgs84(1, 2, "EPSG:31276")
@@ -0,0 +1,105 @@
+import math
+import random
+
+import numpy as np
+import pytest
+
+import server
+
+
+def random_hydrants(rng, count, statuses=("working",), types=("nadzemni",)):
+    return [{
+        "id": f"h{i}",
+        "latitude": 46.2 + rng.uniform(-0.15, 0.15),
+        "longitude": 16.35 + rng.uniform(-0.2, 0.2),
+        "status": rng.choice(statuses),
+        "tip_hidranta": rng.choice(types),
+    } for i in range(count)]
+
+
+def brute_force_nearest(hydrants, lat, lon, k, statuses=None, types=None):
+    candidates = [h for h in hydrants
+                  if (not statuses or h["status"] in statuses) and (not types or h["tip_hidranta"] in types)]
+    candidates.sort(key=lambda h: server.haversine_m(lat, lon, h["latitude"], h["longitude"]))
+    return [h["id"] for h in candidates[:k]]
+
+
+class TestHydrantNearestIndex:
+    def test_matches_brute_force(self):
+        rng = random.Random(1)
+        hydrants = random_hydrants(rng, 500)
+        index = server.HydrantNearestIndex()
+        for hydrant in hydrants:
+            index.upsert(hydrant)
+        index.rebuild_all()
+        for _ in range(300):
+            lat, lon = 46.2 + rng.uniform(-0.2, 0.2), 16.35 + rng.uniform(-0.25, 0.25)
+            k = rng.randint(1, 10)
+            found = [r["id"] for r in index.nearest(lat, lon, k)]
+            assert found == brute_force_nearest(hydrants, lat, lon, k)
+
+    def test_pending_and_removed_without_rebuild(self):
+        rng = random.Random(2)
+        hydrants = random_hydrants(rng, 200, statuses=("working", "broken"), types=("nadzemni", "podzemni"))
+        index = server.HydrantNearestIndex()
+        for hydrant in hydrants:
+            index.upsert(hydrant)
+        index.rebuild_all()
+
+        # Moves, status changes and deletes land in pending/removed sets
+        by_id = {h["id"]: h for h in hydrants}
+        for hydrant in rng.sample(hydrants, 20):
+            moved = {**hydrant, "latitude": hydrant["latitude"] + 0.01, "status": "working"}
+            by_id[moved["id"]] = moved
+            index.upsert(moved)
+        for hydrant_id in rng.sample(sorted(by_id), 15):
+            del by_id[hydrant_id]
+            index.remove(hydrant_id)
+
+        remaining = list(by_id.values())
+        for _ in range(100):
+            lat, lon = 46.2 + rng.uniform(-0.2, 0.2), 16.35 + rng.uniform(-0.25, 0.25)
+            found = [r["id"] for r in index.nearest(lat, lon, 5, ["working"], ["podzemni"])]
+            assert found == brute_force_nearest(remaining, lat, lon, 5, ["working"], ["podzemni"])
+
+    def test_distances_are_haversine(self):
+        index = server.HydrantNearestIndex()
+        index.upsert({"id": "a", "latitude": 46.0, "longitude": 16.0})
+        (result,) = index.nearest(46.0, 16.01, 1)
+        assert result["distance_m"] == pytest.approx(server.haversine_m(46.0, 16.01, 46.0, 16.0), abs=0.1)
+
+
+class TestHydrantClusterIndex:
+    def test_every_zoom_counts_every_hydrant_once(self):
+        rng = random.Random(3)
+        hydrants = random_hydrants(rng, 300, statuses=("working", "broken"))
+        index = server.HydrantClusterIndex(max_zoom=12)
+        for hydrant in hydrants:
+            index.upsert(hydrant)
+        for zoom in range(13):
+            features = index.query(zoom)
+            total = sum(f["count"] if f["type"] == "cluster" else 1 for f in features)
+            assert total == len(hydrants)
+            broken = sum(f["by_status"].get("broken", 0) if f["type"] == "cluster" else f["status"] == "broken"
+                         for f in features)
+            assert broken == sum(h["status"] == "broken" for h in hydrants)
+
+    def test_remove_and_move(self):
+        index = server.HydrantClusterIndex(max_zoom=10)
+        index.upsert({"id": "a", "latitude": 46.2, "longitude": 16.3})
+        index.upsert({"id": "b", "latitude": 46.2001, "longitude": 16.3001})
+        (cluster,) = index.query(5)
+        assert cluster["type"] == "cluster" and cluster["count"] == 2
+
+        index.upsert({"id": "b", "latitude": -30.0, "longitude": 120.0})
+        assert sorted(f["id"] for f in index.query(5)) == ["a", "b"]
+        index.remove("a")
+        assert [f["id"] for f in index.query(5)] == ["b"]
+        assert len(index) == 1
+
+    def test_bbox_limits_features(self):
+        index = server.HydrantClusterIndex(max_zoom=10)
+        index.upsert({"id": "in", "latitude": 46.2, "longitude": 16.3})
+        index.upsert({"id": "out", "latitude": 45.0, "longitude": 14.0})
+        features = index.query(10, [16.2, 46.1, 16.4, 46.3])
+        assert [f["id"] for f in features] == ["in"]
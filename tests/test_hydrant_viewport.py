@@ -0,0 +1,24 @@
+import pytest
+
+import server
+
+
+class TestViewportParameters:
+    def test_bbox_is_clamped(self):
+        assert server._parse_bbox("-200.5,-95,200,95") == [-180.0, -90.0, 180.0, 90.0]
+        assert server._bbox_filter([-180.0, -90.0, 180.0, 90.0]) is None
+
+    def test_bbox_polygon(self):
+        within = server._bbox_filter(server._parse_bbox("16.2,46.1,16.4,46.3"))
+        ring = within["$geoWithin"]["$geometry"]["coordinates"][0]
+        assert ring[0] == ring[-1] == [16.2, 46.1]
+
+    @pytest.mark.parametrize("bbox", ["16.4,46.1,16.2,46.3", "1,2,3", "a,b,c,d", "nan,1,2,3"])
+    def test_invalid_bbox(self, bbox):
+        with pytest.raises(server.HTTPException):
+            server._parse_bbox(bbox)
+
+    @pytest.mark.parametrize("near", ["91,16", "46,181", "46"])
+    def test_invalid_near(self, near):
+        with pytest.raises(server.HTTPException):
+            server._parse_point(near)
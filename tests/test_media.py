@@ -0,0 +1,175 @@
+import asyncio
+import io
+
+import pytest
+from fastapi import HTTPException
+from PIL import Image
+
+import server
+
+
+def encoded_image(fmt):
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8), "red").save(buffer, fmt)
+    return buffer.getvalue()
+
+
+class TestParseRangeHeader:
+    @pytest.mark.parametrize("header,expected", [
+        ("bytes=0-99", (0, 99)),
+        ("bytes=100-", (100, 999)),
+        ("bytes=-200", (800, 999)),
+        ("bytes=900-5000", (900, 999)),
+        ("bytes=-5000", (0, 999)),
+        ("bytes = 5-5", (5, 5)),
+    ])
+    def test_satisfiable(self, header, expected):
+        assert server._parse_range_header(header, 1000) == expected
+
+    @pytest.mark.parametrize("header", ["bytes=1000-", "bytes=500-400", "bytes=-0"])
+    def test_unsatisfiable(self, header):
+        assert server._parse_range_header(header, 1000) is None
+
+    @pytest.mark.parametrize("header", ["items=0-1", "bytes=0-1,5-6", "bytes=a-b"])
+    def test_unsupported(self, header):
+        with pytest.raises(ValueError):
+            server._parse_range_header(header, 1000)
+
+
+class TestSniffImageType:
+    @pytest.mark.parametrize("fmt,content_type", [
+        ("JPEG", "image/jpeg"), ("PNG", "image/png"), ("GIF", "image/gif"), ("WEBP", "image/webp"),
+    ])
+    def test_allowed_formats(self, fmt, content_type):
+        assert server._sniff_image_type(io.BytesIO(encoded_image(fmt))) == content_type
+
+    @pytest.mark.parametrize("data", [
+        b'<svg xmlns="http://www.w3.org/2000/svg"><script>alert(1)</script></svg>',
+        b"<html><script>alert(1)</script></html>",
+        b"",
+    ])
+    def test_scriptable_content_rejected(self, data):
+        assert server._sniff_image_type(io.BytesIO(data)) is None
+
+    def test_other_raster_formats_rejected(self):
+        assert server._sniff_image_type(io.BytesIO(encoded_image("BMP"))) is None
+
+
+class TestDecodeDataUrl:
+    def test_declared_type_is_ignored(self):
+        assert server._decode_data_url("data:text/html;base64,PGh0bWw+") == b"<html>"
+
+    def test_requires_base64(self):
+        with pytest.raises(ValueError):
+            server._decode_data_url("data:text/html,<script>alert(1)</script>")
+
+    def test_size_limit_before_decoding(self, monkeypatch):
+        monkeypatch.setattr(server, "MEDIA_MAX_BYTES", 10)
+        with pytest.raises(HTTPException) as error:
+            server._decode_data_url("data:image/png;base64," + "A" * 100)
+        assert error.value.status_code == 413
+
+
+def test_media_ids_only_from_own_references():
+    media_id = "a" * 64
+    assert server.media_id_from_ref(f"/api/media/{media_id}?size=thumb") == media_id
+    assert server.media_id_from_ref("/api/media/../../etc/passwd") is None
+    assert server.media_id_from_ref("https://example.com/x.jpg") is None
+
+
+class TestMediaUploadLimit:
+    LIMIT = 1000
+
+    def call(self, monkeypatch, path, chunks, content_length=None):
+        monkeypatch.setattr(server, "MEDIA_MAX_REQUEST_BYTES", self.LIMIT)
+        read = []
+
+        async def endpoint(scope, receive, send):
+            while True:
+                message = await receive()
+                read.append(len(message.get("body", b"")))
+                if not message.get("more_body"):
+                    break
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+
+        messages = iter([{"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+                         for i, chunk in enumerate(chunks)])
+
+        async def receive():
+            return next(messages)
+
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        headers = [(b"content-length", str(content_length).encode())] if content_length is not None else []
+        scope = {"type": "http", "method": "POST", "path": path, "headers": headers}
+        asyncio.run(server.MediaUploadLimitMiddleware(endpoint)(scope, receive, send))
+        return sent[0]["status"], read
+
+    def test_declared_length_refused_before_reading(self, monkeypatch):
+        status, read = self.call(monkeypatch, "/api/media", [b"x" * 2000], content_length=2000)
+        assert status == 413
+        assert read == []
+
+    def test_streamed_body_cut_off_at_limit(self, monkeypatch):
+        with pytest.raises(HTTPException) as e:
+            self.call(monkeypatch, "/api/hydrants/h1/photos", [b"x" * 400] * 10)
+        assert e.value.status_code == 413
+
+    def test_small_uploads_and_other_paths_pass(self, monkeypatch):
+        assert self.call(monkeypatch, "/api/media", [b"x" * 400, b"x" * 400], content_length=800)[0] == 200
+        assert self.call(monkeypatch, "/api/hydrants", [b"x" * 2000], content_length=2000)[0] == 200
+
+
+class TestServedVariants:
+    def store(self, monkeypatch, tmp_path, data, content_type):
+        monkeypatch.setattr(server, "MEDIA_ROOT", tmp_path)
+        media_id = server.hashlib.sha256(data).hexdigest()
+        server.media_path(media_id).parent.mkdir(parents=True)
+        server.media_path(media_id).write_bytes(data)
+
+        class Media:
+            async def find_one(self, query, projection=None):
+                return {"content_type": content_type} if query["id"] == media_id else None
+
+        async def render(media_id):
+            targets = {v: str(server.media_variant_path(media_id, v)) for v in server.MEDIA_VARIANTS}
+            try:
+                server._render_media_variants(str(server.media_path(media_id)), targets)
+                return True
+            except Exception:
+                return False
+
+        monkeypatch.setattr(server, "db", type("Db", (), {"media": Media()})())
+        monkeypatch.setattr(server, "ensure_media_variants", render)
+        return media_id
+
+    def fetch(self, media_id, **kwargs):
+        request = server.Request({"type": "http", "method": "GET", "headers": []})
+
+        async def body():
+            response = await server.get_media(media_id, request, **kwargs)
+            return response, b"".join([chunk async for chunk in response.body_iterator])
+        return asyncio.run(body())
+
+    def test_default_is_the_stripped_full_variant(self, monkeypatch, tmp_path):
+        exif = Image.Exif()
+        exif[0x8825] = {2: (45.0, 48.0, 0.0)}  # GPSInfo: latitude
+        buffer = io.BytesIO()
+        Image.new("RGB", (16, 16), "red").save(buffer, "JPEG", exif=exif)
+        media_id = self.store(monkeypatch, tmp_path, buffer.getvalue(), "image/jpeg")
+
+        response, data = self.fetch(media_id, size=server.MEDIA_DEFAULT_VARIANT)
+        assert response.headers["etag"] == f'"{media_id}-full"'
+        assert data != buffer.getvalue()
+        with Image.open(io.BytesIO(data)) as served:
+            assert not served.getexif()
+
+    def test_undecodable_image_is_not_served(self, monkeypatch, tmp_path):
+        media_id = self.store(monkeypatch, tmp_path, b"\xff\xd8\xff broken jpeg", "image/jpeg")
+        with pytest.raises(HTTPException) as error:
+            self.fetch(media_id, size="full")
+        assert error.value.status_code == 415
@@ -0,0 +1,160 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import server
+
+
+def make_index():
+    index = server.SearchIndex()
+    index.upsert("message", {"id": "m1", "title": "Vježba", "content": "Požar na tavanu, Čakovec",
+                             "sent_to_departments": ["all"], "created_at": datetime(2024, 5, 1)})
+    index.upsert("message", {"id": "m2", "title": "Sastanak", "content": "Zapovjedništvo DVD Gornji Kneginec",
+                             "sent_to_departments": ["DVD_Kneginec"], "created_at": datetime(2024, 5, 2)})
+    index.upsert("chat", {"id": "c1", "chat_type": "private", "sender_id": "u1", "recipient_id": "u2",
+                          "sender_name": "Ana", "content": "Hidrant u Đurđevcu ne radi", "created_at": datetime(2024, 5, 3)})
+    index.upsert("chat", {"id": "c2", "chat_type": "group", "group_id": "DVD_Kneginec_operational",
+                          "sender_name": "Ivo", "content": "Požar dojavljen", "created_at": datetime(2024, 5, 4)})
+    index.upsert("equipment", {"id": "e1", "name": "Motorna pila", "serial_number": "MP-2231",
+                               "type": "alat", "department": "DVD_Kneginec"})
+    return index
+
+
+def ids(result):
+    return sorted(r["id"] for r in result["results"])
+
+
+def test_fold_text_strips_diacritics():
+    assert server.fold_text("ČĆŽŠĐ čćžšđ") == "cczsd cczsd"
+    assert server.search_tokens("Požar na tavanu, 3. kat!") == ["pozar", "na", "tavanu", "kat"]
+
+
+def test_query_without_diacritics_matches():
+    index = make_index()
+    assert ids(index.search("pozar", {"all"})) == ["m1"]
+    assert ids(index.search("durdevcu", {"user:u2"})) == ["c1"]
+
+
+def test_last_term_matches_as_prefix():
+    index = make_index()
+    assert ids(index.search("zapovj", {"dept:DVD_Kneginec"})) == ["m2"]
+    assert ids(index.search("motorna pi", {"vzo"})) == ["e1"]
+
+
+def test_all_terms_must_match():
+    index = make_index()
+    assert ids(index.search("pozar cakovec", {"all", "group:DVD_Kneginec_operational"})) == ["m1"]
+
+
+def test_scopes_limit_visibility():
+    index = make_index()
+    assert ids(index.search("hidrant", {"user:u3"})) == []
+    assert ids(index.search("hidrant", {"user:u1"})) == ["c1"]
+    assert ids(index.search("pozar", {"all"})) == ["m1"]
+    assert ids(index.search("pozar", {"all", "group:DVD_Kneginec_operational"})) == ["c2", "m1"]
+
+
+def test_operational_group_scope_follows_user():
+    member = server.User(id="u9", username="m", full_name="M", email="m@example.com",
+                         department="DVD_Kneginec", is_operational=False)
+    assert "group:DVD_Kneginec_operational" not in server.search_scopes_for(member)
+    assert "group:DVD_Kneginec_all" in server.search_scopes_for(member)
+
+
+def test_update_and_remove():
+    index = make_index()
+    index.upsert("chat", {"id": "c1", "chat_type": "private", "sender_id": "u1", "recipient_id": "u2",
+                          "sender_name": "Ana", "content": "Popravljeno", "created_at": datetime(2024, 5, 5)})
+    assert ids(index.search("hidrant", {"user:u1"})) == []
+    assert ids(index.search("popravljeno", {"user:u1"})) == ["c1"]
+    index.remove("chat", "c1")
+    assert ids(index.search("popravljeno", {"user:u1"})) == []
+    assert index.total_length == sum(entry["length"] for entry in index.documents.values())
+
+
+def test_kinds_filter():
+    index = make_index()
+    result = index.search("pozar", {"all", "group:DVD_Kneginec_operational"}, kinds={"chat"})
+    assert ids(result) == ["c2"]
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self.docs:
+            yield dict(doc)
+
+
+class FakeCollection:
+    """find/find_one/insert_one by equality, plus the $gt/$ne the change feed uses"""
+
+    def __init__(self, docs=()):
+        self.docs = [dict(doc) for doc in docs]
+
+    @staticmethod
+    def matches(doc, query):
+        for key, condition in query.items():
+            if isinstance(condition, dict):
+                if "$gt" in condition and not doc.get(key) > condition["$gt"]:
+                    return False
+                if "$ne" in condition and doc.get(key) == condition["$ne"]:
+                    return False
+            elif doc.get(key) != condition:
+                return False
+        return True
+
+    def find(self, query=None, projection=None):
+        return FakeCursor([doc for doc in self.docs if self.matches(doc, query or {})])
+
+    async def find_one(self, query, projection=None):
+        return next((dict(doc) for doc in self.docs if self.matches(doc, query)), None)
+
+    async def insert_one(self, doc):
+        self.docs.append(dict(doc))
+
+
+class FakeDatabase(dict):
+    def __missing__(self, name):
+        collection = self[name] = FakeCollection()
+        return collection
+
+    __getattr__ = dict.__getitem__
+
+
+def test_refresh_picks_up_other_workers_changes(monkeypatch):
+    database = FakeDatabase()
+    monkeypatch.setattr(server, "db", database)
+    monkeypatch.setattr(server, "search_index", server.SearchIndex())
+    asyncio.run(server.rebuild_search_index())
+
+    # Another worker stores an alert and deletes a piece of equipment
+    database.messages.docs.append({"id": "m9", "title": "Uzbuna", "content": "Požar u Preloku",
+                                   "sent_to_departments": ["all"], "created_at": datetime(2024, 5, 9)})
+    server.search_index.upsert("equipment", {"id": "e1", "name": "Motorna pila", "department": "DVD_Kneginec"})
+    now = datetime.now(timezone.utc)
+    database.search_changes.docs += [{"kind": "message", "id": "m9", "worker": "other", "at": now},
+                                     {"kind": "equipment", "id": "e1", "worker": "other", "at": now}]
+
+    asyncio.run(server.refresh_search_index())
+    assert ids(server.search_index.search("prelok", {"all"})) == ["m9"]
+    assert ids(server.search_index.search("pila", {"vzo"})) == []
+
+
+def test_writes_are_logged_and_stale_worker_rebuilds(monkeypatch):
+    database = FakeDatabase()
+    monkeypatch.setattr(server, "db", database)
+    monkeypatch.setattr(server, "search_index", server.SearchIndex())
+    asyncio.run(server.index_search_document("message", {
+        "id": "m1", "title": "Vježba", "content": "Požar", "sent_to_departments": ["all"],
+        "created_at": datetime(2024, 5, 1)}))
+    assert database.search_changes.docs[0]["worker"] == server._search_worker_id
+
+    monkeypatch.setattr(server, "_search_index_synced_at",
+                        datetime.now(timezone.utc) - server.SEARCH_CHANGE_RETENTION - timedelta(minutes=1))
+    asyncio.run(server.refresh_search_index())
+    # Nothing in the (fake) messages collection, so the rebuild drops the unsaved document
+    assert ids(server.search_index.search("pozar", {"all"})) == []
@@ -0,0 +1,59 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import server
+
+
+def alert(i, created_at):
+    return {"id": f"m{i}", "message_type": "alert", "title": "Uzbuna", "content": "Požar", "sent_by": "u0",
+            "sent_by_name": "Dežurni", "sent_to_departments": ["all"], "created_at": created_at}
+
+
+def member():
+    return server.User(username="ivan", email="ivan@example.com", full_name="Ivan Horvat", department="DVD_Cakovec")
+
+
+def run_sync(monkeypatch, alerts, chat=()):
+    async def unread(user_id):
+        return 0
+
+    async def sync_alerts(user, since):
+        return [a for a in alerts if a["created_at"] > since.replace(tzinfo=None)][:server.SYNC_LIMIT]
+
+    async def sync_chat(user, since):
+        return list(chat)
+
+    monkeypatch.setattr(server, "get_unread_private", unread)
+    monkeypatch.setattr(server, "_sync_alerts", sync_alerts)
+    monkeypatch.setattr(server, "_sync_chat", sync_chat)
+
+    def call(cursor):
+        return asyncio.run(server.sync(cursor=cursor, current_user=member()))
+    return call
+
+
+def test_burst_is_paged_without_losing_alerts(monkeypatch):
+    start = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(minutes=1)
+    alerts = [alert(i, start + timedelta(milliseconds=10 * i)) for i in range(250)]
+    call = run_sync(monkeypatch, alerts)
+
+    cursor = server._encode_sync_cursor(start - timedelta(seconds=1))
+    received = set()
+    for _ in range(10):
+        result = call(cursor)
+        received.update(m.id for m in result["messages"])
+        cursor = result["cursor"]
+        if not result["has_more"]["messages"]:
+            break
+    assert received == {a["id"] for a in alerts}
+
+
+def test_cursor_stops_at_last_returned_alert(monkeypatch):
+    start = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(minutes=1)
+    alerts = [alert(i, start + timedelta(seconds=i / 10)) for i in range(server.SYNC_LIMIT + 5)]
+    call = run_sync(monkeypatch, alerts)
+
+    result = call(server._encode_sync_cursor(start - timedelta(seconds=1)))
+    assert result["has_more"]["messages"]
+    last = alerts[server.SYNC_LIMIT - 1]["created_at"].replace(tzinfo=timezone.utc)
+    assert server._decode_sync_cursor(result["cursor"]) < last